@@ -0,0 +1,118 @@
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+
+"""
+Compare the orders of the neighbors searches (query_order option) of filters.radius_assign and
+filters.grid_decimation_deprecated on a point cloud: for each filter and each order, the wall time
+of the pipeline (and its cache misses with --perf, measured with `perf stat`) is reported, minus
+the ones of the pipeline without the filter.
+"""
+
+ORDERS = ["file", "morton"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Benchmark the query_order option of the filters")
+    parser.add_argument("--input_las", "-i", type=str, required=True, help="Input las file")
+    parser.add_argument(
+        "--condition_src",
+        type=str,
+        default="Classification==2",
+        help="pdal condition for the source points of radius_assign",
+    )
+    parser.add_argument(
+        "--condition_ref",
+        type=str,
+        default="Classification==4 || Classification==5",
+        help="pdal condition for the reference points of radius_assign",
+    )
+    parser.add_argument("--radius", type=float, default=1, help="radius of radius_assign")
+    parser.add_argument(
+        "--resolution", type=float, default=0.5, help="resolution of grid_decimation"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="number of runs of each configuration"
+    )
+    parser.add_argument(
+        "--perf", action="store_true", help="measure the cache misses with `perf stat`"
+    )
+    return parser.parse_args()
+
+
+def filter_stages(args, query_order):
+    return {
+        "radius_assign": [
+            {
+                "type": "filters.radius_assign",
+                "src_where": args.condition_src,
+                "ref_where": args.condition_ref,
+                "radius": args.radius,
+                "output_dimension": "radius_search",
+                "query_order": query_order,
+            }
+        ],
+        "grid_decimation": [
+            {
+                "type": "filters.grid_decimation_deprecated",
+                "resolution": args.resolution,
+                "output_type": "max",
+                "output_dimension": "grid",
+                "query_order": query_order,
+            }
+        ],
+    }
+
+
+def run_pipeline(stages, use_perf):
+    """Run a pipeline with the pdal application, return (wall time, cache misses or None)"""
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete_on_close=False) as pipeline_file:
+        json.dump(stages, pipeline_file)
+        pipeline_file.close()
+
+        command = ["pdal", "pipeline", pipeline_file.name]
+        if use_perf:
+            command = ["perf", "stat", "-x", ",", "-e", "cache-misses"] + command
+        start = time.perf_counter()
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+        wall_time = time.perf_counter() - start
+
+    cache_misses = None
+    if use_perf:
+        # csv output of perf stat on stderr: value,unit,event,...
+        for line in result.stderr.splitlines():
+            fields = line.split(",")
+            if len(fields) > 2 and fields[2].startswith("cache-misses") and fields[0].isdigit():
+                cache_misses = int(fields[0])
+    return wall_time, cache_misses
+
+
+def best_run(stages, repeat, use_perf):
+    runs = [run_pipeline(stages, use_perf) for _ in range(repeat)]
+    wall_time = min(run[0] for run in runs)
+    cache_misses = min(run[1] for run in runs) if use_perf else None
+    return wall_time, cache_misses
+
+
+def main(args):
+    use_perf = args.perf and shutil.which("perf") is not None
+    if args.perf and not use_perf:
+        print("perf not found: the cache misses are not measured")
+
+    reader = [{"type": "readers.las", "filename": args.input_las}]
+    base_time, base_misses = best_run(reader, args.repeat, use_perf)
+
+    print(f"{'filter':>16} {'order':>7} {'time (s)':>9} {'cache misses':>13}")
+    for name in filter_stages(args, "file"):
+        for order in ORDERS:
+            stages = reader + filter_stages(args, order)[name]
+            wall_time, cache_misses = best_run(stages, args.repeat, use_perf)
+            misses = f"{cache_misses - base_misses:>13}" if use_perf else f"{'-':>13}"
+            print(f"{name:>16} {order:>7} {wall_time - base_time:>9.3f} {misses}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
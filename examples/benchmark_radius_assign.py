@@ -0,0 +1,97 @@
+import argparse
+import time
+
+import pdal
+
+"""
+Compare the spatial indexes of filters.radius_assign (kdtree/grid) on a point cloud:
+for each configuration, the time of the pipeline is measured with and without the
+radius_assign filter, and the difference is reported.
+"""
+
+CONFIGURATIONS = [
+    # (radius, is3d, max2d_above, max2d_below)
+    (1, False, -1, -1),
+    (1, False, 0.5, 0.5),
+    (1.5, False, -1, 0),
+    (1, True, -1, -1),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Benchmark the spatial indexes of filters.radius_assign")
+    parser.add_argument("--input_las", "-i", type=str, required=True, help="Input las file")
+    parser.add_argument(
+        "--condition_src",
+        type=str,
+        default="Classification==2",
+        help="pdal condition for the source points",
+    )
+    parser.add_argument(
+        "--condition_ref",
+        type=str,
+        default="Classification==4 || Classification==5",
+        help="pdal condition for the reference points",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="number of runs of each configuration"
+    )
+    parser.add_argument("--threads", type=int, default=1, help="threads option of the filter")
+    return parser.parse_args()
+
+
+def build_pipeline(input_las, condition_src, condition_ref, radius_assign_options=None):
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=input_las)
+    pipeline |= pdal.Filter.ferry(dimensions="=>SRC_DOMAIN, =>REF_DOMAIN")
+    pipeline |= pdal.Filter.assign(
+        value=[f"SRC_DOMAIN = 1 WHERE {condition_src}", f"REF_DOMAIN = 1 WHERE {condition_ref}"]
+    )
+    if radius_assign_options is not None:
+        pipeline |= pdal.Filter.radius_assign(
+            src_domain="SRC_DOMAIN",
+            reference_domain="REF_DOMAIN",
+            output_dimension="radius_search",
+            **radius_assign_options,
+        )
+    return pipeline
+
+
+def best_time(pipeline_builder, repeat):
+    times = []
+    for _ in range(repeat):
+        pipeline = pipeline_builder()
+        start = time.perf_counter()
+        pipeline.execute()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(input_las, condition_src, condition_ref, repeat, threads):
+    base_time = best_time(lambda: build_pipeline(input_las, condition_src, condition_ref), repeat)
+    print(
+        f"{'radius':>6} {'is3d':>5} {'above':>6} {'below':>6} {'kdtree (s)':>11} {'grid (s)':>9}"
+    )
+    for radius, is3d, max2d_above, max2d_below in CONFIGURATIONS:
+        times = {}
+        for index in ["kdtree", "grid"]:
+            options = dict(
+                radius=radius,
+                is3d=is3d,
+                max2d_above=max2d_above,
+                max2d_below=max2d_below,
+                index=index,
+                threads=threads,
+            )
+            total_time = best_time(
+                lambda: build_pipeline(input_las, condition_src, condition_ref, options), repeat
+            )
+            times[index] = total_time - base_time
+        print(
+            f"{radius:>6} {str(is3d):>5} {max2d_above:>6} {max2d_below:>6} "
+            f"{times['kdtree']:>11.3f} {times['grid']:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(**vars(args))
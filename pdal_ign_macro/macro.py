@@ -1,3 +1,7 @@
+import json
+import re
+from collections import Counter
+
 import pdal
 
 """
@@ -14,10 +18,13 @@ def add_radius_assign(
     condition_out: str,
     max2d_above: float = -1,
     max2d_below: float = -1,
+    index_cache_size: int = 0,
+    src_bounds: str = "",
 ) -> pdal.Pipeline:
     """
-    Search points from "condition_src" that are closer than "radius_search" from points that
+    Search points from "condition_src" that are closer than "radius" from points that
     belong to "condition_ref" and modify them with "condition_out"
+    (a single filters.radius_assign stage, with no temporary dimension)
 
     This combination is equivalent to the CloseBy macro of TerraScan
 
@@ -31,31 +38,138 @@ def add_radius_assign(
             have a point from "condition_ref" closer than "radius" (eg. "Classification==2")
         max2d_above (float, optional): In case of 2d Search, upward limit for potential neighbors. Defaults to -1.
         max2d_below (float, optional):  In case of 2d Search, downward limit for potential neighbors. Defaults to -1.
+        index_cache_size (int, optional): memory (in MB) of the cache of indexes shared by the radius_assign
+            stages of the pipeline, for the stages with the same reference points. Defaults to 0 (no cache).
+        src_bounds (str, optional): 2d bounds "([xmin, xmax], [ymin, ymax])" of the points of "condition_src"
+            that are searched (the other ones are only potential neighbors). Defaults to "" (no bounds).
 
     Returns:
         pdal.Pipeline: output pipeline with the radius_assign steps added.
     """
 
-    pipeline |= pdal.Filter.ferry(dimensions="=>REF_DOMAIN, =>SRC_DOMAIN, =>radius_search")
-    pipeline |= pdal.Filter.assign(
-        value=[
-            "SRC_DOMAIN = 0",
-            f"SRC_DOMAIN = 1 WHERE {condition_src}",
-            "REF_DOMAIN = 0",
-            f"REF_DOMAIN = 1 WHERE {condition_ref}",
-            "radius_search = 0",
-        ]
-    )
     pipeline |= pdal.Filter.radius_assign(
         radius=radius,
-        src_domain="SRC_DOMAIN",
-        reference_domain="REF_DOMAIN",
-        output_dimension="radius_search",
+        src_where=condition_src,
+        ref_where=condition_ref,
+        value=condition_out,
+        is3d=search_3d,
+        max2d_above=max2d_above,
+        max2d_below=max2d_below,
+        index_cache_size=index_cache_size,
+        **({"src_bounds": src_bounds} if src_bounds else {}),
+    )
+    return pipeline
+
+
+def radius_assign_rule(
+    radius: float,
+    search_3d: bool,
+    condition_src: str,
+    condition_ref: str,
+    condition_out: str,
+    max2d_above: float = -1,
+    max2d_below: float = -1,
+    src_bounds: str = "",
+) -> dict:
+    """
+    Rule of add_radius_assign_multi, with the arguments of add_radius_assign
+
+    Returns:
+        dict: rule of filters.radius_assign_multi
+    """
+    rule = dict(
+        radius=radius,
+        is3d=search_3d,
+        src_where=condition_src,
+        ref_where=condition_ref,
+        value=condition_out,
+        max2d_above=max2d_above,
+        max2d_below=max2d_below,
+    )
+    if src_bounds:
+        rule["src_bounds"] = src_bounds
+    return rule
+
+
+def add_radius_assign_multi(pipeline: pdal.Pipeline, rules: list) -> pdal.Pipeline:
+    """
+    Apply a list of rules (from radius_assign_rule) in order, with a single
+    filters.radius_assign_multi stage: the result is the one of a add_radius_assign for each rule,
+    but the successive rules that don't use the output of each other are searched in the same scan
+    of the points, and the rules with the same reference points and radius share their index
+
+    Args:
+        pipeline (pdal.Pipeline): pdal pipeline
+        rules (list): rules built by radius_assign_rule
+
+    Returns:
+        pdal.Pipeline: output pipeline with the radius_assign_multi step added.
+    """
+    pipeline |= pdal.Filter.radius_assign_multi(rules=json.dumps(rules))
+    return pipeline
+
+
+def add_radius_opening(
+    pipeline: pdal.Pipeline,
+    radius: float,
+    search_3d: bool,
+    condition_src: str,
+    condition_ref: str,
+    dimension: str,
+    cleanup_radius: float,
+    max2d_above: float = -1,
+    max2d_below: float = -1,
+    cleanup_max2d_above: float = -1,
+    cleanup_max2d_below: float = -1,
+    condition_cleanup: str = "",
+    src_bounds: str = "",
+) -> pdal.Pipeline:
+    """
+    Mark with "dimension"=1 the points from "condition_src" that are closer than "radius" from points
+    that belong to "condition_ref", then unmark ("dimension"=0) the marked points from "condition_cleanup"
+    that are closer than "cleanup_radius" from unmarked points from "condition_cleanup"
+
+    This is equivalent to (with a single filters.radius_opening stage):
+        add_radius_assign(pipeline, radius, search_3d, condition_src, condition_ref, f"{dimension}=1",
+                          max2d_above, max2d_below)
+        add_radius_assign(pipeline, cleanup_radius, search_3d,
+                          f"{dimension}==1 && ({condition_cleanup})", f"{dimension}==0 && ({condition_cleanup})",
+                          f"{dimension}=0", cleanup_max2d_above, cleanup_max2d_below)
+
+    Args:
+        pipeline (pdal.Pipeline): pdal pipeline
+        radius (float): search distance for the marking
+        search_3d (bool): the distance research is in 3d if True (2d otherwise)
+        condition_src (str): pdal condition for the points that can be marked (eg. "Classification==2")
+        condition_ref (str): pdal condition for the potential neighbors of the marking (eg. "Classification==4")
+        dimension (str): marker dimension
+        cleanup_radius (float): search distance for the cleanup
+        max2d_above (float, optional): In case of 2d Search, upward limit for the marking. Defaults to -1.
+        max2d_below (float, optional): In case of 2d Search, downward limit for the marking. Defaults to -1.
+        cleanup_max2d_above (float, optional): In case of 2d Search, upward limit for the cleanup. Defaults to -1.
+        cleanup_max2d_below (float, optional): In case of 2d Search, downward limit for the cleanup. Defaults to -1.
+        condition_cleanup (str, optional): pdal condition for the points of the cleanup. Defaults to condition_src.
+        src_bounds (str, optional): 2d bounds "([xmin, xmax], [ymin, ymax])" of the points whose marker is
+            computed (the other ones are only potential neighbors). Defaults to "" (no bounds).
+
+    Returns:
+        pdal.Pipeline: output pipeline with the radius_opening step added.
+    """
+
+    pipeline |= pdal.Filter.radius_opening(
+        src_where=condition_src,
+        ref_where=condition_ref,
+        output_dimension=dimension,
+        radius=radius,
         is3d=search_3d,
         max2d_above=max2d_above,
         max2d_below=max2d_below,
+        cleanup_where=condition_cleanup or condition_src,
+        cleanup_radius=cleanup_radius,
+        cleanup_max2d_above=cleanup_max2d_above,
+        cleanup_max2d_below=cleanup_max2d_below,
+        **({"src_bounds": src_bounds} if src_bounds else {}),
     )
-    pipeline |= pdal.Filter.assign(value=condition_out, where="radius_search==1")
     return pipeline
 
 
@@ -94,3 +208,175 @@ def build_condition(key, values):
             condition += " || "
     condition += ")"
     return condition
+
+
+class ClassMask:
+    """
+    Table of classes of a filters.class_mask stage, which writes a bitmask of the class of each
+    point (bit i for the i-th class of the table): a condition on a set of classes of the table is
+    then a single bitwise and, instead of a chain of comparisons.
+
+    The bit tests are supported by the expressions of the plugin filters (radius_assign,
+    radius_opening, grid_decimation_multi), not by the PDAL ones (e.g. filters.assign): use
+    build_condition there.
+
+    The mask is computed from the classification of the points when the stage runs: it is only
+    valid until a stage changes the classification. reassign_classification_for_digital_model
+    does not use it: its conditions on sets of classes are in filters.gridDecimation (a PDAL
+    filter) or follow a change of the classification, so each one would need its own class_mask
+    stage, a scan of the points to save a single chain of comparisons.
+
+    Args:
+        classes (list): table of the classes (at most 32)
+        dimension (str, optional): name of the mask dimension. Defaults to "ClassMask".
+    """
+
+    def __init__(self, classes, dimension="ClassMask"):
+        if len(classes) > 32:
+            raise ValueError(f"Too many classes for a class mask: {len(classes)}, at most 32")
+        self.classes = list(classes)
+        self.dimension = dimension
+
+    def add_stage(self, pipeline: pdal.Pipeline) -> pdal.Pipeline:
+        """Add the filters.class_mask stage which writes the mask dimension"""
+        pipeline |= pdal.Filter.class_mask(classes=self.classes, output_dimension=self.dimension)
+        return pipeline
+
+    def condition(self, classes) -> str:
+        """
+        build '(mask & bits)', true for the points of one of the classes (which must be in the table)
+        """
+        missing = [c for c in classes if c not in self.classes]
+        if missing:
+            raise ValueError(f"Classes {missing} are not in the table of the class mask")
+        bits = sum(1 << self.classes.index(c) for c in set(classes))
+        return f"({self.dimension} & {bits})"
+
+
+class PipelinePlan:
+    """
+    Stages recorded as on a pdal.Pipeline (`plan |= stage`, so that the macros can be applied to a
+    plan), then optimized into a minimal pdal.Pipeline with the same result:
+        - adjacent filters.assign stages are merged into a single stage (the values are applied in
+          order on each point, as by the successive stages)
+        - the ferry entries "=>dim" of dimensions that already exist are dropped, and adjacent
+          ferries are merged
+        - the "dim=0" values on dimensions which are already 0 on all the points are dropped (a
+          dimension created by a ferry is 0 if it is not in the input dimensions)
+
+    The stages that are neither assigns nor ferries are kept as they are, and may write any
+    dimension.
+
+    Args:
+        input_dimensions (list, optional): dimensions of the input points, if they are known.
+            Defaults to None (unknown: a dimension created by a ferry may already have values).
+    """
+
+    def __init__(self, input_dimensions=None):
+        self.stages = []
+        self.input_dimensions = None if input_dimensions is None else set(input_dimensions)
+
+    def __or__(self, stage):
+        self.stages.append(stage)
+        return self
+
+    def optimized_stages(self) -> list:
+        """Stages of the optimized pipeline"""
+        stages = []
+        existing = set(self.input_dimensions or [])  # dimensions known to exist
+        zeros = set()  # dimensions known to be 0 on all the points
+        for stage in self.stages:
+            options = _stage_options(stage)
+
+            if stage.type == "filters.ferry" and options.keys() == {"dimensions"}:
+                entries = []
+                for entry in _split_list(options["dimensions"]):
+                    source, _, target = (part.strip() for part in entry.partition("=>"))
+                    if source:
+                        zeros.discard(target)
+                    elif target in existing:
+                        continue
+                    elif self.input_dimensions is not None:
+                        zeros.add(target)
+                    existing.add(target)
+                    entries.append(entry)
+                if not entries:
+                    continue
+                if stages and stages[-1].type == "filters.ferry":
+                    entries = _split_list(_stage_options(stages.pop())["dimensions"]) + entries
+                stages.append(pdal.Filter.ferry(dimensions=", ".join(entries)))
+
+            elif stage.type == "filters.assign" and options.keys() == {"value"}:
+                values = []
+                for value in _as_list(options["value"]):
+                    dimension, expression, condition = _parse_assignment(value)
+                    if dimension is None:
+                        zeros.clear()
+                    elif expression == 0 and condition is None:
+                        if dimension in zeros:
+                            continue
+                        zeros.add(dimension)
+                    else:
+                        zeros.discard(dimension)
+                    values.append(value)
+                if not values:
+                    continue
+                if stages and stages[-1].type == "filters.assign":
+                    values = _as_list(_stage_options(stages.pop())["value"]) + values
+                stages.append(pdal.Filter.assign(value=values))
+
+            else:
+                zeros.clear()
+                stages.append(stage)
+        return stages
+
+    def pipeline(self) -> pdal.Pipeline:
+        """Optimized pipeline"""
+        pipeline = pdal.Pipeline()
+        for stage in self.optimized_stages():
+            pipeline |= stage
+        return pipeline
+
+    def explain(self) -> str:
+        """Number of stages of the recorded and of the optimized pipeline, in total and by type"""
+        before = Counter(stage.type for stage in self.stages)
+        after = Counter(stage.type for stage in self.optimized_stages())
+        lines = [f"{sum(before.values())} stages -> {sum(after.values())} stages"]
+        lines += [
+            f"    {stage_type}: {before[stage_type]} -> {after[stage_type]}"
+            for stage_type in before
+            if before[stage_type] != after[stage_type]
+        ]
+        return "\n".join(lines)
+
+
+def _stage_options(stage):
+    """Options of a pdal stage, without its type"""
+    return {key: value for key, value in stage.options.items() if key != "type"}
+
+
+def _as_list(value):
+    """Items of a list option, given as a list or as a single string"""
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _split_list(value):
+    """Items of a list option, given as a list or as a comma separated string"""
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    return list(value)
+
+
+def _parse_assignment(value):
+    """(dimension, expression, condition) of a "dim = expression [WHERE condition]" value of
+    filters.assign. The expression is returned as a number if it is a number, the condition is
+    None without WHERE, and all are None if the value can't be parsed"""
+    match = re.fullmatch(r"\s*(\w+)\s*=\s*(.*?)(?:\s+WHERE\s+(.*))?\s*", value, re.I | re.S)
+    if match is None:
+        return None, None, None
+    dimension, expression, condition = match.groups()
+    try:
+        expression = float(expression)
+    except ValueError:
+        pass
+    return dimension, expression, condition
@@ -1,10 +1,14 @@
 import argparse
-import shutil
+import base64
+import json
 import tempfile
+from pathlib import Path
 
+import laspy
+import numpy as np
 import pdal
-from pdaltools.las_add_buffer import run_on_buffered_las
-from pdaltools.las_remove_dimensions import remove_dimensions_from_las
+from pdaltools.las_add_buffer import ORIGINAL_TILE_TAG, create_las_with_buffer
+from pdaltools.las_info import get_buffered_bounds_from_filename
 
 from pdal_ign_macro import macro
 
@@ -85,12 +89,88 @@ def parse_args(argv=None):
         required=False,
         help="reset tags at the beginning of the process"
     )
+    parser.add_argument(
+        "--core_only_sources",
+        action="store_true",
+        help="If set (when running with a buffer), the buffer points are only evaluated where they "
+        + "can change the output of the original tile (same output, faster)",
+    )
+    parser.add_argument(
+        "--native_filter",
+        action="store_true",
+        help="If set, mark the points with a single filters.mnx_marking stage instead of the chain "
+        + "of PDAL stages (same markers, faster)",
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        type=str,
+        default=None,
+        help="Directory of the temporary files (the input with its buffer), instead of the default "
+        + "temporary directory of the system",
+    )
 
     return parser.parse_args(argv)
 
 
-def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension, reset_tags):
-    pipeline = pdal.Pipeline() | pdal.Reader.las(input_las)
+class SourceBounds:
+    """Bounds of the source points of the successive spatial stages of the marking pipeline
+
+    On a buffered tile, the output of the core tile for a stage only depends on the points closer
+    than the reach of the stage (radius of a radius_assign, radius + cleanup_radius of a
+    radius_opening, resolution of a grid decimation): the source points of a stage are limited to
+    the core tile grown by the reach of the next stages, the other points are only references.
+
+    Without core bounds, the stages are not limited and their reaches are summed up in `reach`.
+    """
+
+    def __init__(self, core_bounds=None, reach=0):
+        self.core_bounds = core_bounds
+        self.reach = reach
+
+    def next(self, stage_reach: float) -> str:
+        """src_bounds of the next stage of the pipeline ("" without core bounds)"""
+        if self.core_bounds is None:
+            self.reach += stage_reach
+            return ""
+
+        self.reach -= stage_reach
+        # 1m more, so that the rounding of the coordinates and of the sums does not matter
+        margin = max(self.reach, 0) + 1
+        (xmin, xmax), (ymin, ymax) = self.core_bounds
+        return f"([{xmin - margin}, {xmax + margin}], [{ymin - margin}, {ymax + margin}])"
+
+    def options(self, stage_reach: float) -> dict:
+        """src_bounds option of the next stage, for the filters that are not added with macro"""
+        bounds = self.next(stage_reach)
+        return {"src_bounds": bounds} if bounds else {}
+
+
+def define_marking_pipeline(
+    input_las, output_las, dsm_dimension, dtm_dimension, reset_tags, core_bounds=None
+):
+    """Define the marking pipeline. With core_bounds ([xmin, xmax], [ymin, ymax]) of the core
+    tile of a buffered input, the buffer points are only evaluated as source points where they
+    can change the output of the core tile. Without output_las, the pipeline has no writer.
+    Returns the pipeline and the temporary dimensions added to the points, with their PDAL type"""
+    src_bounds = SourceBounds()
+    pipeline, temporary_dimensions = build_marking_pipeline(
+        input_las, output_las, dsm_dimension, dtm_dimension, reset_tags, src_bounds
+    )
+    if core_bounds is None:
+        return pipeline, temporary_dimensions
+
+    # the first definition gives the reach of all the stages
+    src_bounds = SourceBounds(core_bounds, src_bounds.reach)
+    return build_marking_pipeline(
+        input_las, output_las, dsm_dimension, dtm_dimension, reset_tags, src_bounds
+    )
+
+
+def build_marking_pipeline(
+    input_las, output_las, dsm_dimension, dtm_dimension, reset_tags, src_bounds
+):
+    # the stages are recorded in a plan, whose adjacent assigns are merged in the returned pipeline
+    pipeline = macro.PipelinePlan() | pdal.Reader.las(input_las)
 
     # 0 - ajout de dimensions temporaires et de sortie
     temporary_dimensions = [
@@ -105,6 +185,11 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
 
     pipeline |= pdal.Filter.ferry(dimensions="=>" + ", =>".join(added_dimensions))
 
+    # masque des classes, pour tester l'appartenance à une liste de classes en une seule opération
+    # dans les conditions des filtres radius_assign, radius_opening et grid_decimation_multi
+    class_mask = macro.ClassMask([2, 3, 4, 5, 6, 9, 17, 67], "PT_CLASS_MASK")
+    pipeline = class_mask.add_stage(pipeline)
+
     if reset_tags:
         # Reset each tag dimension to 0
         for tag_dimension in added_dimensions:
@@ -124,46 +209,30 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
         value=["PT_VEG_DSM = 1 WHERE " + macro.build_condition("Classification", [4, 5])]
     )
     # 1.2 bouche trou : assigne les points sol à l'intérieur de la veget (4,5)
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         1,
         False,
         condition_src="Classification==2",
-        condition_ref=macro.build_condition("Classification", [4, 5]),
-        condition_out="PT_VEG_DSM=1",
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1,
-        False,
-        condition_src="PT_VEG_DSM==1 && Classification==2",
-        condition_ref="Classification==2 && PT_VEG_DSM==0",
-        condition_out="PT_VEG_DSM=0",
+        condition_ref=class_mask.condition([4, 5]),
+        dimension="PT_VEG_DSM",
+        cleanup_radius=1,
+        src_bounds=src_bounds.next(1 + 1),
     )
     # 1.3 Isolement en PT_UNDER_VEGET=1 des éléments sous la végétation (hors sol)
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         1,
         False,
-        condition_src=macro.build_condition("Classification", [6, 9, 17, 67]),
-        condition_ref=macro.build_condition("Classification", [4, 5]),
-        condition_out="PT_UNDER_VEGET=1",
+        condition_src=class_mask.condition([6, 9, 17, 67]),
+        condition_ref=class_mask.condition([4, 5]),
+        dimension="PT_UNDER_VEGET",
+        cleanup_radius=1,
         max2d_above=-1,
         max2d_below=0,
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1,
-        False,
-        condition_src="PT_UNDER_VEGET==1 && ( "
-        + macro.build_condition("Classification", [6, 9, 17, 67])
-        + " )",
-        condition_ref="PT_UNDER_VEGET==0 && ( "
-        + macro.build_condition("Classification", [6, 9, 17, 67])
-        + " )",
-        condition_out="PT_UNDER_VEGET=0",
-        max2d_above=0.5,
-        max2d_below=0.5,
+        cleanup_max2d_above=0.5,
+        cleanup_max2d_below=0.5,
+        src_bounds=src_bounds.next(1 + 1),
     )
     # 1.4 selection des points de veget basse proche de la veget haute
     pipeline = macro.add_radius_assign(
@@ -173,13 +242,10 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
         condition_src="Classification==3",
         condition_ref="Classification==5",
         condition_out="PT_VEG_DSM=1",
+        src_bounds=src_bounds.next(1),
     )
-    # 1.5 Premiers points tagués pour le MNS
-    # max des points de veget (PT_VEG_DSM==1) sur une grille régulière :
-    # TODO: remplacer par GridDecimation une fois le correctif mergé dans PDAL
-    pipeline |= pdal.Filter.grid_decimation_deprecated(
-        resolution=0.75, output_dimension=dsm_dimension, output_type="max", where="PT_VEG_DSM==1"
-    )
+    # 1.5 Premiers points tagués pour le MNS : max des points de veget (PT_VEG_DSM==1) sur une grille
+    # régulière, calculé avec les grilles de l'étape 3 (les étapes 2.x ne lisent ni n'écrivent ces dimensions)
     ###################################################################################################################
     # 2 - Gestion de l'eau
     ###################################################################################################################
@@ -187,42 +253,30 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
     #       Gestion de l'eau sur les masques hydro qui ne doivent pas se supperposer aux points virtuels 66
 
     # 2.1 L'eau sous la roche
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         1.25,
         False,
         condition_src="Classification==9",
         condition_ref="Classification==2",
-        condition_out="PT_ON_SOL=1",
+        dimension="PT_ON_SOL",
+        cleanup_radius=1,
         max2d_above=-1,
         max2d_below=0,
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1,
-        False,
-        condition_src="PT_ON_SOL==1",
-        condition_ref="PT_ON_SOL==0 && Classification==9",
-        condition_out="PT_ON_SOL=0",
-        max2d_above=0.5,
-        max2d_below=0.5,
+        cleanup_max2d_above=0.5,
+        cleanup_max2d_below=0.5,
+        src_bounds=src_bounds.next(1.25 + 1),
     )
     # 2.2 Gestion de l'eau sur les masques hydro
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         1,
         False,
         condition_src="Classification==9",
         condition_ref="Classification==66",
-        condition_out="PT_ON_VIRT=1",
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1,
-        False,
-        condition_src="PT_ON_VIRT==1 && Classification==9",
-        condition_ref="PT_ON_VIRT==0 && Classification==9",
-        condition_out="PT_ON_VIRT=0",
+        dimension="PT_ON_VIRT",
+        cleanup_radius=1,
+        src_bounds=src_bounds.next(1 + 1),
     )
     ###################################################################################################################
     # 3 - sélection des premiers points pour MNT et MNS
@@ -230,93 +284,106 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
     #       Initialisation pour le MNT
     #       Initialisation pour le MNS
 
-    # 3.1 Pour le MNT (le point sol max sur une grille de 50cm)
-    # TODO: remplacer par GridDecimation une fois le correctif mergé dans PDAL
-    pipeline |= pdal.Filter.grid_decimation_deprecated(
-        resolution=0.5,
-        output_dimension=dtm_dimension,
-        output_type="max",
-        where="(Classification==2)",
-    )
-    # 3.2 Pour les MNS (Pour le moment: Les bâtis, ponts, veget)
+    # Les grilles sont calculées par un seul filtre, dans l'ordre (en 2 passes, car 3.2 lit la sortie de 1.5)
     # TODO: remplacer par GridDecimation une fois le correctif mergé dans PDAL
-    pipeline |= pdal.Filter.grid_decimation_deprecated(
-        resolution=0.5,
-        output_dimension=dsm_dimension,
-        output_type="max",
-        where="(PT_UNDER_VEGET==0 && ("
-        + macro.build_condition("Classification", [6, 17, 67])
-        + f") || {dsm_dimension}==1)",
-    )
-    # 3.3 Pour les points "eau" on prendra le point le plus bas de la grille de 50cm et qui ne sont ni sous la roche ni près de pts virtuels
-    pipeline |= pdal.Filter.grid_decimation_deprecated(
-        resolution=0.5,
-        output_dimension=dtm_dimension,
-        output_type="min",
-        where="(PT_ON_SOL==0 && PT_ON_VIRT==0 && Classification==9)",
-    )
-    pipeline |= pdal.Filter.grid_decimation_deprecated(
-        resolution=0.5,
-        output_dimension=dsm_dimension,
-        output_type="min",
-        where="(PT_UNDER_VEGET==0 && PT_ON_SOL==0 && PT_ON_VIRT==0 && Classification==9)",
-    )
+    grids = [
+        # 1.5 max des points de veget (PT_VEG_DSM==1) sur une grille régulière
+        dict(
+            resolution=0.75,
+            output_dimension=dsm_dimension,
+            output_type="max",
+            where="PT_VEG_DSM==1",
+            **src_bounds.options(0.75),
+        ),
+        # 3.1 Pour le MNT (le point sol max sur une grille de 50cm)
+        dict(
+            resolution=0.5,
+            output_dimension=dtm_dimension,
+            output_type="max",
+            where="(Classification==2)",
+            **src_bounds.options(0.5),
+        ),
+        # 3.2 Pour les MNS (Pour le moment: Les bâtis, ponts, veget)
+        dict(
+            resolution=0.5,
+            output_dimension=dsm_dimension,
+            output_type="max",
+            where="(PT_UNDER_VEGET==0 && "
+            + class_mask.condition([6, 17, 67])
+            + f" || {dsm_dimension}==1)",
+            **src_bounds.options(0.5),
+        ),
+        # 3.3 Pour les points "eau" on prendra le point le plus bas de la grille de 50cm et qui ne sont ni sous la roche ni près de pts virtuels
+        dict(
+            resolution=0.5,
+            output_dimension=dtm_dimension,
+            output_type="min",
+            where="(PT_ON_SOL==0 && PT_ON_VIRT==0 && Classification==9)",
+            **src_bounds.options(0.5),
+        ),
+        dict(
+            resolution=0.5,
+            output_dimension=dsm_dimension,
+            output_type="min",
+            where="(PT_UNDER_VEGET==0 && PT_ON_SOL==0 && PT_ON_VIRT==0 && Classification==9)",
+            **src_bounds.options(0.5),
+        ),
+    ]
+    pipeline |= pdal.Filter.grid_decimation_multi(grids=json.dumps(grids))
     ###################################################################################################################
     # 4 - Gestion des points sol sous la veget, bâtis et ponts pour le MNS
     ###################################################################################################################
     #       On enlève les points sol sous la véget, le bati et les ponts du taguage pour les MNS
     #       Particularité de reprise des points sol au plus près des bâtiments
 
-    # 4.1 Isolement des points sols sous la véget, le bati et les ponts
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1.5,
-        False,
-        condition_src=f"{dtm_dimension}==1",
-        condition_ref=macro.build_condition("Classification", [4, 5, 6, 17, 67]),
-        condition_out=f"{dsm_dimension}=0",
-    )
-    # 4.2 Particularité de reprise des points sol au plus près des bâtiments
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1.25,
-        False,
-        condition_src="Classification==2 && PT_VEG_DSM==0",
-        condition_ref=macro.build_condition("Classification", [6, 67]),
-        condition_out="PT_CLOSED_BUILDING=1",
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1,
-        False,
-        condition_src=f"Classification==2 && {dsm_dimension}==0 && PT_CLOSED_BUILDING==1 && {dtm_dimension}==1",
-        condition_ref="Classification==2 && PT_CLOSED_BUILDING==0 && PT_VEG_DSM==0",
-        condition_out=f"{dsm_dimension}=1",
-    )
+    # Les règles 4.x sont appliquées par un seul filtre, dans l'ordre (en 2 passes : 4.1 et 4.2 sont
+    # indépendantes, 4.3 lit leurs sorties)
+    rules = [
+        # 4.1 Isolement des points sols sous la véget, le bati et les ponts
+        macro.radius_assign_rule(
+            1.5,
+            False,
+            condition_src=f"{dtm_dimension}==1",
+            condition_ref=class_mask.condition([4, 5, 6, 17, 67]),
+            condition_out=f"{dsm_dimension}=0",
+            src_bounds=src_bounds.next(1.5),
+        ),
+        # 4.2 Particularité de reprise des points sol au plus près des bâtiments
+        macro.radius_assign_rule(
+            1.25,
+            False,
+            condition_src="Classification==2 && PT_VEG_DSM==0",
+            condition_ref=class_mask.condition([6, 67]),
+            condition_out="PT_CLOSED_BUILDING=1",
+            src_bounds=src_bounds.next(1.25),
+        ),
+        macro.radius_assign_rule(
+            1,
+            False,
+            condition_src=f"Classification==2 && {dsm_dimension}==0 && PT_CLOSED_BUILDING==1 && {dtm_dimension}==1",
+            condition_ref="Classification==2 && PT_CLOSED_BUILDING==0 && PT_VEG_DSM==0",
+            condition_out=f"{dsm_dimension}=1",
+            src_bounds=src_bounds.next(1),
+        ),
+    ]
+    pipeline = macro.add_radius_assign_multi(pipeline, rules)
     ###################################################################################################################
     # 5 - Gestion des classes sous les ponts pour être détaguées pour le MNS dsm_dimension=0
     ###################################################################################################################
 
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         1.5,
         False,
-        condition_src=macro.build_condition("Classification", [2, 3, 4, 5, 6, 9, 67]),
+        condition_src=class_mask.condition([2, 3, 4, 5, 6, 9, 67]),
         condition_ref="Classification==17",
-        condition_out="PT_UNDER_BRIDGE=1",
+        dimension="PT_UNDER_BRIDGE",
+        cleanup_radius=1.25,
         max2d_above=-1,  # prendre les points (condition_src) qui on des points ponts au dessus d'eux (condition_ref)
         max2d_below=0,
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        1.25,
-        False,
-        condition_src="PT_UNDER_BRIDGE==1",
-        condition_ref="PT_UNDER_BRIDGE==0 && "
-        + macro.build_condition("Classification", [2, 3, 4, 5, 6, 9, 67]),
-        condition_out="PT_UNDER_BRIDGE=0",
-        max2d_above=0.5,
-        max2d_below=0.5,
+        cleanup_max2d_above=0.5,
+        cleanup_max2d_below=0.5,
+        src_bounds=src_bounds.next(1.5 + 1.25),
     )
     pipeline |= pdal.Filter.assign(value=[f"{dsm_dimension}=0 WHERE PT_UNDER_BRIDGE==1"])
 
@@ -340,21 +407,15 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
     # 7.1 Taguage pour les MNT des points virtuels ponts et eau
     pipeline |= pdal.Filter.assign(value=[f"{dtm_dimension}=1 WHERE Classification==66"])
     # 7.2 gestion des pts 66 "eau" sous le sursol
-    pipeline = macro.add_radius_assign(
+    pipeline = macro.add_radius_opening(
         pipeline,
         0.5,
         False,
         condition_src="Classification==66",
-        condition_ref=macro.build_condition("Classification", [4, 5, 6, 17, 67]),
-        condition_out="PT_UNDER_VEGET=1",
-    )
-    pipeline = macro.add_radius_assign(
-        pipeline,
-        0.5,
-        False,
-        condition_src="PT_UNDER_VEGET==1 && Classification==66",
-        condition_ref="PT_UNDER_VEGET==0 && Classification==66",
-        condition_out="PT_UNDER_VEGET=0",
+        condition_ref=class_mask.condition([4, 5, 6, 17, 67]),
+        dimension="PT_UNDER_VEGET",
+        cleanup_radius=0.5,
+        src_bounds=src_bounds.next(0.5 + 0.5),
     )
     # 7.3 Taguage pour les MNS des points virtuels eau seulement
     pipeline = macro.add_radius_assign(
@@ -364,6 +425,7 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
         condition_src="Classification==66",
         condition_ref="Classification==17",
         condition_out="PT_UNDER_BRIDGE=1",
+        src_bounds=src_bounds.next(0.5),
     )
     pipeline |= pdal.Filter.assign(
         value=[
@@ -379,13 +441,118 @@ def define_marking_pipeline(input_las, output_las, dsm_dimension, dtm_dimension,
     pipeline |= pdal.Filter.assign(value=[f"{dtm_dimension}=1 WHERE Classification==68"])
 
     ##################################################################################################################
-    # 9 - export du nuage et des DSM
+    # 9 - export du nuage
     ###################################################################################################################
-    pipeline |= pdal.Writer.las(
-        extra_dims="all", forward="all", filename=output_las, minor_version="4"
-    )
+    if output_las:
+        pipeline |= pdal.Writer.las(
+            extra_dims="all", forward="all", filename=output_las, minor_version="4"
+        )
+
+    temporary_types = dict.fromkeys(temporary_dimensions, "double")
+    temporary_types[class_mask.dimension] = "uint32"
+    return pipeline.pipeline(), temporary_types
+
 
-    return pipeline, temporary_dimensions
+def define_native_marking_pipeline(
+    input_las,
+    output_las,
+    dsm_dimension,
+    dtm_dimension,
+    reset_tags,
+    core_bounds=None,
+    keep_temporary_dimensions=False,
+):
+    """Same marking as define_marking_pipeline, with a single filters.mnx_marking stage. The
+    temporary dimensions are only added to the points with keep_temporary_dimensions (the
+    returned temporary dimensions are otherwise empty). Without output_las, the pipeline has no
+    writer"""
+    options = {}
+    if core_bounds is not None:
+        (xmin, xmax), (ymin, ymax) = core_bounds
+        options["src_bounds"] = f"([{xmin}, {xmax}], [{ymin}, {ymax}])"
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(input_las)
+    pipeline |= pdal.Filter.mnx_marking(
+        dsm_dimension=dsm_dimension,
+        dtm_dimension=dtm_dimension,
+        reset_tags=reset_tags,
+        keep_temporary_dimensions=keep_temporary_dimensions,
+        **options,
+    )
+    if output_las:
+        pipeline |= pdal.Writer.las(
+            extra_dims="all", forward="all", filename=output_las, minor_version="4"
+        )
+
+    temporary_dimensions = [
+        "PT_VEG_DSM",
+        "PT_UNDER_BRIDGE",
+        "PT_CLOSED_BUILDING",
+        "PT_UNDER_VEGET",
+        "PT_ON_SOL",
+        "PT_ON_VIRT",
+    ]
+    return pipeline, dict.fromkeys(
+        temporary_dimensions if keep_temporary_dimensions else [], "double"
+    )
+
+
+# PDAL types of the numpy types of the extra dimensions of a las file
+PDAL_TYPES = {
+    "i1": "int8",
+    "u1": "uint8",
+    "i2": "int16",
+    "u2": "uint16",
+    "i4": "int32",
+    "u4": "uint32",
+    "i8": "int64",
+    "u8": "uint64",
+    "f4": "float",
+    "f8": "double",
+}
+
+
+def las_extra_dimensions(las_file):
+    """Extra dimensions of a las file (read in its header), with their PDAL type"""
+    with laspy.open(las_file) as reader:
+        extra_dimensions = reader.header.point_format.extra_dimensions
+        return {dim.name: PDAL_TYPES[np.dtype(dim.dtype).str[1:]] for dim in extra_dimensions}
+
+
+# VLRs written by writers.las itself: spatial reference and extra bytes description
+WRITER_VLRS = [("LASF_Projection", None), ("liblas", 2112), ("LASF_Spec", 4)]
+
+
+def las_header_options(las_file):
+    """Options of writers.las to write the header fields and the VLRs of a las file, for an output
+    whose reader does not read this file (forward="all" only forwards the header of the reader)"""
+    with laspy.open(las_file) as reader:
+        header = reader.header
+    options = dict(
+        system_id=header.system_identifier,
+        software_id=header.generating_software,
+        global_encoding=int(header.global_encoding.value),
+        project_id=str(header.uuid),
+    )
+    if header.creation_date:
+        options["creation_doy"] = header.creation_date.timetuple().tm_yday
+        options["creation_year"] = header.creation_date.year
+    vlrs = [
+        dict(
+            user_id=vlr.user_id,
+            record_id=vlr.record_id,
+            description=vlr.description,
+            data=base64.b64encode(vlr.record_data_bytes()).decode(),
+        )
+        for vlr in header.vlrs
+        if not any(
+            vlr.user_id == user_id and record_id in (None, vlr.record_id)
+            for user_id, record_id in WRITER_VLRS
+        )
+    ]
+    if vlrs:
+        options["vlrs"] = vlrs
+    return options
 
 
 def mark_points_to_use_for_digital_models_with_new_dimension(
@@ -397,47 +564,81 @@ def mark_points_to_use_for_digital_models_with_new_dimension(
     output_dtm,
     keep_temporary_dimensions=False,
     reset_tags=False,
+    core_bounds=None,
+    native_filter=False,
+    original_tile_only=False,
+    header_las=None,
 ):
-
-    with tempfile.NamedTemporaryFile(
-        suffix="_with_temporary_dims.las", dir=".", delete_on_close=False
-    ) as tmp_las:
+    """Mark the points of input_las and write them to output_las (only the points of the original
+    tile with original_tile_only, for an input buffered by create_las_with_buffer), in a single
+    pipeline. The header fields and the VLRs of the output are those of input_las, or of
+    header_las if given (the original tile of a buffered input)"""
+    if native_filter:
+        pipeline, temporary_dimensions = define_native_marking_pipeline(
+            input_las,
+            None,
+            dsm_dimension,
+            dtm_dimension,
+            reset_tags,
+            core_bounds,
+            keep_temporary_dimensions,
+        )
+    else:
         pipeline, temporary_dimensions = define_marking_pipeline(
             input_las,
-            tmp_las.name,
+            None,
             dsm_dimension,
             dtm_dimension,
-            reset_tags
+            reset_tags,
+            core_bounds,
         )
 
-        if output_dtm:
-            pipeline |= pdal.Writer.gdal(
-                gdaldriver="GTiff",
-                output_type="max",
-                resolution=0.5,
-                filename=output_dtm,
-                where=f"{dtm_dimension}==1",
-            )
-
-        if output_dsm:
-            pipeline |= pdal.Writer.gdal(
-                gdaldriver="GTiff",
-                output_type="max",
-                resolution=0.5,
-                filename=output_dsm,
-                where=f"{dsm_dimension}==1",
-            )
-
-        pipeline.execute()
+    # DTM and DSM: max Z of the marked points of each cell, on cells anchored to multiples of
+    # the resolution, written in a single scan of the points
+    grids = [
+        dict(
+            resolution=0.5,
+            output_type="max",
+            where=f"{dimension}==1",
+            output_dimension="",
+            output_raster=output_raster,
+            origin_x=0,
+            origin_y=0,
+        )
+        for dimension, output_raster in [
+            (dtm_dimension, output_dtm),
+            (dsm_dimension, output_dsm),
+        ]
+        if output_raster
+    ]
+    if grids:
+        pipeline |= pdal.Filter.grid_decimation_multi(grids=json.dumps(grids))
+
+    if original_tile_only:
+        pipeline |= pdal.Filter.range(limits=f"{ORIGINAL_TILE_TAG}[1:1]")
+
+    # the output is written once: the writer only writes the extra dimensions of the input and
+    # the markers (and the temporary dimensions with keep_temporary_dimensions)
+    extra_dimensions = {
+        dimension: pdal_type
+        for dimension, pdal_type in las_extra_dimensions(input_las).items()
+        if dimension not in temporary_dimensions and dimension != ORIGINAL_TILE_TAG
+    }
+    extra_dimensions.update({dtm_dimension: "double", dsm_dimension: "double"})
+    if keep_temporary_dimensions:
+        extra_dimensions.update(temporary_dimensions)
+    header_options = las_header_options(header_las) if header_las else {}
+    pipeline |= pdal.Writer.las(
+        filename=output_las,
+        forward="all",
+        minor_version="4",
+        extra_dims=", ".join(
+            f"{name}={pdal_type}" for name, pdal_type in extra_dimensions.items()
+        ),
+        **header_options,
+    )
 
-        if keep_temporary_dimensions:
-            shutil.copy(tmp_las.name, output_las)
-        else:
-            remove_dimensions_from_las(
-                tmp_las.name,
-                temporary_dimensions + ["SRC_DOMAIN", "REF_DOMAIN", "radius_search"],
-                output_las,
-            )
+    pipeline.execute()
 
 
 def main(
@@ -453,7 +654,10 @@ def main(
     spatial_ref="EPSG:2154",
     tile_width=1000,
     tile_coord_scale=1000,
-    reset_tags=False
+    reset_tags=False,
+    core_only_sources=False,
+    native_filter=False,
+    tmp_dir=None,
 ):
     if skip_buffer:
         mark_points_to_use_for_digital_models_with_new_dimension(
@@ -465,22 +669,45 @@ def main(
             output_dtm,
             keep_temporary_dims,
             reset_tags,
+            native_filter=native_filter,
         )
     else:
-        mark_with_buffer = run_on_buffered_las(
-            buffer_width, spatial_ref, tile_width, tile_coord_scale
-        )(mark_points_to_use_for_digital_models_with_new_dimension)
+        # bounds of the original tile in the buffered one (from its name, as the buffer)
+        core_bounds = None
+        if core_only_sources:
+            core_bounds = get_buffered_bounds_from_filename(
+                input_las, buffer_width=0, tile_width=tile_width, tile_coord_scale=tile_coord_scale
+            )
 
-        mark_with_buffer(
-            input_las,
-            output_las,
-            dsm_dimension,
-            dtm_dimension,
-            output_dsm,
-            output_dtm,
-            keep_temporary_dims,
-            reset_tags,
-        )
+        # the buffer points are removed when the output is written (instead of writing the
+        # buffered output, then reading it again to remove them)
+        with tempfile.NamedTemporaryFile(
+            suffix="_buffered_input.laz", dir=tmp_dir, delete_on_close=False
+        ) as buffered_las:
+            create_las_with_buffer(
+                Path(input_las).parent,
+                input_las,
+                buffered_las.name,
+                buffer_width=buffer_width,
+                spatial_ref=spatial_ref,
+                tile_width=tile_width,
+                tile_coord_scale=tile_coord_scale,
+                tag_original_tile=True,
+            )
+            mark_points_to_use_for_digital_models_with_new_dimension(
+                buffered_las.name,
+                output_las,
+                dsm_dimension,
+                dtm_dimension,
+                output_dsm,
+                output_dtm,
+                keep_temporary_dims,
+                reset_tags,
+                core_bounds,
+                native_filter,
+                original_tile_only=True,
+                header_las=input_las,
+            )
 
 
 if __name__ == "__main__":
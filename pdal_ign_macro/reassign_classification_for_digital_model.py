@@ -8,6 +8,10 @@ from pdal_ign_macro import macro
 This tool shows how to use functions of macro in a pdal pipeline
 """
 
+# mémoire (en Mo) du cache d'index des radius_assign : les étapes 3 cherchent toutes les points de
+# pont (17), dont l'index n'est construit qu'une fois
+INDEX_CACHE_SIZE = 64
+
 
 def parse_args():
     parser = argparse.ArgumentParser("Tool to apply pdal pipelines for DSM and DTM calculation")
@@ -76,6 +80,8 @@ if __name__ == "__main__":
     )
 
     # selection de points DSM (max) sur une grille régulière
+    # (pas de macro.ClassMask : la classification change à chaque étape, et gridDecimation est un
+    # filtre PDAL, sans le & des expressions des plugins)
     pipeline |= pdal.Filter.gridDecimation(
         resolution=0.5,
         value="Classification=200",
@@ -105,6 +111,7 @@ if __name__ == "__main__":
         False,
         condition_src="Classification==2",
         condition_ref="Classification==17",
+        index_cache_size=INDEX_CACHE_SIZE,
         condition_out="Classification=102",
     )
     pipeline = macro.add_radius_assign(
@@ -123,6 +130,7 @@ if __name__ == "__main__":
         False,
         condition_src="Classification==3",
         condition_ref="Classification==17",
+        index_cache_size=INDEX_CACHE_SIZE,
         condition_out="Classification=103",
     )
     pipeline = macro.add_radius_assign(
@@ -141,6 +149,7 @@ if __name__ == "__main__":
         False,
         condition_src="Classification==4",
         condition_ref="Classification==17",
+        index_cache_size=INDEX_CACHE_SIZE,
         condition_out="Classification=104",
     )
     pipeline = macro.add_radius_assign(
@@ -159,6 +168,7 @@ if __name__ == "__main__":
         False,
         condition_src="Classification==5",
         condition_ref="Classification==17",
+        index_cache_size=INDEX_CACHE_SIZE,
         condition_out="Classification=105",
     )
     pipeline = macro.add_radius_assign(
@@ -177,6 +187,7 @@ if __name__ == "__main__":
         False,
         condition_src="Classification==9",
         condition_ref="Classification==17",
+        index_cache_size=INDEX_CACHE_SIZE,
         condition_out="Classification=109",
     )
     pipeline = macro.add_radius_assign(
@@ -0,0 +1,186 @@
+"""
+Run a pipeline of neighborhood filters (radius_assign, radius_opening, ...) on a las file window by
+window, so that the memory depends on the size of the windows instead of the size of the tile
+"""
+
+import math
+import os
+import tempfile
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import laspy
+import numpy as np
+import pdal
+
+
+class Window(NamedTuple):
+    xmin: float
+    xmax: float
+    ymin: float
+    ymax: float
+    first_x: bool
+    last_x: bool
+    first_y: bool
+    last_y: bool
+
+
+def split_in_windows(minx: float, maxx: float, miny: float, maxy: float, window_size: float):
+    """Split a 2d bounding box into square windows of side "window_size", row by row"""
+    nb_x = max(math.ceil((maxx - minx) / window_size), 1)
+    nb_y = max(math.ceil((maxy - miny) / window_size), 1)
+    return [
+        Window(
+            minx + ix * window_size,
+            minx + (ix + 1) * window_size,
+            miny + iy * window_size,
+            miny + (iy + 1) * window_size,
+            ix == 0,
+            ix == nb_x - 1,
+            iy == 0,
+            iy == nb_y - 1,
+        )
+        for iy in range(nb_y)
+        for ix in range(nb_x)
+    ]
+
+
+def core_mask(points: np.ndarray, window: Window) -> np.ndarray:
+    """Mask of the points of the window itself (not of its halo): the windows are half-open, and
+    the windows on the border of the tile extend to infinity, so that each point belongs to a single
+    window"""
+    x, y = points["X"], points["Y"]
+    mask_x = ((x >= window.xmin) | window.first_x) & ((x < window.xmax) | window.last_x)
+    mask_y = ((y >= window.ymin) | window.first_y) & ((y < window.ymax) | window.last_y)
+    return mask_x & mask_y
+
+
+def halo_mask(points: np.ndarray, window: Window, halo: float) -> np.ndarray:
+    """Mask of the points of the window and of its halo"""
+    # margin for the points outside the bounds of the header (rounded) on the border of the tile
+    margin = halo + 1
+    xmin = window.xmin - (margin if window.first_x else halo)
+    xmax = window.xmax + (margin if window.last_x else halo)
+    ymin = window.ymin - (margin if window.first_y else halo)
+    ymax = window.ymax + (margin if window.last_y else halo)
+    x, y = points["X"], points["Y"]
+    return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+
+
+def split_input(
+    input_las: str, windows: List[Window], halo: float, chunk_size: int, tmp_dir: str
+) -> Tuple[List[Optional[str]], Optional[np.dtype]]:
+    """Read the input file once, in stream mode, and append the points of each window and of its
+    halo to a raw file of the window.
+
+    Returns the files of the windows (None for a window without any point) and the dtype of their
+    points (the same for all the chunks, not stored in the raw files)"""
+    window_inputs = [None] * len(windows)
+    dtype = None
+    for chunk in pdal.Reader.las(filename=input_las).pipeline().iterator(chunk_size=chunk_size):
+        dtype = chunk.dtype
+        for index, window in enumerate(windows):
+            points = chunk[halo_mask(chunk, window, halo)]
+            if not len(points):
+                continue
+            if window_inputs[index] is None:
+                window_inputs[index] = os.path.join(tmp_dir, f"input_{index}.bin")
+            with open(window_inputs[index], "ab") as window_input:
+                points.tofile(window_input)
+    return window_inputs, dtype
+
+
+def run_in_windows(
+    input_las: str,
+    output_las: str,
+    add_stages: Callable[[pdal.Pipeline], pdal.Pipeline],
+    window_size: float,
+    halo: float,
+    chunk_size: int = 100_000,
+):
+    """Run the stages added by "add_stages" on "input_las" window by window, and write the result to
+    "output_las".
+
+    Each window is read with a halo of width "halo" around it, the stages run on the window and its
+    halo in memory, and only the points of the window are kept. The result of each point is then the
+    same as with a run on the whole tile as long as it only depends on the points closer than "halo":
+    for filters.radius_assign, "halo" must be at least the radius, for chained stages at least the
+    sum of their radii (e.g. radius + cleanup_radius for filters.radius_opening). For
+    filters.grid_decimation_deprecated, whose cells are anchored to a fixed origin, "halo" must be
+    at least the resolution.
+
+    The peak memory depends on the size of the windows and of their halo instead of the size of the
+    tile. The input file is read once, in stream mode: the points of each window and of its halo are
+    written to a temporary raw file (uncompressed, the points of a halo being written once for each
+    window they border), then each window is read back from its file. The points are written window
+    by window: their order is not the one of the input file.
+
+    Args:
+        input_las (str): input las file
+        output_las (str): output las file (with all the dimensions added by the stages)
+        add_stages (Callable[[pdal.Pipeline], pdal.Pipeline]): function that adds the stages to a
+            pipeline and returns it (e.g. lambda p: macro.add_radius_assign(p, 1, False, ...))
+        window_size (float): side of the square windows
+        halo (float): width of the halo read around each window
+        chunk_size (int, optional): number of points read at once. Defaults to 100000.
+    """
+    if window_size <= 0:
+        raise ValueError(f"Invalid window size: {window_size}, must be > 0")
+    if halo < 0:
+        raise ValueError(f"Invalid halo: {halo}, must be >= 0")
+
+    with laspy.open(input_las) as reader:
+        header = reader.header
+        writer_options = dict(
+            dataformat_id=header.point_format.id,
+            minor_version=header.version.minor,
+            scale_x=header.scales[0],
+            scale_y=header.scales[1],
+            scale_z=header.scales[2],
+            offset_x=header.offsets[0],
+            offset_y=header.offsets[1],
+            offset_z=header.offsets[2],
+        )
+        minx, miny = header.mins[0], header.mins[1]
+        maxx, maxy = header.maxs[0], header.maxs[1]
+    srs = pdal.Reader.las(filename=input_las).pipeline().quickinfo["readers.las"].get("srs", {})
+    if srs.get("wkt"):
+        writer_options["a_srs"] = srs["wkt"]
+
+    windows = split_in_windows(minx, maxx, miny, maxy, window_size)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        window_inputs, dtype = split_input(input_las, windows, halo, chunk_size, tmp_dir)
+        window_files = []
+        for index, (window, window_input) in enumerate(zip(windows, window_inputs)):
+            if window_input is None:
+                continue
+            points = np.fromfile(window_input, dtype=dtype)
+            os.remove(window_input)
+            if not np.any(core_mask(points, window)):
+                continue
+
+            pipeline = add_stages(pdal.Pipeline(arrays=[points]))
+            pipeline.execute()
+            result = pipeline.arrays[0]
+            core = result[core_mask(result, window)]
+
+            window_file = os.path.join(tmp_dir, f"window_{index}.las")
+            pdal.Writer.las(filename=window_file, extra_dims="all", **writer_options).pipeline(
+                core
+            ).execute()
+            window_files.append(window_file)
+
+        if not window_files:
+            pipeline = add_stages(pdal.Pipeline() | pdal.Reader.las(filename=input_las))
+            pipeline |= pdal.Writer.las(filename=output_las, forward="all", extra_dims="all")
+            pipeline.execute()
+            return
+
+        # the windows have the same point format: they are concatenated chunk by chunk
+        with laspy.open(window_files[0]) as first:
+            output_header = first.header
+        with laspy.open(output_las, mode="w", header=output_header) as writer:
+            for window_file in window_files:
+                with laspy.open(window_file) as reader:
+                    for points in reader.chunk_iterator(chunk_size):
+                        writer.write_points(points)
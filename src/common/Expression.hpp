@@ -0,0 +1,340 @@
+#pragma once
+
+#include <cctype>
+#include <cstdint>
+#include <cstdlib>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace pdal
+{
+
+// Expression on the dimensions of a point, with the syntax of the PDAL expressions:
+// numbers, dimension names, parentheses, arithmetic (+ - * /), comparisons (== != < <= > >=)
+// and logical operators (! && ||). A comparison or a logical operator evaluates to 1 or 0.
+// It also has the bitwise and of the integer parts (&, e.g. "ClassMask & 12" to test bits of a
+// mask), with the precedence of C: below the comparisons ("ClassMask & 4 == 4" is
+// "ClassMask & (4 == 4)"), so a bit test is written "(ClassMask & 4) == 4".
+class Expression
+{
+public:
+    bool empty() const { return m_nodes.empty(); }
+    const std::string& text() const { return m_text; }
+
+    // dimensions read by the expression, indexed by the dimension indexes passed to eval
+    const std::vector<std::string>& dimensionNames() const { return m_dimNames; }
+
+    // throws std::invalid_argument if the expression is invalid
+    void parse(const std::string& text)
+    {
+        m_text = text;
+        m_nodes.clear();
+        m_dimNames.clear();
+        m_pos = 0;
+        m_root = parseOr();
+        skipSpaces();
+        if (m_pos != m_text.size())
+            fail("unexpected character");
+    }
+
+    // value of the expression, get(i) being the value of the dimension dimensionNames()[i]
+    template <typename Getter>
+    double eval(const Getter& get) const
+    {
+        return evalNode(m_root, get);
+    }
+
+    template <typename Getter>
+    bool test(const Getter& get) const
+    {
+        return eval(get) != 0;
+    }
+
+private:
+    enum class Op { Const, Dim, Neg, Not, Add, Sub, Mul, Div, BitAnd, Eq, Ne, Lt, Le, Gt, Ge, And, Or };
+
+    struct Node
+    {
+        Op m_op;
+        double m_value; // Const
+        size_t m_dim; // Dim
+        int m_left, m_right;
+    };
+
+    std::string m_text;
+    std::vector<Node> m_nodes;
+    std::vector<std::string> m_dimNames;
+    int m_root = -1;
+    size_t m_pos = 0;
+
+    [[noreturn]] void fail(const std::string& what) const
+    {
+        throw std::invalid_argument("invalid expression '" + m_text + "': " + what +
+                                    " at position " + std::to_string(m_pos));
+    }
+
+    int addNode(Op op, int left = -1, int right = -1, double value = 0, size_t dim = 0)
+    {
+        m_nodes.push_back(Node {op, value, dim, left, right});
+        return static_cast<int>(m_nodes.size()) - 1;
+    }
+
+    void skipSpaces()
+    {
+        while (m_pos < m_text.size() && std::isspace(static_cast<unsigned char>(m_text[m_pos])))
+            m_pos++;
+    }
+
+    // consumes the token if it comes next
+    bool accept(const std::string& token)
+    {
+        skipSpaces();
+        if (m_text.compare(m_pos, token.size(), token) != 0)
+            return false;
+        m_pos += token.size();
+        return true;
+    }
+
+    int parseOr()
+    {
+        int node = parseAnd();
+        while (accept("||"))
+            node = addNode(Op::Or, node, parseAnd());
+        return node;
+    }
+
+    int parseAnd()
+    {
+        int node = parseBitAnd();
+        while (accept("&&"))
+            node = addNode(Op::And, node, parseBitAnd());
+        return node;
+    }
+
+    int parseBitAnd()
+    {
+        int node = parseComparison();
+        while (true)
+        {
+            skipSpaces();
+            if (m_text.compare(m_pos, 1, "&") != 0 || m_text.compare(m_pos, 2, "&&") == 0)
+                return node;
+            m_pos++;
+            node = addNode(Op::BitAnd, node, parseComparison());
+        }
+    }
+
+    int parseComparison()
+    {
+        int node = parseSum();
+        while (true)
+        {
+            Op op;
+            if (accept("=="))
+                op = Op::Eq;
+            else if (accept("!="))
+                op = Op::Ne;
+            else if (accept("<="))
+                op = Op::Le;
+            else if (accept(">="))
+                op = Op::Ge;
+            else if (accept("<"))
+                op = Op::Lt;
+            else if (accept(">"))
+                op = Op::Gt;
+            else
+                return node;
+            node = addNode(op, node, parseSum());
+        }
+    }
+
+    int parseSum()
+    {
+        int node = parseProduct();
+        while (true)
+        {
+            if (accept("+"))
+                node = addNode(Op::Add, node, parseProduct());
+            else if (accept("-"))
+                node = addNode(Op::Sub, node, parseProduct());
+            else
+                return node;
+        }
+    }
+
+    int parseProduct()
+    {
+        int node = parseUnary();
+        while (true)
+        {
+            if (accept("*"))
+                node = addNode(Op::Mul, node, parseUnary());
+            else if (accept("/"))
+                node = addNode(Op::Div, node, parseUnary());
+            else
+                return node;
+        }
+    }
+
+    int parseUnary()
+    {
+        skipSpaces();
+        if (m_pos + 1 < m_text.size() && m_text[m_pos] == '!' && m_text[m_pos + 1] != '=')
+        {
+            m_pos++;
+            return addNode(Op::Not, parseUnary());
+        }
+        if (accept("-"))
+            return addNode(Op::Neg, parseUnary());
+        return parsePrimary();
+    }
+
+    int parsePrimary()
+    {
+        skipSpaces();
+        if (m_pos >= m_text.size())
+            fail("unexpected end");
+
+        char c = m_text[m_pos];
+        if (c == '(')
+        {
+            m_pos++;
+            int node = parseOr();
+            if (!accept(")"))
+                fail("expected ')'");
+            return node;
+        }
+        if (std::isdigit(static_cast<unsigned char>(c)) || c == '.')
+        {
+            const char* begin = m_text.c_str() + m_pos;
+            char* end;
+            double value = std::strtod(begin, &end);
+            if (end == begin)
+                fail("invalid number");
+            m_pos += end - begin;
+            return addNode(Op::Const, -1, -1, value);
+        }
+        if (std::isalpha(static_cast<unsigned char>(c)) || c == '_')
+        {
+            size_t begin = m_pos;
+            while (m_pos < m_text.size() &&
+                   (std::isalnum(static_cast<unsigned char>(m_text[m_pos])) || m_text[m_pos] == '_'))
+                m_pos++;
+            std::string name = m_text.substr(begin, m_pos - begin);
+            size_t dim = 0;
+            while (dim < m_dimNames.size() && m_dimNames[dim] != name)
+                dim++;
+            if (dim == m_dimNames.size())
+                m_dimNames.push_back(name);
+            return addNode(Op::Dim, -1, -1, 0, dim);
+        }
+        fail("unexpected character");
+    }
+
+    template <typename Getter>
+    double evalNode(int id, const Getter& get) const
+    {
+        const Node& node = m_nodes[id];
+        switch (node.m_op)
+        {
+        case Op::Const:
+            return node.m_value;
+        case Op::Dim:
+            return get(node.m_dim);
+        case Op::Neg:
+            return -evalNode(node.m_left, get);
+        case Op::Not:
+            return evalNode(node.m_left, get) == 0;
+        case Op::Add:
+            return evalNode(node.m_left, get) + evalNode(node.m_right, get);
+        case Op::Sub:
+            return evalNode(node.m_left, get) - evalNode(node.m_right, get);
+        case Op::Mul:
+            return evalNode(node.m_left, get) * evalNode(node.m_right, get);
+        case Op::Div:
+            return evalNode(node.m_left, get) / evalNode(node.m_right, get);
+        case Op::BitAnd:
+            return static_cast<double>(static_cast<int64_t>(evalNode(node.m_left, get)) &
+                                       static_cast<int64_t>(evalNode(node.m_right, get)));
+        case Op::Eq:
+            return evalNode(node.m_left, get) == evalNode(node.m_right, get);
+        case Op::Ne:
+            return evalNode(node.m_left, get) != evalNode(node.m_right, get);
+        case Op::Lt:
+            return evalNode(node.m_left, get) < evalNode(node.m_right, get);
+        case Op::Le:
+            return evalNode(node.m_left, get) <= evalNode(node.m_right, get);
+        case Op::Gt:
+            return evalNode(node.m_left, get) > evalNode(node.m_right, get);
+        case Op::Ge:
+            return evalNode(node.m_left, get) >= evalNode(node.m_right, get);
+        case Op::And:
+            return evalNode(node.m_left, get) != 0 && evalNode(node.m_right, get) != 0;
+        case Op::Or:
+            return evalNode(node.m_left, get) != 0 || evalNode(node.m_right, get) != 0;
+        }
+        return 0;
+    }
+};
+
+// Assignment with the syntax of filters.assign: "Dimension = expression [WHERE condition]"
+class AssignStatement
+{
+public:
+    // throws std::invalid_argument if the statement is invalid
+    void parse(const std::string& text)
+    {
+        size_t equal = text.find('=');
+        if (equal == std::string::npos || equal == 0 || text.compare(equal, 2, "==") == 0)
+            throw std::invalid_argument("invalid assignment '" + text + "': expected 'Dimension = value'");
+
+        m_dimension = trim(text.substr(0, equal));
+        for (char c : m_dimension)
+            if (!std::isalnum(static_cast<unsigned char>(c)) && c != '_')
+                throw std::invalid_argument("invalid dimension name in the assignment '" + text + "'");
+
+        std::string rest = text.substr(equal + 1);
+        size_t where = findWhere(rest);
+        m_value.parse(rest.substr(0, where));
+        m_condition = Expression();
+        if (where != std::string::npos)
+            m_condition.parse(rest.substr(where + 5));
+    }
+
+    const std::string& dimension() const { return m_dimension; }
+    const Expression& value() const { return m_value; }
+    // empty if the statement has no WHERE clause
+    const Expression& condition() const { return m_condition; }
+
+private:
+    std::string m_dimension;
+    Expression m_value, m_condition;
+
+    static std::string trim(const std::string& s)
+    {
+        size_t begin = s.find_first_not_of(" \t\n");
+        size_t end = s.find_last_not_of(" \t\n");
+        return begin == std::string::npos ? "" : s.substr(begin, end - begin + 1);
+    }
+
+    // position of the "WHERE" keyword (case insensitive, as a whole word)
+    static size_t findWhere(const std::string& s)
+    {
+        for (size_t i = 0; i + 5 <= s.size(); ++i)
+        {
+            bool word = (i == 0 || std::isspace(static_cast<unsigned char>(s[i - 1]))) &&
+                        (i + 5 == s.size() || std::isspace(static_cast<unsigned char>(s[i + 5])));
+            if (!word)
+                continue;
+            std::string token = s.substr(i, 5);
+            for (char& c : token)
+                c = std::toupper(static_cast<unsigned char>(c));
+            if (token == "WHERE")
+                return i;
+        }
+        return std::string::npos;
+    }
+};
+
+} // namespace pdal
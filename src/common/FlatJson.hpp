@@ -0,0 +1,130 @@
+#pragma once
+
+#include <cctype>
+#include <map>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace pdal
+{
+
+// Flat JSON object: the values (strings, numbers, booleans) are kept as text
+typedef std::map<std::string, std::string> FlatJsonObject;
+
+// Parser for the options made of a list of flat JSON objects (e.g. a list of rules).
+// PDAL passes each object of a list as its own option value: a value may be an object, or a
+// list of objects.
+class FlatJsonParser
+{
+public:
+    static std::vector<FlatJsonObject> parse(const std::vector<std::string>& values)
+    {
+        std::vector<FlatJsonObject> objects;
+        for (const std::string& value : values)
+        {
+            FlatJsonParser parser(value);
+            parser.parseValues(objects);
+        }
+        return objects;
+    }
+
+private:
+    const std::string& m_text;
+    size_t m_pos;
+
+    explicit FlatJsonParser(const std::string& text) : m_text(text), m_pos(0) {}
+
+    [[noreturn]] void fail(const std::string& what) const
+    {
+        throw std::invalid_argument("invalid JSON (" + what + " at position " +
+                                    std::to_string(m_pos) + "): " + m_text);
+    }
+
+    void skipSpaces()
+    {
+        while (m_pos < m_text.size() && std::isspace(static_cast<unsigned char>(m_text[m_pos])))
+            m_pos++;
+    }
+
+    char peek()
+    {
+        skipSpaces();
+        return m_pos < m_text.size() ? m_text[m_pos] : '\0';
+    }
+
+    void expect(char c)
+    {
+        if (peek() != c)
+            fail(std::string("expected '") + c + "'");
+        m_pos++;
+    }
+
+    void parseValues(std::vector<FlatJsonObject>& objects)
+    {
+        if (peek() == '[')
+        {
+            m_pos++;
+            if (peek() != ']')
+                while (true)
+                {
+                    objects.push_back(parseObject());
+                    if (peek() != ',')
+                        break;
+                    m_pos++;
+                }
+            expect(']');
+        }
+        else
+            objects.push_back(parseObject());
+        if (peek() != '\0')
+            fail("unexpected character");
+    }
+
+    FlatJsonObject parseObject()
+    {
+        FlatJsonObject object;
+        expect('{');
+        if (peek() != '}')
+            while (true)
+            {
+                std::string key = parseString();
+                expect(':');
+                object[key] = parseScalar();
+                if (peek() != ',')
+                    break;
+                m_pos++;
+            }
+        expect('}');
+        return object;
+    }
+
+    std::string parseString()
+    {
+        expect('"');
+        std::string s;
+        while (m_pos < m_text.size() && m_text[m_pos] != '"')
+        {
+            if (m_text[m_pos] == '\\' && m_pos + 1 < m_text.size())
+                m_pos++;
+            s += m_text[m_pos++];
+        }
+        expect('"');
+        return s;
+    }
+
+    std::string parseScalar()
+    {
+        if (peek() == '"')
+            return parseString();
+        size_t begin = m_pos;
+        while (m_pos < m_text.size() && m_text[m_pos] != ',' && m_text[m_pos] != '}' &&
+               !std::isspace(static_cast<unsigned char>(m_text[m_pos])))
+            m_pos++;
+        if (m_pos == begin)
+            fail("expected a value");
+        return m_text.substr(begin, m_pos - begin);
+    }
+};
+
+} // namespace pdal
@@ -0,0 +1,152 @@
+#pragma once
+
+#include <pdal/SpatialReference.hpp>
+
+#include "GridCells.hpp"
+
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <limits>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+namespace pdal
+{
+
+// Single band raster of doubles on the cells of a grid, written as a GeoTIFF without GDAL
+// (uncompressed, in a single strip, with the EPSG code of the coordinate system if it has one)
+class GeoTiffRaster
+{
+public:
+    static constexpr double NoData = -9999;
+
+    explicit GeoTiffRaster(const GridFrame& frame)
+        : m_width(frame.width()), m_height(frame.height()), m_resolution(frame.resolution()),
+          m_values(frame.cellCount(), NoData)
+    {
+        // corner of the upper left pixel: the rows of the image go from the north to the south
+        BOX2D upperLeft = frame.cellBounds(0, frame.height() - 1);
+        m_originX = upperLeft.minx;
+        m_originY = upperLeft.maxy;
+    }
+
+    void set(std::pair<int, int> cell, double value)
+    {
+        m_values[static_cast<uint64_t>(m_height - 1 - cell.second) * m_width + cell.first] = value;
+    }
+
+    void setSpatialReference(const SpatialReference& srs)
+    {
+        std::string epsg = srs.empty() ? "" : srs.identifyHorizontalEPSG();
+        m_epsg = epsg.empty() ? 0 : std::stoi(epsg);
+        m_geographic = m_epsg && srs.isGeographic();
+    }
+
+    // false if the coordinate system is unknown or has no EPSG code (not written in the file)
+    bool hasEpsg() const { return m_epsg > 0 && m_epsg <= std::numeric_limits<uint16_t>::max(); }
+
+    // throws std::runtime_error if the file can't be written
+    void write(const std::string& filename) const
+    {
+        // GeoKeyDirectory: version, revision, minor revision, number of keys, then the keys
+        std::vector<uint16_t> geoKeys {1, 1, 0, 0};
+        auto addKey = [&](uint16_t key, uint16_t value)
+        {
+            geoKeys.insert(geoKeys.end(), {key, 0, 1, value});
+            geoKeys[3]++;
+        };
+        if (hasEpsg())
+            addKey(1024, m_geographic ? 2 : 1); // GTModelType: projected or geographic
+        addKey(1025, 1); // GTRasterType: PixelIsArea
+        if (hasEpsg())
+            addKey(m_geographic ? 2048 : 3072, static_cast<uint16_t>(m_epsg));
+        const std::string noData = "-9999";
+
+        // header, IFD, then the values of the tags which don't fit in an entry, then the pixels
+        const uint16_t nbEntries = 15;
+        const uint64_t ifdSize = 2 + 12 * nbEntries + 4;
+        const uint64_t scaleOffset = 8 + ifdSize;
+        const uint64_t tiepointOffset = scaleOffset + 3 * 8;
+        const uint64_t geoKeysOffset = tiepointOffset + 6 * 8;
+        const uint64_t noDataOffset = geoKeysOffset + 2 * geoKeys.size();
+        const uint64_t dataOffset = (noDataOffset + noData.size() + 1 + 7) / 8 * 8;
+        const uint64_t dataSize = m_values.size() * sizeof(double);
+        if (dataOffset + dataSize > std::numeric_limits<uint32_t>::max())
+            throw std::runtime_error("raster too large for a GeoTIFF file: " + filename);
+
+        std::vector<uint8_t> bytes(dataOffset + dataSize, 0);
+        size_t pos = 0;
+        auto put = [&](uint64_t value, int size)
+        {
+            for (int i = 0; i < size; ++i)
+                bytes[pos++] = static_cast<uint8_t>(value >> (8 * i)); // little endian
+        };
+        auto putDouble = [&](double value)
+        {
+            uint64_t bits;
+            std::memcpy(&bits, &value, sizeof(bits));
+            put(bits, 8);
+        };
+        // entry of the IFD: tag, type (2: ascii, 3: short, 4: long, 12: double), count, value or offset
+        auto entry = [&](uint16_t tag, uint16_t type, uint32_t count, uint32_t value)
+        {
+            put(tag, 2);
+            put(type, 2);
+            put(count, 4);
+            put(value, type == 3 && count == 1 ? 2 : 4);
+            if (type == 3 && count == 1)
+                put(0, 2);
+        };
+
+        put('I' | ('I' << 8), 2);
+        put(42, 2);
+        put(8, 4);
+        put(nbEntries, 2);
+        entry(256, 4, 1, m_width);                // ImageWidth
+        entry(257, 4, 1, m_height);               // ImageLength
+        entry(258, 3, 1, 64);                     // BitsPerSample
+        entry(259, 3, 1, 1);                      // Compression: none
+        entry(262, 3, 1, 1);                      // PhotometricInterpretation: black is zero
+        entry(273, 4, 1, dataOffset);             // StripOffsets
+        entry(277, 3, 1, 1);                      // SamplesPerPixel
+        entry(278, 4, 1, m_height);               // RowsPerStrip
+        entry(279, 4, 1, dataSize);               // StripByteCounts
+        entry(284, 3, 1, 1);                      // PlanarConfiguration: contiguous
+        entry(339, 3, 1, 3);                      // SampleFormat: floating point
+        entry(33550, 12, 3, scaleOffset);         // ModelPixelScale
+        entry(33922, 12, 6, tiepointOffset);      // ModelTiepoint
+        entry(34735, 3, geoKeys.size(), geoKeysOffset); // GeoKeyDirectory
+        entry(42113, 2, noData.size() + 1, noDataOffset); // GDAL_NODATA
+        put(0, 4); // no next IFD
+
+        for (double value : {m_resolution, m_resolution, 0.})
+            putDouble(value);
+        for (double value : {0., 0., 0., m_originX, m_originY, 0.})
+            putDouble(value);
+        for (uint16_t value : geoKeys)
+            put(value, 2);
+        for (char c : noData)
+            put(c, 1);
+
+        pos = dataOffset;
+        for (double value : m_values)
+            putDouble(value);
+
+        std::ofstream out(filename, std::ios::binary);
+        out.write(reinterpret_cast<const char*>(bytes.data()), bytes.size());
+        if (!out)
+            throw std::runtime_error("unable to write the raster " + filename);
+    }
+
+private:
+    int m_width, m_height;
+    double m_resolution;
+    double m_originX, m_originY;
+    int m_epsg = 0;
+    bool m_geographic = false;
+    std::vector<double> m_values; // row by row, from the north
+};
+
+} // namespace pdal
@@ -0,0 +1,216 @@
+#pragma once
+
+#include <pdal/pdal_types.hpp>
+#include <pdal/util/Bounds.hpp>
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <limits>
+#include <stdexcept>
+#include <utility>
+#include <vector>
+
+namespace pdal
+{
+
+// Point kept in each cell of a grid, by cell index (row * width + col). The cells are a flat
+// array when the points fill the grid, or an open addressing hash table of the occupied cells
+// when the cells are much more numerous than the points (e.g. a few points on a large extent).
+class GridCells
+{
+public:
+    static constexpr PointId Empty = std::numeric_limits<PointId>::max();
+
+    GridCells(uint64_t cellCount, point_count_t pointCount) : m_cellCount(cellCount)
+    {
+        m_dense = cellCount <= 4 * pointCount + 4096;
+        if (m_dense)
+        {
+            m_values.assign(cellCount, Empty);
+            return;
+        }
+
+        // at most one occupied cell per point: the table is at most half full
+        size_t capacity = 16;
+        while (capacity < 2 * pointCount)
+            capacity *= 2;
+        m_keys.assign(capacity, EmptyKey);
+        m_values.assign(capacity, Empty);
+    }
+
+    uint64_t cellCount() const { return m_cellCount; }
+
+    bool dense() const { return m_dense; }
+
+    // point kept in a cell, Empty if none (the entry of the cell is created if needed)
+    PointId& at(uint64_t cell)
+    {
+        if (m_dense)
+            return m_values[cell];
+
+        size_t mask = m_keys.size() - 1;
+        size_t slot = hash(cell) & mask;
+        while (m_keys[slot] != cell && m_keys[slot] != EmptyKey)
+            slot = (slot + 1) & mask;
+        m_keys[slot] = cell;
+        return m_values[slot];
+    }
+
+    // calls visit(id) on the point kept in each occupied cell
+    template <typename Visit>
+    void forEachKept(const Visit& visit) const
+    {
+        for (PointId id : m_values)
+            if (id != Empty)
+                visit(id);
+    }
+
+    size_t memorySize() const
+    {
+        return m_values.size() * sizeof(PointId) + m_keys.size() * sizeof(uint64_t);
+    }
+
+private:
+    static constexpr uint64_t EmptyKey = std::numeric_limits<uint64_t>::max();
+
+    uint64_t m_cellCount;
+    bool m_dense;
+    std::vector<uint64_t> m_keys; // cell of each slot of the hash table
+    std::vector<PointId> m_values;
+
+    static size_t hash(uint64_t cell)
+    {
+        // the neighbor cells have consecutive indexes: they are spread over the table
+        cell ^= cell >> 33;
+        cell *= 0xff51afd7ed558ccdULL;
+        cell ^= cell >> 33;
+        return static_cast<size_t>(cell);
+    }
+};
+
+// Cell (col, row) of a point in a grid of square cells from (bounds.minx, bounds.miny)
+inline std::pair<int, int> gridCellOf(const BOX2D& bounds, double resolution, double x, double y)
+{
+    // if x==(xmax of the cell), we assume the point are in the upper cell
+    // if y==(ymax of the cell), we assume the point are in the right cell
+    int col = static_cast<int>((x - bounds.minx) / resolution);
+    int row = static_cast<int>((y - bounds.miny) / resolution);
+
+    // to avoid numeric pb with the division (append if the point is on the grid)
+    if (x < bounds.minx + col * resolution)
+        col--;
+    if (y < bounds.miny + row * resolution)
+        row--;
+    if (x >= bounds.minx + (col + 1) * resolution)
+        col++;
+    if (y >= bounds.miny + (row + 1) * resolution)
+        row++;
+
+    return std::make_pair(col, row);
+}
+
+// Grid of square cells which covers 2d bounds, anchored to an origin (by default (0, 0): the
+// cells are on the multiples of the resolution). The cells are then the same for any bounds, e.g.
+// with or without a buffer, or on adjacent tiles. The cell (0, 0) is the cell of the lower left
+// corner of the bounds.
+class GridFrame
+{
+public:
+    GridFrame(const BOX2D& bounds, double resolution) : GridFrame(bounds, resolution, 0., 0.) {}
+
+    // throws std::out_of_range if the cells can't be numbered with ints
+    GridFrame(const BOX2D& bounds, double resolution, double originX, double originY)
+        : m_bounds(bounds), m_resolution(resolution)
+    {
+        m_origin.minx = originX;
+        m_origin.miny = originY;
+        const double limit = std::numeric_limits<int>::max() - 1;
+        for (double x : {bounds.minx, bounds.maxx})
+            if (!(std::abs((x - originX) / resolution) < limit))
+                throw std::out_of_range("grid width out of range");
+        for (double y : {bounds.miny, bounds.maxy})
+            if (!(std::abs((y - originY) / resolution) < limit))
+                throw std::out_of_range("grid height out of range");
+
+        // the size comes from the cell of the upper right corner, so that each point of the
+        // bounds has a cell of the grid, whatever the rounding of the coordinates
+        m_first = gridCellOf(m_origin, resolution, bounds.minx, bounds.miny);
+        std::pair<int, int> last = gridCellOf(m_origin, resolution, bounds.maxx, bounds.maxy);
+        m_width = static_cast<int64_t>(last.first) - m_first.first + 1;
+        m_height = static_cast<int64_t>(last.second) - m_first.second + 1;
+        if (m_width > std::numeric_limits<int>::max())
+            throw std::out_of_range("grid width out of range");
+        if (m_height > std::numeric_limits<int>::max())
+            throw std::out_of_range("grid height out of range");
+    }
+
+    const BOX2D& bounds() const { return m_bounds; }
+    double resolution() const { return m_resolution; }
+    int width() const { return static_cast<int>(m_width); }
+    int height() const { return static_cast<int>(m_height); }
+    uint64_t cellCount() const { return static_cast<uint64_t>(m_width) * m_height; }
+
+    // cell (col, row) of a point of the bounds
+    std::pair<int, int> cellOf(double x, double y) const
+    {
+        std::pair<int, int> cell = gridCellOf(m_origin, m_resolution, x, y);
+        return std::make_pair(cell.first - m_first.first, cell.second - m_first.second);
+    }
+
+    uint64_t index(std::pair<int, int> cell) const
+    {
+        return static_cast<uint64_t>(cell.second) * m_width + cell.first;
+    }
+
+    // bounds of a cell
+    BOX2D cellBounds(int col, int row) const
+    {
+        return BOX2D(m_origin.minx + (m_first.first + col) * m_resolution,
+                     m_origin.miny + (m_first.second + row) * m_resolution,
+                     m_origin.minx + (m_first.first + col + 1) * m_resolution,
+                     m_origin.miny + (m_first.second + row + 1) * m_resolution);
+    }
+
+private:
+    BOX2D m_bounds;
+    BOX2D m_origin; // only minx, miny
+    double m_resolution;
+    std::pair<int, int> m_first; // cell of the lower left corner, from the origin
+    int64_t m_width, m_height;
+};
+
+// Cells of a grid which intersect src bounds (all the cells with empty src bounds): the points
+// of the other cells are not kept
+class GridCellRange
+{
+public:
+    GridCellRange(const GridFrame& frame, const BOX2D& srcBounds)
+        : m_first(0, 0), m_last(std::numeric_limits<int>::max(), std::numeric_limits<int>::max())
+    {
+        if (srcBounds.empty())
+            return;
+        const BOX2D& bounds = frame.bounds();
+        if (srcBounds.maxx < bounds.minx || srcBounds.minx > bounds.maxx ||
+            srcBounds.maxy < bounds.miny || srcBounds.miny > bounds.maxy)
+            m_last = std::make_pair(-1, -1); // no cell
+        else
+        {
+            m_first = frame.cellOf(std::max(srcBounds.minx, bounds.minx),
+                                   std::max(srcBounds.miny, bounds.miny));
+            m_last = frame.cellOf(std::min(srcBounds.maxx, bounds.maxx),
+                                  std::min(srcBounds.maxy, bounds.maxy));
+        }
+    }
+
+    bool contains(std::pair<int, int> cell) const
+    {
+        return cell.first >= m_first.first && cell.first <= m_last.first &&
+               cell.second >= m_first.second && cell.second <= m_last.second;
+    }
+
+private:
+    std::pair<int, int> m_first, m_last;
+};
+
+} // namespace pdal
@@ -0,0 +1,78 @@
+#pragma once
+
+#include <pdal/PointView.hpp>
+
+#include <algorithm>
+#include <cstdint>
+#include <limits>
+#include <string>
+#include <utility>
+#include <vector>
+
+namespace pdal
+{
+
+namespace morton_order
+{
+
+// spreads the 32 bits of v on the even bits of a 64 bits word
+inline uint64_t spreadBits(uint64_t v)
+{
+    v &= 0xffffffffULL;
+    v = (v | (v << 16)) & 0x0000ffff0000ffffULL;
+    v = (v | (v << 8)) & 0x00ff00ff00ff00ffULL;
+    v = (v | (v << 4)) & 0x0f0f0f0f0f0f0f0fULL;
+    v = (v | (v << 2)) & 0x3333333333333333ULL;
+    v = (v | (v << 1)) & 0x5555555555555555ULL;
+    return v;
+}
+
+// position of v in [min, min + extent] on 32 bits
+inline uint64_t quantize(double v, double min, double scale)
+{
+    double q = (v - min) * scale;
+    return static_cast<uint64_t>(std::min(std::max(q, 0.), 4294967295.));
+}
+
+} // namespace morton_order
+
+// Sorts ids (points of the view) along the 2d Morton (Z-order) curve of their X, Y: consecutive
+// points are then close to each other, so that consecutive neighbors searches read the same parts
+// of the index. The points with the same code keep the order of their ids.
+inline void sortMorton(const PointView& view, PointIdList& ids)
+{
+    using namespace morton_order;
+
+    if (ids.size() < 2)
+        return;
+
+    double minx = std::numeric_limits<double>::max(), miny = minx;
+    double maxx = std::numeric_limits<double>::lowest(), maxy = maxx;
+    for (PointId id : ids)
+    {
+        double x = view.getFieldAs<double>(Dimension::Id::X, id);
+        double y = view.getFieldAs<double>(Dimension::Id::Y, id);
+        minx = std::min(minx, x);
+        maxx = std::max(maxx, x);
+        miny = std::min(miny, y);
+        maxy = std::max(maxy, y);
+    }
+
+    // the same scale on both axes, so that a cell of the curve is square
+    double extent = std::max(maxx - minx, maxy - miny);
+    double scale = extent > 0 ? 4294967295. / extent : 0.;
+
+    std::vector<std::pair<uint64_t, PointId>> codes(ids.size());
+    for (size_t i = 0; i < ids.size(); ++i)
+    {
+        uint64_t qx = quantize(view.getFieldAs<double>(Dimension::Id::X, ids[i]), minx, scale);
+        uint64_t qy = quantize(view.getFieldAs<double>(Dimension::Id::Y, ids[i]), miny, scale);
+        codes[i] = {spreadBits(qx) | (spreadBits(qy) << 1), ids[i]};
+    }
+    std::sort(codes.begin(), codes.end());
+
+    for (size_t i = 0; i < ids.size(); ++i)
+        ids[i] = codes[i].second;
+}
+
+} // namespace pdal
@@ -0,0 +1,116 @@
+#pragma once
+
+#include <pdal/pdal_types.hpp>
+
+#include <cstdint>
+#include <deque>
+#include <functional>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+namespace pdal
+{
+
+// Neighbor lists of the points of a block of consecutive point ids (the ids of the point view
+// are stored on 32 bits). Only the points whose list has been computed have one.
+class NeighborBlock
+{
+public:
+    static constexpr PointId Size = 4096;
+
+    explicit NeighborBlock(PointId first) : m_first(first), m_offsets(Size + 1, 0), m_computed(Size) {}
+
+    // the lists must be added in the order of the ids
+    void add(PointId id, const std::vector<uint64_t>& neighbors)
+    {
+        size_t local = id - m_first;
+        // the points skipped since the last list have an empty list
+        for (size_t i = m_next; i <= local; ++i)
+            m_offsets[i] = static_cast<uint32_t>(m_neighbors.size());
+        for (uint64_t neighbor : neighbors)
+            m_neighbors.push_back(static_cast<uint32_t>(neighbor));
+        m_offsets[local + 1] = static_cast<uint32_t>(m_neighbors.size());
+        m_computed[local] = true;
+        m_next = local + 1;
+    }
+
+    bool empty() const { return m_next == 0; }
+
+    bool has(PointId id) const { return m_computed[id - m_first]; }
+
+    // [begin, end) of the list of a point of the block, which must have one
+    std::pair<const uint32_t*, const uint32_t*> neighbors(PointId id) const
+    {
+        size_t local = id - m_first;
+        return {m_neighbors.data() + m_offsets[local], m_neighbors.data() + m_offsets[local + 1]};
+    }
+
+    size_t memorySize() const
+    {
+        return (m_offsets.size() + m_neighbors.size()) * sizeof(uint32_t) + m_computed.size() / 8;
+    }
+
+private:
+    PointId m_first;
+    std::vector<uint32_t> m_offsets; // list of the point i: [m_offsets[i], m_offsets[i + 1])
+    std::vector<bool> m_computed;
+    std::vector<uint32_t> m_neighbors;
+    size_t m_next = 0; // first point after the last list
+};
+
+// Cache of neighbor blocks by (search key, block index), with a memory budget: the oldest
+// blocks are evicted when a new block does not fit.
+class NeighborListCache
+{
+public:
+    explicit NeighborListCache(size_t budget) : m_budget(budget) {}
+
+    // nullptr if the block is not in the cache
+    const NeighborBlock* get(size_t key, size_t block) const
+    {
+        auto it = m_blocks.find(Key(key, block));
+        return it == m_blocks.end() ? nullptr : &it->second;
+    }
+
+    void put(size_t key, size_t block, NeighborBlock&& neighbors)
+    {
+        size_t size = neighbors.memorySize();
+        if (size > m_budget)
+        {
+            m_evictions++;
+            return;
+        }
+        while (m_size + size > m_budget && !m_order.empty())
+        {
+            auto it = m_blocks.find(m_order.front());
+            m_size -= it->second.memorySize();
+            m_blocks.erase(it);
+            m_order.pop_front();
+            m_evictions++;
+        }
+        m_blocks.emplace(Key(key, block), std::move(neighbors));
+        m_order.push_back(Key(key, block));
+        m_size += size;
+    }
+
+    size_t evictions() const { return m_evictions; }
+
+private:
+    typedef std::pair<size_t, size_t> Key;
+    struct KeyHash
+    {
+        size_t operator()(const Key& key) const
+        {
+            return std::hash<size_t>()(key.first * 0x9e3779b97f4a7c15ULL ^ key.second);
+        }
+    };
+
+    size_t m_budget;
+    size_t m_size = 0;
+    size_t m_evictions = 0;
+    std::unordered_map<Key, NeighborBlock, KeyHash> m_blocks;
+    std::deque<Key> m_order; // oldest first
+};
+
+} // namespace pdal
@@ -0,0 +1,107 @@
+#pragma once
+
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <exception>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+namespace pdal
+{
+
+// Number of chunks used by processInChunks
+inline size_t chunkCount(uint64_t count, int threads)
+{
+    return std::max<size_t>(std::min<uint64_t>(std::max(threads, 1), count), 1);
+}
+
+// Calls process(begin, end, chunk) on chunkCount(count, threads) contiguous chunks of [0, count),
+// one thread per chunk (in the calling thread when there is a single chunk). The chunks are
+// numbered in order, so that per-chunk results can be merged deterministically. The first exception
+// thrown by process is thrown again in the calling thread, once the other chunks are done.
+inline void processInChunks(uint64_t count, int threads,
+                            const std::function<void(uint64_t, uint64_t, size_t)>& process)
+{
+    size_t nbChunks = chunkCount(count, threads);
+    if (nbChunks <= 1)
+    {
+        process(0, count, 0);
+        return;
+    }
+
+    uint64_t chunkSize = (count + nbChunks - 1) / nbChunks;
+    std::exception_ptr error;
+    std::mutex errorMutex;
+    std::vector<std::thread> workers;
+    for (size_t chunk = 0; chunk < nbChunks; ++chunk)
+    {
+        uint64_t begin = std::min<uint64_t>(chunk * chunkSize, count);
+        uint64_t end = std::min<uint64_t>(begin + chunkSize, count);
+        workers.emplace_back(
+            [&, begin, end, chunk]()
+            {
+                try
+                {
+                    process(begin, end, chunk);
+                }
+                catch (...)
+                {
+                    std::lock_guard<std::mutex> lock(errorMutex);
+                    if (!error)
+                        error = std::current_exception();
+                }
+            });
+    }
+    for (auto& worker : workers)
+        worker.join();
+    if (error)
+        std::rethrow_exception(error);
+}
+
+// Calls process(i) on each i of [0, count) with up to threads threads, each thread taking the next
+// index when it is done: suited to items of different sizes (e.g. point views). In the calling
+// thread when there is a single thread. The first exception thrown by process is thrown again in
+// the calling thread, once the other threads are done.
+inline void processEach(uint64_t count, int threads, const std::function<void(uint64_t)>& process)
+{
+    size_t nbThreads = chunkCount(count, threads);
+    if (nbThreads <= 1)
+    {
+        for (uint64_t i = 0; i < count; ++i)
+            process(i);
+        return;
+    }
+
+    std::atomic<uint64_t> next(0);
+    std::exception_ptr error;
+    std::mutex errorMutex;
+    std::vector<std::thread> workers;
+    for (size_t t = 0; t < nbThreads; ++t)
+        workers.emplace_back(
+            [&]()
+            {
+                for (uint64_t i = next++; i < count; i = next++)
+                {
+                    try
+                    {
+                        process(i);
+                    }
+                    catch (...)
+                    {
+                        std::lock_guard<std::mutex> lock(errorMutex);
+                        if (!error)
+                            error = std::current_exception();
+                        next = count; // the other items are not processed
+                    }
+                }
+            });
+    for (auto& worker : workers)
+        worker.join();
+    if (error)
+        std::rethrow_exception(error);
+}
+
+} // namespace pdal
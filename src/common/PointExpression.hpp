@@ -0,0 +1,102 @@
+#pragma once
+
+#include <pdal/PointLayout.hpp>
+#include <pdal/PointRef.hpp>
+
+#include "Expression.hpp"
+
+#include <string>
+#include <vector>
+
+namespace pdal
+{
+
+// Expression bound to the dimensions of a point layout
+class PointExpression
+{
+public:
+    // throws std::invalid_argument if the expression is invalid
+    void parse(const std::string& text) { m_expr.parse(text); }
+
+    bool empty() const { return m_expr.empty(); }
+    const Expression& expression() const { return m_expr; }
+
+    // resolves the dimensions of the expression; returns the name of an unknown dimension,
+    // or an empty string
+    std::string bind(const PointLayoutPtr layout)
+    {
+        m_dims.clear();
+        for (const std::string& name : m_expr.dimensionNames())
+        {
+            Dimension::Id id = layout->findDim(name);
+            if (id == Dimension::Id::Unknown)
+                return name;
+            m_dims.push_back(id);
+        }
+        return "";
+    }
+
+    double eval(PointRef& point) const
+    {
+        return m_expr.eval([&](size_t i) { return point.getFieldAs<double>(m_dims[i]); });
+    }
+
+    bool test(PointRef& point) const { return eval(point) != 0; }
+
+private:
+    Expression m_expr;
+    std::vector<Dimension::Id> m_dims;
+};
+
+// Assignment "Dimension = expression [WHERE condition]" bound to a point layout
+class PointAssignment
+{
+public:
+    // throws std::invalid_argument if the statement is invalid
+    void parse(const std::string& text)
+    {
+        AssignStatement statement;
+        statement.parse(text);
+        m_dimName = statement.dimension();
+        m_value.parse(statement.value().text());
+        m_condition = PointExpression();
+        if (!statement.condition().empty())
+            m_condition.parse(statement.condition().text());
+    }
+
+    const std::string& dimension() const { return m_dimName; }
+
+    // dimensions read by the value and the condition
+    std::vector<std::string> dimensionsRead() const
+    {
+        std::vector<std::string> names(m_value.expression().dimensionNames());
+        const std::vector<std::string>& condNames = m_condition.expression().dimensionNames();
+        names.insert(names.end(), condNames.begin(), condNames.end());
+        return names;
+    }
+
+    // returns the name of an unknown dimension, or an empty string
+    std::string bind(const PointLayoutPtr layout)
+    {
+        m_dim = layout->findDim(m_dimName);
+        if (m_dim == Dimension::Id::Unknown)
+            return m_dimName;
+        std::string unknown = m_value.bind(layout);
+        if (unknown.empty() && !m_condition.empty())
+            unknown = m_condition.bind(layout);
+        return unknown;
+    }
+
+    void apply(PointRef& point) const
+    {
+        if (m_condition.empty() || m_condition.test(point))
+            point.setField(m_dim, m_value.eval(point));
+    }
+
+private:
+    std::string m_dimName;
+    Dimension::Id m_dim = Dimension::Id::Unknown;
+    PointExpression m_value, m_condition;
+};
+
+} // namespace pdal
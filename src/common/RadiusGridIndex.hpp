@@ -0,0 +1,358 @@
+#pragma once
+
+#include "RadiusIndex.hpp"
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <limits>
+#include <numeric>
+#include <unordered_map>
+#include <vector>
+
+namespace pdal
+{
+
+// Uniform grid on the reference points, with cells of the size of the search radius (voxels in
+// 3d): a query only reads the 3x3 (3x3x3) cells around the query point. The buffer is reordered
+// by cell so that a cell is read contiguously, and by Z inside a cell: in 2d, the points inside
+// the cylinder limits are then found with a binary search.
+// The cells are stored in a dense array when the grid is not much larger than the number of
+// points, in a hash map otherwise.
+template <typename T>
+class RadiusGridIndex : public RadiusIndex
+{
+public:
+    RadiusGridIndex(const RadiusQuery& query, RefPointBuffer<T> buffer,
+                    ExactCoordsReader exactCoords = ExactCoordsReader())
+        : RadiusIndex(query, buffer.m_tolerance), m_query(query), m_buffer(std::move(buffer)),
+          m_exactCoords(exactCoords)
+    {
+        m_dims = query.m_search3d ? 3 : 2;
+        build();
+    }
+
+    using RadiusIndex::anyWithin;
+    using RadiusIndex::nearestWithin;
+
+    size_t size() const override { return m_buffer.size(); }
+
+    size_t memorySize() const override
+    {
+        return m_buffer.memorySize() + m_cellStart.size() * sizeof(uint32_t) +
+               m_cellRanges.size() * (sizeof(uint64_t) + 2 * sizeof(uint32_t) + 2 * sizeof(void*));
+    }
+
+    bool anyWithin(double x, double y, double z, const ApproxMatcher& matcher) const override
+    {
+        const double pruneR2 = matcher.pruneR2();
+        return scan(x, y, z, matcher, [pruneR2]() { return pruneR2; },
+                    [&](uint32_t i, double dist2, double zSrc)
+                    {
+                        Match match = matcher.test(dist2, zSrc, m_buffer.m_z[i]);
+                        return match == Match::Yes ||
+                               (match == Match::Unsure && exactMatch(i, x, y, z, matcher.query()));
+                    });
+    }
+
+    void allWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                   std::vector<uint64_t>& ids) const override
+    {
+        const double pruneR2 = matcher.pruneR2();
+        scan(x, y, z, matcher, [pruneR2]() { return pruneR2; },
+                 [&](uint32_t i, double dist2, double zSrc)
+                 {
+                     Match match = matcher.test(dist2, zSrc, m_buffer.m_z[i]);
+                     if (match == Match::Yes ||
+                         (match == Match::Unsure && exactMatch(i, x, y, z, matcher.query())))
+                         ids.push_back(m_buffer.m_ids[i]);
+                     return false;
+                 });
+    }
+
+    bool nearestWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                       double& dist2) const override
+    {
+        thread_local std::vector<NearestSearch::Candidate> candidates;
+        NearestSearch search(matcher, candidates);
+        scan(x, y, z, matcher, [&search]() { return search.bound(); },
+             [&](uint32_t i, double d, double zSrc)
+             {
+                 search.offer(i, d, zSrc, m_buffer.m_z[i]);
+                 return false;
+             });
+        return search.result([&](uint32_t i, double& d)
+                             { return exactMatch(i, x, y, z, matcher.query(), d); },
+                             dist2);
+    }
+
+private:
+    RadiusQuery m_query; // query the index was built for
+    RefPointBuffer<T> m_buffer;
+    ExactCoordsReader m_exactCoords;
+    int m_dims;
+
+    double m_min[3];
+    double m_cellSize;
+    int64_t m_size[3];
+
+    // dense grid: m_cellStart[cell] to m_cellStart[cell + 1] are the points of the cell
+    std::vector<uint32_t> m_cellStart;
+    // sparse grid: range of the points of the non-empty cells
+    std::unordered_map<uint64_t, std::pair<uint32_t, uint32_t>> m_cellRanges;
+    bool m_dense;
+
+    int64_t cellCoord(double v, int dim) const
+    {
+        if (dim >= m_dims)
+            return 0;
+        return static_cast<int64_t>(std::floor((v - m_min[dim]) / m_cellSize));
+    }
+
+    uint64_t cellKey(int64_t ix, int64_t iy, int64_t iz) const
+    {
+        return static_cast<uint64_t>(ix) +
+               static_cast<uint64_t>(m_size[0]) *
+                   (static_cast<uint64_t>(iy) + static_cast<uint64_t>(m_size[1]) * iz);
+    }
+
+    bool cellRange(int64_t ix, int64_t iy, int64_t iz, uint32_t& begin, uint32_t& end) const
+    {
+        uint64_t key = cellKey(ix, iy, iz);
+        if (m_dense)
+        {
+            begin = m_cellStart[key];
+            end = m_cellStart[key + 1];
+            return begin < end;
+        }
+        auto it = m_cellRanges.find(key);
+        if (it == m_cellRanges.end())
+            return false;
+        begin = it->second.first;
+        end = it->second.second;
+        return true;
+    }
+
+    bool exactMatch(uint32_t i, double x, double y, double z, const RadiusQuery& query,
+                    double& dist2) const
+    {
+        double xRef, yRef, zRef;
+        m_exactCoords(m_buffer.m_ids[i], xRef, yRef, zRef);
+        return query.accept(x, y, z, xRef, yRef, zRef, dist2);
+    }
+
+    bool exactMatch(uint32_t i, double x, double y, double z, const RadiusQuery& query) const
+    {
+        double dist2;
+        return exactMatch(i, x, y, z, query, dist2);
+    }
+
+    // Reads the points of the cells around the query point that are inside the Z limits (up to
+    // the rounding errors), starting with the cell of the query point. The cells farther than
+    // bound() are skipped. visit(i, dist2, zSrc) is called on each point with its squared distance
+    // on the stored coordinates, and stops the scan when it returns true.
+    template <typename Bound, typename Visit>
+    bool scan(double x, double y, double z, const ApproxMatcher& matcher, const Bound& bound,
+              const Visit& visit) const
+    {
+        if (m_buffer.size() == 0)
+            return false;
+
+        const double q[3] = {x - m_buffer.m_originX, y - m_buffer.m_originY,
+                             z - m_buffer.m_originZ};
+        int64_t c[3];
+        for (int d = 0; d < 3; ++d)
+            c[d] = cellCoord(q[d], d);
+
+        // bounds of the Z values inside the cylinder (with a margin for the rounding errors: the
+        // points are then tested exactly)
+        double zLow = -std::numeric_limits<double>::infinity();
+        double zHigh = std::numeric_limits<double>::infinity();
+        const RadiusQuery& query = matcher.query();
+        if (query.zLimited())
+        {
+            double margin = matcher.zMargin() + 1e-7;
+            if (query.m_max2d_below >= 0)
+                zLow = q[2] - query.m_max2d_below - margin;
+            if (query.m_max2d_above >= 0)
+                zHigh = q[2] + query.m_max2d_above + margin;
+        }
+
+        VisitCounter visited;
+        auto scanCell = [&](int64_t ix, int64_t iy, int64_t iz)
+        {
+            uint32_t begin, end;
+            if (!cellRange(ix, iy, iz, begin, end))
+                return false;
+            if (zLow > -std::numeric_limits<double>::infinity())
+                begin = std::lower_bound(m_buffer.m_z.begin() + begin, m_buffer.m_z.begin() + end,
+                                         zLow, [](T a, double b) { return a < b; }) -
+                        m_buffer.m_z.begin();
+            for (uint32_t i = begin; i < end; ++i)
+            {
+                if (m_buffer.m_z[i] > zHigh)
+                    break;
+                visited.m_count++;
+                double dx = q[0] - m_buffer.m_x[i];
+                double dy = q[1] - m_buffer.m_y[i];
+                double dist = dx * dx + dy * dy;
+                if (m_dims == 3)
+                {
+                    double dz = q[2] - m_buffer.m_z[i];
+                    dist += dz * dz;
+                }
+                if (dist <= bound() && visit(i, dist, q[2]))
+                    return true;
+            }
+            return false;
+        };
+
+        bool inside = true;
+        for (int d = 0; d < m_dims; ++d)
+            inside = inside && c[d] >= 0 && c[d] < m_size[d];
+        if (inside && scanCell(c[0], c[1], c[2]))
+            return true;
+
+        int64_t zFrom = (m_dims == 3) ? c[2] - 1 : 0, zTo = (m_dims == 3) ? c[2] + 1 : 0;
+        for (int64_t iz = std::max<int64_t>(zFrom, 0); iz <= std::min<int64_t>(zTo, m_size[2] - 1); ++iz)
+            for (int64_t iy = std::max<int64_t>(c[1] - 1, 0); iy <= std::min<int64_t>(c[1] + 1, m_size[1] - 1); ++iy)
+                for (int64_t ix = std::max<int64_t>(c[0] - 1, 0); ix <= std::min<int64_t>(c[0] + 1, m_size[0] - 1); ++ix)
+                {
+                    if (ix == c[0] && iy == c[1] && iz == c[2])
+                        continue;
+                    const int64_t cell[3] = {ix, iy, iz};
+                    if (cellDist2(cell, q) > bound())
+                        continue;
+                    if (scanCell(ix, iy, iz))
+                        return true;
+                }
+        return false;
+    }
+
+    // squared distance from the query point to a cell (enlarged by the rounding error on the
+    // cell of a point)
+    double cellDist2(const int64_t cell[3], const double q[3]) const
+    {
+        const double eps = m_cellSize * 1e-9 + 1e-9;
+        double dist = 0;
+        for (int d = 0; d < m_dims; ++d)
+        {
+            double low = m_min[d] + cell[d] * m_cellSize - eps;
+            double high = m_min[d] + (cell[d] + 1) * m_cellSize + eps;
+            double delta = 0;
+            if (q[d] < low)
+                delta = low - q[d];
+            else if (q[d] > high)
+                delta = q[d] - high;
+            dist += delta * delta;
+        }
+        return dist;
+    }
+
+    void build()
+    {
+        const size_t count = m_buffer.size();
+        m_size[0] = m_size[1] = m_size[2] = 1;
+        m_min[0] = m_min[1] = m_min[2] = 0;
+        m_cellSize = 1;
+        m_dense = true;
+        m_cellStart.assign(2, 0);
+        if (count == 0)
+            return;
+
+        double max[3];
+        for (int d = 0; d < 3; ++d)
+        {
+            const std::vector<T>& coords = coordsOf(d);
+            auto minmax = std::minmax_element(coords.begin(), coords.end());
+            m_min[d] = *minmax.first;
+            max[d] = *minmax.second;
+        }
+
+        // a neighbor closer than the radius is at most one cell away as long as the cells are
+        // larger than the radius (plus the uncertainty on the stored coordinates); the cells are
+        // enlarged if needed so that the cell keys fit in 64 bits
+        m_cellSize = (m_query.m_radius + 2 * m_matcher.zMargin() * m_dims) * (1 + 1e-6) + 1e-6;
+        for (int d = 0; d < m_dims; ++d)
+            m_cellSize = std::max(m_cellSize, (max[d] - m_min[d]) / (1 << 20));
+        double cellCount = 1;
+        for (int d = 0; d < m_dims; ++d)
+        {
+            m_size[d] = cellCoord(max[d], d) + 1;
+            cellCount *= m_size[d];
+        }
+        m_dense = (cellCount <= 2. * count + 1024);
+
+        // counting sort of the points by cell (linear time)
+        std::vector<uint64_t> keys(count);
+        for (size_t i = 0; i < count; ++i)
+            keys[i] = cellKey(cellCoord(m_buffer.m_x[i], 0), cellCoord(m_buffer.m_y[i], 1),
+                              cellCoord(m_buffer.m_z[i], 2));
+
+        std::vector<uint32_t> order(count);
+        if (m_dense)
+        {
+            m_cellStart.assign(static_cast<size_t>(cellCount) + 1, 0);
+            for (uint64_t key : keys)
+                m_cellStart[key + 1]++;
+            std::partial_sum(m_cellStart.begin(), m_cellStart.end(), m_cellStart.begin());
+            std::vector<uint32_t> next(m_cellStart.begin(), m_cellStart.end() - 1);
+            for (size_t i = 0; i < count; ++i)
+                order[next[keys[i]]++] = i;
+        }
+        else
+        {
+            std::vector<uint32_t>().swap(m_cellStart);
+            m_cellRanges.reserve(count);
+            for (uint64_t key : keys)
+                m_cellRanges[key].second++;
+            uint32_t start = 0;
+            for (auto& cell : m_cellRanges)
+            {
+                uint32_t size = cell.second.second;
+                cell.second = std::make_pair(start, start);
+                start += size;
+            }
+            for (size_t i = 0; i < count; ++i)
+                order[m_cellRanges[keys[i]].second++] = i;
+        }
+
+        // sort each cell by Z
+        auto sortCell = [&](uint32_t begin, uint32_t end)
+        {
+            std::sort(order.begin() + begin, order.begin() + end, [this](uint32_t a, uint32_t b)
+                      { return m_buffer.m_z[a] < m_buffer.m_z[b]; });
+        };
+        if (m_dense)
+        {
+            for (size_t cell = 0; cell + 1 < m_cellStart.size(); ++cell)
+                if (m_cellStart[cell + 1] - m_cellStart[cell] > 1)
+                    sortCell(m_cellStart[cell], m_cellStart[cell + 1]);
+        }
+        else
+        {
+            for (auto& cell : m_cellRanges)
+                sortCell(cell.second.first, cell.second.second);
+        }
+
+        // reorder the buffer by cell
+        std::vector<T> tmp(count);
+        for (std::vector<T>* coords : {&m_buffer.m_x, &m_buffer.m_y, &m_buffer.m_z})
+        {
+            for (size_t i = 0; i < count; ++i)
+                tmp[i] = (*coords)[order[i]];
+            coords->swap(tmp);
+        }
+        std::vector<uint64_t> ids(count);
+        for (size_t i = 0; i < count; ++i)
+            ids[i] = m_buffer.m_ids[order[i]];
+        m_buffer.m_ids.swap(ids);
+    }
+
+    const std::vector<T>& coordsOf(int dim) const
+    {
+        return dim == 0 ? m_buffer.m_x : (dim == 1 ? m_buffer.m_y : m_buffer.m_z);
+    }
+};
+
+} // namespace pdal
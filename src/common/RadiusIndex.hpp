@@ -0,0 +1,325 @@
+#pragma once
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+#include <functional>
+#include <vector>
+
+namespace pdal
+{
+
+// Parameters of a radius search: a ball (is3d) or a cylinder limited in Z (2d)
+struct RadiusQuery
+{
+    double m_radius;
+    bool m_search3d;
+    double m_max2d_above, m_max2d_below;
+
+    bool zLimited() const
+    {
+        return !m_search3d && (m_max2d_above >= 0 || m_max2d_below >= 0);
+    }
+
+    // true if a reference point at Zref is inside the Z limits of a source point at Zsrc
+    bool acceptZ(double Zsrc, double Zref) const
+    {
+        if (m_max2d_above >= 0 && Zref > Zsrc && (Zref - Zsrc) > m_max2d_above) return false;
+        if (m_max2d_below >= 0 && Zsrc > Zref && (Zsrc - Zref) > m_max2d_below) return false;
+        return true;
+    }
+
+    // exact test of a reference point against a source point, on the original coordinates;
+    // dist2 is set to their squared distance (2d or 3d)
+    bool accept(double xSrc, double ySrc, double zSrc, double xRef, double yRef, double zRef,
+                double& dist2) const
+    {
+        double dx = xSrc - xRef;
+        double dy = ySrc - yRef;
+        dist2 = dx * dx + dy * dy;
+        if (m_search3d)
+        {
+            double dz = zSrc - zRef;
+            dist2 += dz * dz;
+        }
+        if (dist2 >= m_radius * m_radius)
+            return false;
+        return !zLimited() || acceptZ(zSrc, zRef);
+    }
+
+    bool accept(double xSrc, double ySrc, double zSrc, double xRef, double yRef, double zRef) const
+    {
+        double dist2;
+        return accept(xSrc, ySrc, zSrc, xRef, yRef, zRef, dist2);
+    }
+
+    // the same query seen from the reference points: a source point is inside the limits of a
+    // reference point for the reversed query iff the reference point is inside the limits of the
+    // source point for this query (the distances and the Z differences are computed the same way)
+    RadiusQuery reversed() const
+    {
+        return RadiusQuery {m_radius, m_search3d, m_max2d_below, m_max2d_above};
+    }
+};
+
+// Number of reference points read by the searches of the current thread: a filter reads it before
+// and after a search to know how many points the search visited
+inline uint64_t& visitedPoints()
+{
+    thread_local uint64_t count = 0;
+    return count;
+}
+
+// Counts the points read by a search, added to visitedPoints() at the end of the search (a single
+// access to the thread local counter per search)
+struct VisitCounter
+{
+    uint64_t m_count = 0;
+    ~VisitCounter() { visitedPoints() += m_count; }
+};
+
+// Reads the original coordinates of a reference point (from its id in the point view)
+typedef std::function<void(uint64_t, double&, double&, double&)> ExactCoordsReader;
+
+// Coordinates of the reference points as a structure of arrays, stored as offsets from a local
+// origin. With T=float, a stored coordinate is known up to m_tolerance: the indexes then only
+// use the original coordinates (ExactCoordsReader) for the few points that are too close to the
+// radius or to the Z limits to decide.
+template <typename T>
+struct RefPointBuffer
+{
+    double m_originX = 0, m_originY = 0, m_originZ = 0;
+    double m_tolerance = 0; // bound of the error on a stored coordinate (0: exact coordinates)
+    std::vector<T> m_x, m_y, m_z;
+    std::vector<uint64_t> m_ids; // ids of the points in the filtered view
+
+    void reserve(size_t size)
+    {
+        m_x.reserve(size);
+        m_y.reserve(size);
+        m_z.reserve(size);
+        m_ids.reserve(size);
+    }
+
+    void push(double x, double y, double z, uint64_t id)
+    {
+        m_x.push_back(static_cast<T>(x - m_originX));
+        m_y.push_back(static_cast<T>(y - m_originY));
+        m_z.push_back(static_cast<T>(z - m_originZ));
+        m_ids.push_back(id);
+    }
+
+    size_t size() const { return m_ids.size(); }
+
+    size_t memorySize() const { return size() * (3 * sizeof(T) + sizeof(uint64_t)); }
+};
+
+// Largest error made by storing as a float an offset up to maxOffset (half an ulp)
+inline double floatTolerance(double maxOffset)
+{
+    return std::ldexp(maxOffset, -24);
+}
+
+// Result of the test of a reference point when its coordinates are known up to a tolerance
+enum class Match { No, Yes, Unsure };
+
+// Test of a reference point on the stored coordinates, (dx, dy, dz) being the offsets from the
+// source point to the reference point computed on the stored coordinates.
+class ApproxMatcher
+{
+public:
+    ApproxMatcher(const RadiusQuery& query, double tolerance) : m_query(query)
+    {
+        m_zLimited = query.zLimited();
+        m_r2 = query.m_radius * query.m_radius;
+        m_exact = (tolerance == 0);
+        // bound of the error on the distance and on a Z difference (with a margin for the
+        // rounding of the computation itself)
+        double dims = query.m_search3d ? 3 : 2;
+        m_distMargin = std::sqrt(dims) * tolerance * 1.01 + 1e-9;
+        m_zMargin = tolerance * 1.01 + 1e-9;
+        double inner = std::max(query.m_radius - m_distMargin, 0.);
+        m_innerR2 = inner * inner;
+        m_outerR2 = (query.m_radius + m_distMargin) * (query.m_radius + m_distMargin);
+        m_pruneR2 = m_exact ? m_r2 : m_outerR2;
+    }
+
+    const RadiusQuery& query() const { return m_query; }
+
+    // squared distance above which a box can be skipped
+    double pruneR2() const { return m_pruneR2; }
+    double zMargin() const { return m_exact ? 0 : m_zMargin; }
+    // bound of the error on a distance computed on the stored coordinates
+    double distMargin() const { return m_exact ? 0 : m_distMargin; }
+
+    Match test(double dist2, double zSrc, double zRef) const
+    {
+        if (m_exact)
+        {
+            if (dist2 >= m_r2)
+                return Match::No;
+            return (!m_zLimited || m_query.acceptZ(zSrc, zRef)) ? Match::Yes : Match::No;
+        }
+
+        if (dist2 > m_outerR2)
+            return Match::No;
+        bool unsure = (dist2 >= m_innerR2);
+        if (m_zLimited)
+        {
+            double dz = zRef - zSrc;
+            if (nearZ(dz, 0) || (m_query.m_max2d_above >= 0 && nearZ(dz, m_query.m_max2d_above)) ||
+                (m_query.m_max2d_below >= 0 && nearZ(dz, -m_query.m_max2d_below)))
+                unsure = true;
+            else if (!m_query.acceptZ(zSrc, zRef))
+                return Match::No;
+        }
+        return unsure ? Match::Unsure : Match::Yes;
+    }
+
+private:
+    RadiusQuery m_query;
+    bool m_zLimited, m_exact;
+    double m_r2, m_innerR2, m_outerR2, m_pruneR2;
+    double m_distMargin, m_zMargin;
+
+    bool nearZ(double dz, double limit) const { return std::fabs(dz - limit) <= m_zMargin; }
+};
+
+// Search of the nearest reference point on the stored coordinates. The points that may be the
+// nearest one (up to the error on the stored coordinates) are kept as candidates, which are
+// resolved on the original coordinates at the end of the search.
+class NearestSearch
+{
+public:
+    struct Candidate
+    {
+        uint32_t m_index;
+        double m_dist2;
+    };
+
+    NearestSearch(const ApproxMatcher& matcher, std::vector<Candidate>& candidates)
+        : m_matcher(matcher), m_candidates(candidates)
+    {
+        m_candidates.clear();
+        m_margin = matcher.distMargin();
+        m_bestUpper = matcher.query().m_radius * matcher.query().m_radius;
+        m_bound = matcher.pruneR2();
+    }
+
+    // squared distance on the stored coordinates above which a point can't be the nearest one
+    double bound() const { return m_bound; }
+
+    void offer(uint32_t index, double dist2, double zSrc, double zRef)
+    {
+        if (dist2 > m_bound)
+            return;
+        Match match = m_matcher.test(dist2, zSrc, zRef);
+        if (match == Match::No)
+            return;
+        if (match == Match::Yes)
+        {
+            // the point is in the query: the nearest one is at most at its distance (+ margin)
+            double upper = widen(dist2);
+            if (upper < m_bestUpper)
+            {
+                m_bestUpper = upper;
+                m_bound = widen(upper);
+            }
+        }
+        if (m_candidates.size() >= 256)
+            m_candidates.erase(std::remove_if(m_candidates.begin(), m_candidates.end(),
+                                              [this](const Candidate& c) { return c.m_dist2 > m_bound; }),
+                               m_candidates.end());
+        m_candidates.push_back(Candidate {index, dist2});
+    }
+
+    // exactDist2(index, dist2) computes the squared distance of a candidate on the original
+    // coordinates, and returns false if the candidate is out of the query. Returns false if no
+    // point is in the query.
+    template <typename ExactDist2>
+    bool result(const ExactDist2& exactDist2, double& dist2) const
+    {
+        bool found = false;
+        for (const Candidate& candidate : m_candidates)
+        {
+            if (candidate.m_dist2 > m_bound)
+                continue;
+            double d = candidate.m_dist2;
+            // with exact stored coordinates, all the candidates are in the query
+            if (m_margin != 0 && !exactDist2(candidate.m_index, d))
+                continue;
+            if (!found || d < dist2)
+            {
+                dist2 = d;
+                found = true;
+            }
+        }
+        return found;
+    }
+
+private:
+    const ApproxMatcher& m_matcher;
+    std::vector<Candidate>& m_candidates;
+    double m_margin, m_bestUpper, m_bound;
+
+    double widen(double dist2) const
+    {
+        if (m_margin == 0)
+            return dist2;
+        double dist = std::sqrt(dist2) + m_margin;
+        return dist * dist;
+    }
+};
+
+// Index on reference points for "is there at least one reference point near this point?",
+// "how far is the nearest reference point?" and "which reference points are near this point?"
+// queries
+class RadiusIndex
+{
+public:
+    virtual ~RadiusIndex() {}
+
+    // true if at least one reference point is closer than the query radius from (x, y, z), and
+    // inside the Z limits in 2d
+    bool anyWithin(double x, double y, double z) const { return anyWithin(x, y, z, m_matcher); }
+
+    // same, with another query (see makeMatcher)
+    virtual bool anyWithin(double x, double y, double z, const ApproxMatcher& matcher) const = 0;
+
+    // true if at least one reference point is in the query, dist2 being then the squared distance
+    // (2d or 3d) to the nearest one, computed on the original coordinates
+    bool nearestWithin(double x, double y, double z, double& dist2) const
+    {
+        return nearestWithin(x, y, z, m_matcher, dist2);
+    }
+
+    virtual bool nearestWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                               double& dist2) const = 0;
+
+    // appends to ids the ids (in the point view) of all the reference points in the query
+    virtual void allWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                           std::vector<uint64_t>& ids) const = 0;
+
+    // matcher for another query on the same index: only the Z limits may differ from the query
+    // the index was built for (or a smaller radius)
+    ApproxMatcher makeMatcher(const RadiusQuery& query) const
+    {
+        return ApproxMatcher(query, m_tolerance);
+    }
+
+    virtual size_t size() const = 0;
+
+    // approximate memory used by the index, in bytes
+    virtual size_t memorySize() const = 0;
+
+protected:
+    RadiusIndex(const RadiusQuery& query, double tolerance)
+        : m_matcher(query, tolerance), m_tolerance(tolerance)
+    {
+    }
+
+    ApproxMatcher m_matcher;
+    double m_tolerance;
+};
+
+} // namespace pdal
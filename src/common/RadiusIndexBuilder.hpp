@@ -0,0 +1,108 @@
+#pragma once
+
+#include "RadiusGridIndex.hpp"
+#include "RadiusKDTree.hpp"
+
+#include <pdal/PointView.hpp>
+
+#include <algorithm>
+#include <memory>
+#include <string>
+
+namespace pdal
+{
+
+// Coordinates of the points of a view, read through the view
+struct ViewCoords
+{
+    const PointView* m_view;
+
+    double x(PointId id) const { return m_view->getFieldAs<double>(Dimension::Id::X, id); }
+    double y(PointId id) const { return m_view->getFieldAs<double>(Dimension::Id::Y, id); }
+    double z(PointId id) const { return m_view->getFieldAs<double>(Dimension::Id::Z, id); }
+};
+
+// Coordinates of the points of a view copied in arrays, by point id
+struct ArrayCoords
+{
+    const double *m_x, *m_y, *m_z;
+
+    double x(PointId id) const { return m_x[id]; }
+    double y(PointId id) const { return m_y[id]; }
+    double z(PointId id) const { return m_z[id]; }
+};
+
+namespace radius_index
+{
+
+template <typename Coords, typename T>
+void gatherRefPoints(const Coords& coords, const PointIdList& refIds, RefPointBuffer<T>& buffer)
+{
+    buffer.reserve(refIds.size());
+    for (PointId id : refIds)
+        buffer.push(coords.x(id), coords.y(id), coords.z(id), id);
+}
+
+template <typename T>
+RadiusIndex* makeIndex(const std::string& indexType, const RadiusQuery& query,
+                       RefPointBuffer<T> buffer, ExactCoordsReader exactCoords)
+{
+    if (indexType == "grid")
+        return new RadiusGridIndex<T>(query, std::move(buffer), exactCoords);
+    return new RadiusKDTree<T>(query, std::move(buffer), exactCoords);
+}
+
+} // namespace radius_index
+
+// Builds the index ('kdtree' or 'grid') of the points refIds, whose bounds are refBounds, read
+// from coords (ViewCoords or ArrayCoords). The coordinates are stored as float offsets from the
+// center of the reference points when the rounding error is negligible compared to the radius
+// (the few points too close to the radius or to the Z limits to decide are then tested on the
+// original coordinates), as doubles otherwise. The index reads coords for these exact tests: it
+// must not outlive the view or the arrays.
+template <typename Coords>
+std::unique_ptr<RadiusIndex> buildRadiusIndex(const Coords& coords, const PointIdList& refIds,
+                                              const BOX3D& refBounds, const RadiusQuery& query,
+                                              const std::string& indexType)
+{
+    using namespace radius_index;
+
+    double originX = (refBounds.minx + refBounds.maxx) / 2;
+    double originY = (refBounds.miny + refBounds.maxy) / 2;
+    double originZ = (refBounds.minz + refBounds.maxz) / 2;
+    double maxOffset = std::max({refBounds.maxx - originX, refBounds.maxy - originY,
+                                 refBounds.maxz - originZ});
+    double tolerance = floatTolerance(maxOffset);
+
+    if (!refIds.empty() && tolerance <= query.m_radius * 1e-4)
+    {
+        RefPointBuffer<float> buffer;
+        buffer.m_originX = originX;
+        buffer.m_originY = originY;
+        buffer.m_originZ = originZ;
+        buffer.m_tolerance = tolerance;
+        gatherRefPoints(coords, refIds, buffer);
+
+        ExactCoordsReader exactCoords = [coords](uint64_t id, double& x, double& y, double& z)
+        {
+            x = coords.x(id);
+            y = coords.y(id);
+            z = coords.z(id);
+        };
+        return std::unique_ptr<RadiusIndex>(makeIndex(indexType, query, std::move(buffer), exactCoords));
+    }
+
+    RefPointBuffer<double> buffer;
+    gatherRefPoints(coords, refIds, buffer);
+    return std::unique_ptr<RadiusIndex>(makeIndex(indexType, query, std::move(buffer), ExactCoordsReader()));
+}
+
+// Index of the points refIds of the view
+inline std::unique_ptr<RadiusIndex> buildRadiusIndex(const PointView& view, const PointIdList& refIds,
+                                                     const BOX3D& refBounds, const RadiusQuery& query,
+                                                     const std::string& indexType)
+{
+    return buildRadiusIndex(ViewCoords {&view}, refIds, refBounds, query, indexType);
+}
+
+} // namespace pdal
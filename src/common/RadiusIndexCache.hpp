@@ -0,0 +1,194 @@
+#pragma once
+
+#include "RadiusIndex.hpp"
+
+#include <cstdint>
+#include <cstring>
+#include <list>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <set>
+#include <string>
+#include <tuple>
+
+namespace pdal
+{
+
+class BasePointTable;
+class PointView;
+
+// Hash of a set of reference points (their ids and coordinates): two stages that select the same
+// points at the same position get the same hash.
+class RefPointsHash
+{
+public:
+    void add(uint64_t id, double x, double y, double z)
+    {
+        m_hash = mix(m_hash ^ id);
+        m_hash = mix(m_hash ^ bits(x));
+        m_hash = mix(m_hash ^ bits(y));
+        m_hash = mix(m_hash ^ bits(z));
+    }
+
+    uint64_t value() const { return m_hash; }
+
+private:
+    uint64_t m_hash = 0;
+
+    static uint64_t bits(double v)
+    {
+        uint64_t b;
+        std::memcpy(&b, &v, sizeof(b));
+        return b;
+    }
+
+    // splitmix64 finalizer
+    static uint64_t mix(uint64_t h)
+    {
+        h += 0x9e3779b97f4a7c15ULL;
+        h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+        h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+        return h ^ (h >> 31);
+    }
+};
+
+// Cache of the indexes on reference points, shared by the stages of the same plugin: a stage
+// whose reference points are the same as the ones of a previous stage (same point view, same
+// ids, same coordinates) reuses its index instead of building it again.
+// The indexes are keyed by the ownership of their point view (not by its address, which can be
+// reused by a new view once the view is freed). The least recently used indexes are evicted when
+// the cache is larger than its budget, and the indexes of a freed view are released at the next
+// use of the cache. The stages that use the cache register as consumers of their point table when
+// they are prepared: the indexes of the table are released as soon as the last of them is done,
+// and otherwise (failed execution) when the stages are destroyed with their pipeline.
+class RadiusIndexCache
+{
+public:
+    struct Key
+    {
+        std::weak_ptr<PointView> m_view;
+        uint64_t m_refHash;
+        size_t m_refCount;
+        std::string m_indexType;
+        bool m_search3d;
+        double m_radius; // the kd-tree can be used with any radius: 0 for a kd-tree
+
+        bool operator==(const Key& other) const
+        {
+            return sameView(other.m_view) &&
+                   std::tie(m_refHash, m_refCount, m_indexType, m_search3d, m_radius) ==
+                   std::tie(other.m_refHash, other.m_refCount, other.m_indexType, other.m_search3d,
+                            other.m_radius);
+        }
+
+        bool sameView(const std::weak_ptr<PointView>& view) const
+        {
+            return !m_view.owner_before(view) && !view.owner_before(m_view);
+        }
+    };
+
+    static RadiusIndexCache& instance()
+    {
+        static RadiusIndexCache cache;
+        return cache;
+    }
+
+    // nullptr if the index is not in the cache
+    std::shared_ptr<RadiusIndex> get(const Key& key)
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        releaseExpired();
+        for (auto it = m_entries.begin(); it != m_entries.end(); ++it)
+            if (it->m_key == key)
+            {
+                m_entries.splice(m_entries.begin(), m_entries, it);
+                return it->m_index;
+            }
+        return nullptr;
+    }
+
+    // adds an index of a view of table, then evicts the least recently used indexes until the
+    // cache fits in budget bytes (the new index is kept only if it fits alone)
+    void put(const Key& key, const BasePointTable* table, std::shared_ptr<RadiusIndex> index,
+             size_t budget)
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        releaseExpired();
+        m_entries.push_front(Entry {key, table, index, index->memorySize()});
+        m_size += m_entries.front().m_size;
+        while (m_size > budget && !m_entries.empty())
+        {
+            m_size -= m_entries.back().m_size;
+            m_entries.pop_back();
+        }
+    }
+
+    // releases the indexes of a point view
+    void release(const std::weak_ptr<PointView>& view)
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        releaseIf([&](const Entry& entry) { return entry.m_key.sameView(view); });
+    }
+
+    // registers a stage that will use the cache for the views of table (a stage registered
+    // several times is counted once)
+    void addConsumer(const BasePointTable* table, const void* stage)
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_consumers[table].insert(stage);
+    }
+
+    // the stage no longer uses the cache: the indexes of table are released with its last consumer
+    void removeConsumer(const BasePointTable* table, const void* stage)
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        auto it = m_consumers.find(table);
+        if (it == m_consumers.end())
+            return;
+        it->second.erase(stage);
+        if (!it->second.empty())
+            return;
+        m_consumers.erase(it);
+        releaseIf([&](const Entry& entry) { return entry.m_table == table; });
+    }
+
+private:
+    struct Entry
+    {
+        Key m_key;
+        const BasePointTable* m_table;
+        std::shared_ptr<RadiusIndex> m_index;
+        size_t m_size;
+    };
+
+    std::mutex m_mutex;
+    std::list<Entry> m_entries; // most recently used first
+    size_t m_size = 0;
+    std::map<const BasePointTable*, std::set<const void*>> m_consumers; // stages not done yet
+
+    RadiusIndexCache() {}
+
+    // releases the indexes of the freed views (called with the mutex locked)
+    void releaseExpired()
+    {
+        releaseIf([](const Entry& entry) { return entry.m_key.m_view.expired(); });
+    }
+
+    template <typename Predicate>
+    void releaseIf(const Predicate& predicate)
+    {
+        for (auto it = m_entries.begin(); it != m_entries.end();)
+        {
+            if (predicate(*it))
+            {
+                m_size -= it->m_size;
+                it = m_entries.erase(it);
+            }
+            else
+                ++it;
+        }
+    }
+};
+
+} // namespace pdal
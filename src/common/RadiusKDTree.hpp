@@ -0,0 +1,280 @@
+#pragma once
+
+#include "RadiusIndex.hpp"
+
+#include <algorithm>
+#include <cstdint>
+#include <numeric>
+#include <vector>
+
+namespace pdal
+{
+
+// Static kd-tree dedicated to radius queries (any point, or nearest point, within the radius).
+// The reference buffer is reordered by leaf order so that a leaf is read contiguously, and each
+// node keeps its bounding box in X, Y and Z: in 2d, the Z extent of a node is used to skip the
+// nodes that are entirely out of the cylinder limits.
+template <typename T>
+class RadiusKDTree : public RadiusIndex
+{
+public:
+    RadiusKDTree(const RadiusQuery& query, RefPointBuffer<T> buffer,
+                 ExactCoordsReader exactCoords = ExactCoordsReader())
+        : RadiusIndex(query, buffer.m_tolerance), m_query(query), m_buffer(std::move(buffer)),
+          m_exactCoords(exactCoords)
+    {
+        m_dims = query.m_search3d ? 3 : 2;
+        build();
+    }
+
+    using RadiusIndex::anyWithin;
+    using RadiusIndex::nearestWithin;
+
+    size_t size() const override { return m_buffer.size(); }
+
+    size_t memorySize() const override
+    {
+        return m_buffer.memorySize() + m_nodes.size() * sizeof(Node);
+    }
+
+    // The search stops on the first point found and does not allocate.
+    bool anyWithin(double x, double y, double z, const ApproxMatcher& matcher) const override
+    {
+        const double pruneR2 = matcher.pruneR2();
+        return traverse(x, y, z, matcher, [pruneR2]() { return pruneR2; },
+                        [&](uint32_t i, double dist2, double zSrc)
+                        {
+                            Match match = matcher.test(dist2, zSrc, m_buffer.m_z[i]);
+                            return match == Match::Yes ||
+                                   (match == Match::Unsure && exactMatch(i, x, y, z, matcher.query()));
+                        });
+    }
+
+    // The search radius shrinks to the distance of the nearest point found so far.
+    void allWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                   std::vector<uint64_t>& ids) const override
+    {
+        const double pruneR2 = matcher.pruneR2();
+        traverse(x, y, z, matcher, [pruneR2]() { return pruneR2; },
+                 [&](uint32_t i, double dist2, double zSrc)
+                 {
+                     Match match = matcher.test(dist2, zSrc, m_buffer.m_z[i]);
+                     if (match == Match::Yes ||
+                         (match == Match::Unsure && exactMatch(i, x, y, z, matcher.query())))
+                         ids.push_back(m_buffer.m_ids[i]);
+                     return false;
+                 });
+    }
+
+    bool nearestWithin(double x, double y, double z, const ApproxMatcher& matcher,
+                       double& dist2) const override
+    {
+        thread_local std::vector<NearestSearch::Candidate> candidates;
+        NearestSearch search(matcher, candidates);
+        traverse(x, y, z, matcher, [&search]() { return search.bound(); },
+                 [&](uint32_t i, double d, double zSrc)
+                 {
+                     search.offer(i, d, zSrc, m_buffer.m_z[i]);
+                     return false;
+                 });
+        return search.result([&](uint32_t i, double& d)
+                             { return exactMatch(i, x, y, z, matcher.query(), d); },
+                             dist2);
+    }
+
+private:
+    static const uint32_t LeafSize = 16;
+    static const int MaxDepth = 128;
+
+    struct Node
+    {
+        T m_min[3], m_max[3];
+        uint32_t m_begin, m_end;
+        int32_t m_left, m_right; // -1 for leaves
+        int32_t m_splitDim;
+        T m_splitValue;
+    };
+
+    RadiusQuery m_query; // query the index was built for
+    RefPointBuffer<T> m_buffer;
+    ExactCoordsReader m_exactCoords;
+    int m_dims;
+    std::vector<Node> m_nodes;
+    std::vector<uint32_t> m_order;
+
+    T coord(uint32_t id, int dim) const
+    {
+        return dim == 0 ? m_buffer.m_x[id] : (dim == 1 ? m_buffer.m_y[id] : m_buffer.m_z[id]);
+    }
+
+    bool exactMatch(uint32_t i, double x, double y, double z, const RadiusQuery& query,
+                    double& dist2) const
+    {
+        double xRef, yRef, zRef;
+        m_exactCoords(m_buffer.m_ids[i], xRef, yRef, zRef);
+        return query.accept(x, y, z, xRef, yRef, zRef, dist2);
+    }
+
+    bool exactMatch(uint32_t i, double x, double y, double z, const RadiusQuery& query) const
+    {
+        double dist2;
+        return exactMatch(i, x, y, z, query, dist2);
+    }
+
+    // Depth-first search of the nodes closer than bound() to the query point, the nearest child
+    // first. visit(i, dist2, zSrc) is called on the points closer than bound() (on the stored
+    // coordinates), and stops the search when it returns true.
+    template <typename Bound, typename Visit>
+    bool traverse(double x, double y, double z, const ApproxMatcher& matcher, const Bound& bound,
+                  const Visit& visit) const
+    {
+        if (m_nodes.empty())
+            return false;
+
+        const double q[3] = {x - m_buffer.m_originX, y - m_buffer.m_originY,
+                             z - m_buffer.m_originZ};
+        const bool zLimited = matcher.query().zLimited();
+        VisitCounter visited;
+
+        uint32_t stack[MaxDepth];
+        int top = 0;
+        stack[top++] = 0;
+        while (top > 0)
+        {
+            const Node& node = m_nodes[stack[--top]];
+
+            if (minDist2(node, q) > bound())
+                continue;
+            if (zLimited && !nodeInZLimits(node, q[2], matcher))
+                continue;
+
+            if (node.m_left < 0)
+            {
+                for (uint32_t i = node.m_begin; i < node.m_end; ++i)
+                {
+                    visited.m_count++;
+                    double dx = q[0] - m_buffer.m_x[i];
+                    double dy = q[1] - m_buffer.m_y[i];
+                    double dist = dx * dx + dy * dy;
+                    if (m_dims == 3)
+                    {
+                        double dz = q[2] - m_buffer.m_z[i];
+                        dist += dz * dz;
+                    }
+                    if (dist <= bound() && visit(i, dist, q[2]))
+                        return true;
+                }
+            }
+            else
+            {
+                // visit first the child on the side of the query point
+                uint32_t nearChild = node.m_left, farChild = node.m_right;
+                if (q[node.m_splitDim] >= node.m_splitValue)
+                    std::swap(nearChild, farChild);
+                stack[top++] = farChild;
+                stack[top++] = nearChild;
+            }
+        }
+        return false;
+    }
+
+    void build()
+    {
+        m_order.resize(m_buffer.size());
+        std::iota(m_order.begin(), m_order.end(), 0);
+        if (!m_order.empty())
+            buildNode(0, m_order.size(), 0);
+
+        // reorder the buffer by leaf order
+        std::vector<T> tmp(m_order.size());
+        for (std::vector<T>* coords : {&m_buffer.m_x, &m_buffer.m_y, &m_buffer.m_z})
+        {
+            for (size_t i = 0; i < m_order.size(); ++i)
+                tmp[i] = (*coords)[m_order[i]];
+            coords->swap(tmp);
+        }
+        std::vector<uint64_t> ids(m_order.size());
+        for (size_t i = 0; i < m_order.size(); ++i)
+            ids[i] = m_buffer.m_ids[m_order[i]];
+        m_buffer.m_ids.swap(ids);
+        std::vector<uint32_t>().swap(m_order);
+    }
+
+    uint32_t buildNode(uint32_t begin, uint32_t end, int depth)
+    {
+        uint32_t nodeId = m_nodes.size();
+        m_nodes.emplace_back();
+        Node node;
+        node.m_begin = begin;
+        node.m_end = end;
+        node.m_left = node.m_right = -1;
+        node.m_splitDim = 0;
+        node.m_splitValue = 0;
+        for (int d = 0; d < 3; ++d)
+        {
+            node.m_min[d] = coord(m_order[begin], d);
+            node.m_max[d] = node.m_min[d];
+        }
+        for (uint32_t i = begin + 1; i < end; ++i)
+            for (int d = 0; d < 3; ++d)
+            {
+                T v = coord(m_order[i], d);
+                node.m_min[d] = std::min(node.m_min[d], v);
+                node.m_max[d] = std::max(node.m_max[d], v);
+            }
+
+        // split on the widest dimension, at the median (the depth is logarithmic)
+        if (end - begin > LeafSize && depth < MaxDepth / 2)
+        {
+            int dim = 0;
+            for (int d = 1; d < m_dims; ++d)
+                if (node.m_max[d] - node.m_min[d] > node.m_max[dim] - node.m_min[dim])
+                    dim = d;
+
+            if (node.m_max[dim] > node.m_min[dim])
+            {
+                uint32_t mid = begin + (end - begin) / 2;
+                std::nth_element(m_order.begin() + begin, m_order.begin() + mid,
+                                 m_order.begin() + end, [this, dim](uint32_t a, uint32_t b)
+                                 { return coord(a, dim) < coord(b, dim); });
+                node.m_splitDim = dim;
+                node.m_splitValue = coord(m_order[mid], dim);
+                node.m_left = buildNode(begin, mid, depth + 1);
+                node.m_right = buildNode(mid, end, depth + 1);
+            }
+        }
+        m_nodes[nodeId] = node;
+        return nodeId;
+    }
+
+    // squared distance from the query point to the bounding box of the node
+    double minDist2(const Node& node, const double q[3]) const
+    {
+        double dist = 0;
+        for (int d = 0; d < m_dims; ++d)
+        {
+            double delta = 0;
+            if (q[d] < node.m_min[d])
+                delta = node.m_min[d] - q[d];
+            else if (q[d] > node.m_max[d])
+                delta = q[d] - node.m_max[d];
+            dist += delta * delta;
+        }
+        return dist;
+    }
+
+    // false if all the points of the node are out of the Z limits
+    static bool nodeInZLimits(const Node& node, double Zsrc, const ApproxMatcher& matcher)
+    {
+        const RadiusQuery& query = matcher.query();
+        double margin = matcher.zMargin();
+        double zmin = node.m_min[2], zmax = node.m_max[2];
+        if (query.m_max2d_above >= 0 && zmin > Zsrc && (zmin - Zsrc) > query.m_max2d_above + margin)
+            return false;
+        if (query.m_max2d_below >= 0 && Zsrc > zmax && (Zsrc - zmax) > query.m_max2d_below + margin)
+            return false;
+        return true;
+    }
+};
+
+} // namespace pdal
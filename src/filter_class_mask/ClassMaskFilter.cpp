@@ -0,0 +1,79 @@
+#include "ClassMaskFilter.hpp"
+
+#include <pdal/PointView.hpp>
+#include <pdal/StageFactory.hpp>
+#include <pdal/util/ProgramArgs.hpp>
+
+#include <pdal/Dimension.hpp>
+
+namespace pdal
+{
+
+static PluginInfo const s_info = PluginInfo(
+    "filters.class_mask",
+    "Write a bitmask of the class of each point, from a table of classes (bit i for the i-th class)",
+    "" );
+
+CREATE_SHARED_STAGE(ClassMaskFilter, s_info)
+
+std::string ClassMaskFilter::getName() const { return s_info.name; }
+
+ClassMaskFilter::ClassMaskFilter() :
+m_args(new ClassMaskFilter::ClassMaskArgs)
+{}
+
+
+ClassMaskFilter::~ClassMaskFilter()
+{}
+
+
+void ClassMaskFilter::addArgs(ProgramArgs& args)
+{
+    args.add("classes", "Table of the classes: bit i (value 2^i) of the mask is set for the i-th class", m_args->m_classes);
+    args.add("output_dimension", "Name of the mask dimension", m_args->m_outputDimension, "ClassMask");
+}
+
+void ClassMaskFilter::initialize()
+{
+    if (m_args->m_classes.empty())
+        throwError("The classes must be given.");
+    if (m_args->m_classes.size() > 32)
+        throwError("Too many classes: " + std::to_string(m_args->m_classes.size()) + ", at most 32");
+    if (m_args->m_outputDimension.empty())
+        throwError("The output_dimension must be given.");
+
+    m_masks.assign(256, 0);
+    for (size_t i = 0; i < m_args->m_classes.size(); ++i)
+    {
+        int c = m_args->m_classes[i];
+        if (c < 0 || c > 255)
+            throwError("Invalid class: " + std::to_string(c) + ", must be in [0, 255]");
+        if (m_masks[c])
+            throwError("The class " + std::to_string(c) + " is given twice.");
+        m_masks[c] = uint32_t(1) << i;
+    }
+}
+
+void ClassMaskFilter::addDimensions(PointLayoutPtr layout)
+{
+    m_dim = layout->registerOrAssignDim(m_args->m_outputDimension, Dimension::Type::Unsigned32);
+}
+
+bool ClassMaskFilter::processOne(PointRef& point)
+{
+    uint8_t c = point.getFieldAs<uint8_t>(Dimension::Id::Classification);
+    point.setField(m_dim, m_masks[c]);
+    return true;
+}
+
+void ClassMaskFilter::filter(PointView& view)
+{
+    PointRef point(view, 0);
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        processOne(point);
+    }
+}
+
+} // namespace pdal
@@ -0,0 +1,45 @@
+#pragma once
+
+#include <pdal/Filter.hpp>
+#include <pdal/Streamable.hpp>
+
+extern "C" int32_t ClassMaskFilter_ExitFunc();
+extern "C" PF_ExitFunc ClassMaskFilter_InitPlugin();
+
+namespace pdal
+{
+
+// writes a bitmask of the class of each point: bit i is set for the i-th class of the table, so
+// that a test of membership to a set of classes is a single bitwise and
+class ClassMaskFilter : public Filter, public Streamable
+{
+public:
+    ClassMaskFilter();
+    ~ClassMaskFilter();
+
+    static void * create();
+    static int32_t destroy(void *);
+    std::string getName() const;
+
+private:
+
+    struct ClassMaskArgs
+    {
+        std::vector<int> m_classes;
+        std::string m_outputDimension;
+    };
+    std::unique_ptr<ClassMaskArgs> m_args;
+    std::vector<uint32_t> m_masks; // by class value
+    Dimension::Id m_dim;
+
+    virtual void addArgs(ProgramArgs& args);
+    virtual void initialize();
+    virtual void addDimensions(PointLayoutPtr layout);
+    virtual bool processOne(PointRef& point);
+    virtual void filter(PointView& view);
+
+    ClassMaskFilter& operator=(const ClassMaskFilter&) = delete;
+    ClassMaskFilter(const ClassMaskFilter&) = delete;
+};
+
+} // namespace pdal
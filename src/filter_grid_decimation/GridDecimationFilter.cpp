@@ -6,11 +6,16 @@
  ****************************************************************************/
 
 #include "GridDecimationFilter.hpp"
+#include "MortonOrder.hpp"
+#include "ParallelChunks.hpp"
 
 #include <pdal/PointView.hpp>
 #include <pdal/StageFactory.hpp>
 
+#include <algorithm>
+#include <chrono>
 #include <cstdarg>
+#include <numeric>
 #include <sstream>
 
 namespace pdal {
@@ -34,6 +39,31 @@ void GridDecimationFilter::addArgs(ProgramArgs &args) {
   args.add("output_type", "Point kept into the cells ('min', 'max')", m_args->m_methodKeep, "max");
   args.add("output_dimension", "Name of the added dimension", m_args->m_nameOutDimension, "grid");
   args.add("output_wkt", "Export the grid as wkt", m_args->m_nameWktgrid, "");
+  args.add("output_raster", "Export the Z of the point kept in each cell as a GeoTIFF",
+           m_args->m_nameRaster, "");
+  args.add("query_order",
+           "Order of the points: 'file' or 'morton' (along a Z-order curve, so that consecutive "
+           "points fall in the same cells)",
+           m_args->m_queryOrder, "file");
+  args.add("src_bounds",
+           "2d bounds '([xmin, xmax], [ymin, ymax])' of the computed cells: the points of the "
+           "cells which don't intersect them are not kept",
+           m_args->m_srcBounds);
+  m_args->m_originXArg = &args.add(
+      "origin_x",
+      "X of a corner of the cells (default: 0, the cells are on the multiples of the resolution)",
+      m_args->m_originX, 0.);
+  m_args->m_originYArg = &args.add(
+      "origin_y",
+      "Y of a corner of the cells (default: 0, the cells are on the multiples of the resolution)",
+      m_args->m_originY, 0.);
+  args.add("threads",
+           "Number of threads used for the decimation of a point view (the result does not "
+           "depend on it)",
+           m_args->m_threads, 1);
+  args.add("view_threads",
+           "Number of point views (e.g. from filters.chipper) decimated concurrently",
+           m_args->m_viewThreads, 1);
 }
 
 void GridDecimationFilter::initialize() {}
@@ -47,118 +77,263 @@ void GridDecimationFilter::ready(PointTableRef table) {
   if (m_args->m_methodKeep != "max" && m_args->m_methodKeep != "min")
     throwError("The output_type must be 'max' or 'min'.");
 
-  if (m_args->m_nameOutDimension.empty())
-    throwError("The output_dimension must be given.");
+  if (m_args->m_nameOutDimension.empty() && m_args->m_nameRaster.empty())
+    throwError("The output_dimension or the output_raster must be given.");
+
+  if (m_args->m_queryOrder != "file" && m_args->m_queryOrder != "morton")
+    throwError("The query_order must be 'file' or 'morton'.");
+
+  if (m_args->m_originXArg->set() != m_args->m_originYArg->set())
+    throwError("The origin_x and origin_y options must be given together.");
+
+  if (m_args->m_threads < 1)
+    throwError("threads must be >= 1.");
+
+  if (m_args->m_viewThreads < 1)
+    throwError("view_threads must be >= 1.");
 
   if (!m_args->m_nameWktgrid.empty())
     std::remove(m_args->m_nameWktgrid.c_str());
+  m_rasterWritten = false;
 }
 
 void GridDecimationFilter::addDimensions(PointLayoutPtr layout) {
-  m_args->m_dim =
-      layout->registerOrAssignDim(m_args->m_nameOutDimension, Dimension::Type::Unsigned8);
+  // without output_dimension, the points are not marked (only the raster is written)
+  if (!m_args->m_nameOutDimension.empty())
+    m_args->m_dim =
+        layout->registerOrAssignDim(m_args->m_nameOutDimension, Dimension::Type::Unsigned8);
 }
 
-void GridDecimationFilter::processOne(BOX2D bounds, PointRef &point, PointViewPtr view) {
+GridFrame GridDecimationFilter::gridFrame(const BOX2D &bounds) const {
+  try {
+    // the cells are anchored to the origin (0, 0 by default), whatever the bounds of the view
+    return GridFrame(bounds, m_args->m_edgeLength, m_args->m_originX, m_args->m_originY);
+  } catch (const std::out_of_range &) {
+    throwError("Grid size out of range.");
+  }
+}
+
+void GridDecimationFilter::processOne(const GridFrame &frame, PointRef &point, PointId index,
+                                      PointView &view, GridCells &cells) {
   // get the grid cell
   double x = point.getFieldAs<double>(Dimension::Id::X);
   double y = point.getFieldAs<double>(Dimension::Id::Y);
-  int id = point.getFieldAs<double>(Dimension::Id::PointId);
-
-  // if x==(xmax of the cell), we assume the point are in the upper cell
-  // if y==(ymax of the cell), we assume the point are in the right cell
-  int width = static_cast<int>((x - bounds.minx) / m_args->m_edgeLength);
-  int height = static_cast<int>((y - bounds.miny) / m_args->m_edgeLength);
-
-  // to avoid numeric pb with the division (append if the point is on the grid)
-  if (x < bounds.minx + width * m_args->m_edgeLength)
-    width--;
-  if (y < bounds.miny + height * m_args->m_edgeLength)
-    height--;
-  if (x >= bounds.minx + (width + 1) * m_args->m_edgeLength)
-    width++;
-  if (y >= bounds.miny + (height + 1) * m_args->m_edgeLength)
-    height++;
-
-  auto mptRefid = this->grid.find(std::make_pair(width, height));
-  assert(mptRefid != this->grid.end());
-  auto ptRefid = mptRefid->second;
-
-  if (ptRefid == -1) {
-    this->grid[std::make_pair(width, height)] = point.pointId();
+
+  PointId &ptRefid = cells.at(frame.index(frame.cellOf(x, y)));
+
+  if (ptRefid == GridCells::Empty) {
+    ptRefid = index;
     return;
   }
 
-  PointRef ptRef = view->point(ptRefid);
-
   double z = point.getFieldAs<double>(Dimension::Id::Z);
-  double zRef = ptRef.getFieldAs<double>(Dimension::Id::Z);
+  double zRef = view.getFieldAs<double>(Dimension::Id::Z, ptRefid);
+  if (replaces(z, index, zRef, ptRefid))
+    ptRefid = index;
+}
 
-  if (this->m_args->m_methodKeep == "max" && z > zRef)
-    this->grid[std::make_pair(width, height)] = point.pointId();
-  if (this->m_args->m_methodKeep == "min" && z < zRef)
-    this->grid[std::make_pair(width, height)] = point.pointId();
+bool GridDecimationFilter::replaces(double z, PointId index, double zRef, PointId refIndex) const {
+  // with the same Z, the first point of the view is kept, whatever the order of the points (and
+  // the number of threads)
+  if (z == zRef)
+    return index < refIndex;
+  return this->m_args->m_methodKeep == "max" ? z > zRef : z < zRef;
 }
 
-void GridDecimationFilter::createGrid(BOX2D bounds) {
+std::string GridDecimationFilter::gridWkt(const GridFrame &frame) const {
+  std::ostringstream oss;
+  for (int l(0); l < frame.height(); l++)
+    for (int c(0); c < frame.width(); c++)
+      oss << Polygon(frame.cellBounds(c, l)).wkt() << std::endl;
+  return oss.str();
+}
 
-  size_t d_width = std::floor((bounds.maxx - bounds.minx) / m_args->m_edgeLength) + 1;
-  size_t d_height = std::floor((bounds.maxy - bounds.miny) / m_args->m_edgeLength) + 1;
+void GridDecimationFilter::decimate(PointView &view, ViewResult &result) {
+  auto start = std::chrono::steady_clock::now();
+  BOX2D bounds;
+  view.calculateBounds(bounds);
+  GridFrame frame = gridFrame(bounds);
+  if (!m_args->m_nameWktgrid.empty())
+    result.m_wkt = gridWkt(frame);
+
+  std::vector<uint8_t> keep(view.size());
+  if (m_args->m_threads > 1)
+    decimateInBands(view, frame, keep, result);
+  else {
+    // the cells are only allocated for the grid of this view (a flat array, or a hash table of
+    // the occupied cells when the points are sparse)
+    GridCells cells(frame.cellCount(), view.size());
+
+    PointIdList ids(view.size());
+    std::iota(ids.begin(), ids.end(), 0);
+    if (m_args->m_queryOrder == "morton")
+      sortMorton(view, ids);
+
+    // the cells which intersect src_bounds are computed with all their points, the other ones
+    // are skipped: the grid (anchored to the origin) is the same as without src_bounds
+    const BOX2D &srcBounds = m_args->m_srcBounds;
+    GridCellRange srcCells(frame, srcBounds);
+
+    PointRef point(view, 0);
+    for (PointId i : ids) {
+      point.setPointId(i);
+      if (!srcBounds.empty() &&
+          !srcCells.contains(frame.cellOf(point.getFieldAs<double>(Dimension::Id::X),
+                                          point.getFieldAs<double>(Dimension::Id::Y))))
+        continue;
+      processOne(frame, point, i, view, cells);
+      result.m_processed++;
+    }
 
-  if (d_width < 0.0 || d_width > (std::numeric_limits<int>::max)())
-    throwError("Grid width out of range.");
-  if (d_height < 0.0 || d_height > (std::numeric_limits<int>::max)())
-    throwError("Grid height out of range.");
+    cells.forEachKept([&](PointId id) {
+      keep[id] = 1;
+      result.m_occupied++;
+    });
+  }
 
-  int width = static_cast<int>(d_width);
-  int height = static_cast<int>(d_height);
+  if (!m_args->m_nameOutDimension.empty())
+    for (PointId i = 0; i < view.size(); ++i)
+      view.setField(m_args->m_dim, i, int64_t(keep[i]));
+
+  if (!m_args->m_nameRaster.empty()) {
+    // Z of the point kept in each cell, found by the decimation (no other scan of the cells)
+    result.m_raster.reset(new GeoTiffRaster(frame));
+    result.m_raster->setSpatialReference(view.spatialReference());
+    PointRef point(view, 0);
+    for (PointId i = 0; i < view.size(); ++i)
+      if (keep[i]) {
+        point.setPointId(i);
+        result.m_raster->set(frame.cellOf(point.getFieldAs<double>(Dimension::Id::X),
+                                          point.getFieldAs<double>(Dimension::Id::Y)),
+                             point.getFieldAs<double>(Dimension::Id::Z));
+      }
+  }
 
-  std::vector<Polygon> vgrid;
+  result.m_scanned = view.size();
+  result.m_cells = frame.cellCount();
+  result.m_time = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+}
 
-  for (size_t l(0); l < height; l++)
-    for (size_t c(0); c < width; c++) {
-      BOX2D bounds_dalle(bounds.minx + c * m_args->m_edgeLength,
-                         bounds.miny + l * m_args->m_edgeLength,
-                         bounds.minx + (c + 1) * m_args->m_edgeLength,
-                         bounds.miny + (l + 1) * m_args->m_edgeLength);
-      vgrid.push_back(Polygon(bounds_dalle));
-      this->grid.insert(std::make_pair(std::make_pair(c, l), -1));
+void GridDecimationFilter::decimateInBands(PointView &view, const GridFrame &frame,
+                                           std::vector<uint8_t> &keep, ViewResult &result) {
+  // the rows of the grid are split into bands, decimated concurrently: the points are first
+  // grouped by band (in the order of the view within a band), then each band has its own cells,
+  // so the threads never share a cell and the result is the same as with a single thread
+  const int threads = m_args->m_threads;
+  const uint64_t height = frame.height();
+  const uint64_t skipped = std::numeric_limits<uint64_t>::max();
+  const BOX2D &srcBounds = m_args->m_srcBounds;
+  GridCellRange srcCells(frame, srcBounds);
+
+  // several bands per thread, taken by the threads as they are done: the density of the points
+  // varies from a band to another
+  uint64_t rowsPerBand = (height + 8 * threads - 1) / (8 * threads);
+  size_t nbBands = (height + rowsPerBand - 1) / rowsPerBand;
+  const uint64_t bandCells = rowsPerBand * frame.width();
+
+  // cell of each point, and number of points of each band in each chunk of points
+  size_t nbChunks = chunkCount(view.size(), threads);
+  std::vector<uint64_t> pointCells(view.size());
+  std::vector<std::vector<uint64_t>> counts(nbChunks, std::vector<uint64_t>(nbBands, 0));
+  processInChunks(view.size(), threads, [&](uint64_t begin, uint64_t end, size_t chunk) {
+    PointRef point(view, 0);
+    for (PointId i = begin; i < end; ++i) {
+      point.setPointId(i);
+      coordsGrid cell = frame.cellOf(point.getFieldAs<double>(Dimension::Id::X),
+                                     point.getFieldAs<double>(Dimension::Id::Y));
+      if (!srcBounds.empty() && !srcCells.contains(cell)) {
+        pointCells[i] = skipped;
+        continue;
+      }
+      pointCells[i] = frame.index(cell);
+      counts[chunk][pointCells[i] / bandCells]++;
+    }
+  });
+
+  // the points of a band follow each other, chunk after chunk
+  std::vector<uint64_t> bandBegin(nbBands + 1, 0);
+  std::vector<std::vector<uint64_t>> next(nbChunks, std::vector<uint64_t>(nbBands));
+  uint64_t offset(0);
+  for (size_t b = 0; b < nbBands; ++b) {
+    bandBegin[b] = offset;
+    for (size_t c = 0; c < nbChunks; ++c) {
+      next[c][b] = offset;
+      offset += counts[c][b];
+    }
+  }
+  bandBegin[nbBands] = offset;
+
+  PointIdList bandPoints(offset);
+  processInChunks(view.size(), threads, [&](uint64_t begin, uint64_t end, size_t chunk) {
+    for (PointId i = begin; i < end; ++i)
+      if (pointCells[i] != skipped)
+        bandPoints[next[chunk][pointCells[i] / bandCells]++] = i;
+  });
+
+  std::vector<uint64_t> occupied(nbBands, 0);
+  processEach(nbBands, threads, [&](uint64_t b) {
+    uint64_t firstCell = b * bandCells;
+    uint64_t cellCount = std::min(bandCells, frame.cellCount() - firstCell);
+    GridCells cells(cellCount, bandBegin[b + 1] - bandBegin[b]);
+    for (uint64_t k = bandBegin[b]; k < bandBegin[b + 1]; ++k) {
+      PointId i = bandPoints[k];
+      PointId &ptRefid = cells.at(pointCells[i] - firstCell);
+      if (ptRefid == GridCells::Empty ||
+          replaces(view.getFieldAs<double>(Dimension::Id::Z, i), i,
+                   view.getFieldAs<double>(Dimension::Id::Z, ptRefid), ptRefid))
+        ptRefid = i;
     }
+    cells.forEachKept([&](PointId id) {
+      keep[id] = 1;
+      occupied[b]++;
+    });
+  });
+
+  result.m_processed = offset;
+  for (uint64_t count : occupied)
+    result.m_occupied += count;
+}
 
+void GridDecimationFilter::report(const ViewResult &result) {
+  // the grids of the views follow each other in the wkt file
   if (!m_args->m_nameWktgrid.empty()) {
-    std::ofstream oss(m_args->m_nameWktgrid);
-    for (auto pol : vgrid)
-      oss << pol.wkt() << std::endl;
+    std::ofstream oss(m_args->m_nameWktgrid, std::ios::app);
+    oss << result.m_wkt;
   }
-}
 
-PointViewSet GridDecimationFilter::run(PointViewPtr view) {
-  if (view->empty()) {
-    if (!m_args->m_nameWktgrid.empty())
-      std::ofstream{m_args->m_nameWktgrid};
-
-  } else {
-    BOX2D bounds;
-    view->calculateBounds(bounds);
-    createGrid(bounds);
-
-    for (PointId i = 0; i < view->size(); ++i) {
-      PointRef point = view->point(i);
-      processOne(bounds, point, view);
+  if (result.m_raster) {
+    if (m_rasterWritten)
+      throwError("The output_raster can only be written for a single point view.");
+    try {
+      result.m_raster->write(m_args->m_nameRaster);
+    } catch (const std::runtime_error &err) {
+      throwError(err.what());
     }
+    if (!result.m_raster->hasEpsg())
+      log()->get(LogLevel::Warning) << getName() << ": no EPSG code for the coordinate system, "
+                                    << "the raster " << m_args->m_nameRaster
+                                    << " has no coordinate system" << std::endl;
+    m_rasterWritten = true;
+  }
 
-    std::set<PointId> keepPoint;
-    for (auto it : this->grid)
-      if (it.second != -1)
-        keepPoint.insert(it.second);
-
-    for (PointId i = 0; i < view->size(); ++i) {
-      PointRef point = view->point(i);
-      if (keepPoint.find(view->point(i).pointId()) != keepPoint.end())
-        point.setField(m_args->m_dim, int64_t(1));
-      else
-        point.setField(m_args->m_dim, int64_t(0));
-    }
+  // counters of the view, read by the batch tools in the metadata of the pipeline
+  m_metadata.add("points_scanned", result.m_scanned);
+  m_metadata.add("points_processed", result.m_processed);
+  m_metadata.add("cell_count", result.m_cells);
+  m_metadata.add("occupied_cells", result.m_occupied);
+  m_metadata.add("grid_time", result.m_time);
+}
+
+PointViewSet GridDecimationFilter::run(PointViewPtr view) {
+  // each view has its own grid; with view_threads > 1, the views are decimated together once
+  // they are all known
+  if (m_args->m_viewThreads > 1)
+    m_views.push_back(view);
+  else {
+    ViewResult result;
+    if (!view->empty())
+      decimate(*view, result);
+    report(result);
   }
 
   PointViewSet viewSet;
@@ -166,4 +341,17 @@ PointViewSet GridDecimationFilter::run(PointViewPtr view) {
   return viewSet;
 }
 
+void GridDecimationFilter::done(PointTableRef table) {
+  // the views share the point table, but each one only writes the fields of its own points
+  std::vector<ViewResult> results(m_views.size());
+  processEach(m_views.size(), m_args->m_viewThreads,
+              [&](uint64_t i) {
+                if (!m_views[i]->empty())
+                  decimate(*m_views[i], results[i]);
+              });
+  for (const ViewResult &result : results)
+    report(result);
+  m_views.clear();
+}
+
 } // namespace pdal
@@ -14,6 +14,9 @@
 #include <pdal/Filter.hpp>
 #include <pdal/Polygon.hpp>
 
+#include "GeoTiff.hpp"
+#include "GridCells.hpp"
+
 namespace pdal
 {
 
@@ -34,24 +37,49 @@ private:
         double m_edgeLength; // lenght of grid
         std::string m_nameOutDimension; // name of the new dimension
         std::string m_nameWktgrid; // export wkt grid
+        std::string m_nameRaster; // export the Z of the kept points as a GeoTIFF
+        std::string m_queryOrder; // order of the points (file, morton)
+        BOX2D m_srcBounds; // only the cells which intersect these bounds are computed
+        double m_originX, m_originY; // corner of a cell
+        Arg *m_originXArg, *m_originYArg;
+        int m_threads; // number of threads used for a point view
+        int m_viewThreads; // number of point views processed concurrently
         Dimension::Id m_dim;
     };
     
     std::unique_ptr<GridArgs> m_args;
     
     typedef std::pair<int,int> coordsGrid;
-    std::map< coordsGrid, long> grid;
+
+    // result of the decimation of a point view
+    struct ViewResult
+    {
+        point_count_t m_scanned = 0, m_processed = 0;
+        uint64_t m_cells = 0, m_occupied = 0;
+        double m_time = 0;
+        std::string m_wkt; // cells of the grid, with output_wkt
+        std::unique_ptr<GeoTiffRaster> m_raster; // with output_raster
+    };
+    std::vector<PointViewPtr> m_views; // views decimated in done(), with view_threads > 1
+    bool m_rasterWritten = false;
     
     void addArgs(ProgramArgs& args);
     virtual void initialize();
 
     virtual void ready(PointTableRef table);
     virtual PointViewSet run(PointViewPtr view);
+    virtual void done(PointTableRef table);
     virtual void prepared(PointTableRef table);
     void addDimensions(PointLayoutPtr layout);
     
-    void createGrid(BOX2D bounds);
-    void processOne(BOX2D bounds, PointRef& point, PointViewPtr view);
+    GridFrame gridFrame(const BOX2D& bounds) const;
+    std::string gridWkt(const GridFrame& frame) const;
+    void processOne(const GridFrame& frame, PointRef& point, PointId index, PointView& view, GridCells& cells);
+    bool replaces(double z, PointId index, double zRef, PointId refIndex) const;
+    void decimate(PointView& view, ViewResult& result);
+    void decimateInBands(PointView& view, const GridFrame& frame, std::vector<uint8_t>& keep,
+                         ViewResult& result);
+    void report(const ViewResult& result);
     
     GridDecimationFilter& operator=(const GridDecimationFilter&); // not implemented
     GridDecimationFilter(const GridDecimationFilter&); // not implemented
@@ -0,0 +1,310 @@
+#include "GridDecimationMultiFilter.hpp"
+#include "FlatJson.hpp"
+#include "GeoTiff.hpp"
+#include "GridCells.hpp"
+
+#include <pdal/PointView.hpp>
+#include <pdal/StageFactory.hpp>
+#include <pdal/util/ProgramArgs.hpp>
+#include <pdal/util/Utils.hpp>
+
+#include <pdal/Dimension.hpp>
+
+#include <algorithm>
+#include <chrono>
+#include <cmath>
+#include <limits>
+#include <set>
+
+namespace pdal
+{
+
+static PluginInfo const s_info = PluginInfo(
+    "filters.grid_decimation_multi",
+    "Compute several grid decimations (max or min point of each cell) in a few scans of the points",
+    "" );
+
+CREATE_SHARED_STAGE(GridDecimationMultiFilter, s_info)
+
+std::string GridDecimationMultiFilter::getName() const { return s_info.name; }
+
+GridDecimationMultiFilter::GridDecimationMultiFilter() :
+m_args(new GridDecimationMultiFilter::GridDecimationMultiArgs)
+{}
+
+
+GridDecimationMultiFilter::~GridDecimationMultiFilter()
+{}
+
+
+void GridDecimationMultiFilter::addArgs(ProgramArgs& args)
+{
+    args.add("grids", "List of grids (JSON objects with the options of filters.grid_decimation_deprecated: resolution, output_type, output_dimension, output_raster, where, src_bounds, origin_x, origin_y), applied in order", m_args->m_grids);
+}
+
+void GridDecimationMultiFilter::parseGrids()
+{
+    std::vector<FlatJsonObject> objects;
+    try
+    {
+        objects = FlatJsonParser::parse(m_args->m_grids);
+    }
+    catch (const std::invalid_argument& err)
+    {
+        throwError(std::string("Invalid 'grids' option: ") + err.what());
+    }
+
+    for (const FlatJsonObject& object : objects)
+    {
+        Grid grid;
+        grid.m_resolution = 1.;
+        grid.m_outputType = "max";
+        grid.m_outputDimension = "grid";
+        grid.m_origin = {std::nan(""), std::nan("")};
+        for (const auto& item : object)
+        {
+            const std::string& key = item.first;
+            const std::string& value = item.second;
+            try
+            {
+                if (key == "resolution") grid.m_resolution = std::stod(value);
+                else if (key == "output_type") grid.m_outputType = value;
+                else if (key == "output_dimension") grid.m_outputDimension = value;
+                else if (key == "output_raster") grid.m_outputRaster = value;
+                else if (key == "where") grid.m_where.parse(value);
+                else if (key == "origin_x") grid.m_origin.first = std::stod(value);
+                else if (key == "origin_y") grid.m_origin.second = std::stod(value);
+                else if (key == "src_bounds")
+                {
+                    // an empty value means no bounds, as for the option of the stage
+                    bool valid = true;
+                    try
+                    {
+                        valid = value.empty() || Utils::fromString(value, grid.m_srcBounds);
+                    }
+                    catch (const std::runtime_error&)
+                    {
+                        valid = false;
+                    }
+                    if (!valid)
+                        throw std::invalid_argument(value);
+                }
+                else
+                    throwError("Unknown key '" + key + "' in a grid.");
+            }
+            catch (const std::logic_error&)
+            {
+                throwError("Invalid value '" + value + "' for the key '" + key + "' of a grid.");
+            }
+        }
+
+        if (grid.m_resolution <= 0)
+            throwError("Invalid resolution in a grid: " + std::to_string(grid.m_resolution) + ", must be > 0");
+        if (grid.m_outputType != "max" && grid.m_outputType != "min")
+            throwError("The output_type of each grid must be 'max' or 'min'.");
+        if (grid.m_outputDimension.empty() && grid.m_outputRaster.empty())
+            throwError("The output_dimension or the output_raster of each grid must be given.");
+        if (std::isnan(grid.m_origin.first) != std::isnan(grid.m_origin.second))
+            throwError("The origin_x and origin_y of a grid must be given together.");
+        if (std::isnan(grid.m_origin.first))
+            grid.m_origin = {0., 0.}; // cells on the multiples of the resolution
+        m_grids.push_back(grid);
+    }
+}
+
+void GridDecimationMultiFilter::planPasses()
+{
+    // a grid joins the current pass if its where does not read the output of a grid of the pass
+    // (nor the coordinates): the wheres of a pass are evaluated before its outputs are written,
+    // in the order of the grids, so the grids keep their sequential meaning
+    std::set<std::string> written;
+    for (size_t i = 0; i < m_grids.size(); ++i)
+    {
+        std::vector<std::string> read = m_grids[i].m_where.expression().dimensionNames();
+        read.insert(read.end(), {"X", "Y", "Z"});
+        bool dependent = std::any_of(read.begin(), read.end(),
+                                     [&](const std::string& name) { return written.count(name) > 0; });
+        if (m_passes.empty() || dependent)
+        {
+            m_passes.emplace_back();
+            written.clear();
+        }
+        m_passes.back().push_back(i);
+        if (!m_grids[i].m_outputDimension.empty())
+            written.insert(m_grids[i].m_outputDimension);
+    }
+}
+
+void GridDecimationMultiFilter::initialize()
+{
+    m_grids.clear();
+    m_passes.clear();
+    parseGrids();
+    if (m_grids.empty())
+        throwError("At least one grid must be given.");
+    planPasses();
+}
+
+void GridDecimationMultiFilter::addDimensions(PointLayoutPtr layout)
+{
+    for (Grid& grid : m_grids)
+        if (!grid.m_outputDimension.empty())
+            grid.m_dim = layout->registerOrAssignDim(grid.m_outputDimension, Dimension::Type::Unsigned8);
+}
+
+void GridDecimationMultiFilter::ready(PointTableRef)
+{
+    m_viewCount = 0;
+}
+
+void GridDecimationMultiFilter::prepared(PointTableRef table)
+{
+    PointLayoutPtr layout(table.layout());
+
+    for (Grid& grid : m_grids)
+    {
+        std::string unknown = grid.m_where.bind(layout);
+        if (!unknown.empty())
+            throwError("Unknown dimension '" + unknown + "'.");
+    }
+}
+
+void GridDecimationMultiFilter::processPass(PointView& view, const std::vector<size_t>& pass,
+                                            uint64_t& occupied) const
+{
+    // points of each grid and their bounds: each grid covers the bounds of its own points, with
+    // cells anchored to its origin, as a grid_decimation_deprecated stage with the same where
+    std::vector<std::vector<bool>> selected(pass.size(), std::vector<bool>(view.size()));
+    std::vector<BOX2D> bounds(pass.size());
+    std::vector<point_count_t> counts(pass.size(), 0);
+    PointRef point(view, 0);
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        for (size_t g = 0; g < pass.size(); ++g)
+        {
+            const Grid& grid = m_grids[pass[g]];
+            if (!grid.m_where.empty() && !grid.m_where.test(point))
+                continue;
+            selected[g][id] = true;
+            bounds[g].grow(point.getFieldAs<double>(Dimension::Id::X),
+                           point.getFieldAs<double>(Dimension::Id::Y));
+            counts[g]++;
+        }
+    }
+
+    std::vector<GridFrame> frames;
+    std::vector<GridCells> cells;
+    std::vector<GridCellRange> srcCells;
+    for (size_t g = 0; g < pass.size(); ++g)
+    {
+        const Grid& grid = m_grids[pass[g]];
+        if (counts[g] == 0) // no point: a single cell, never used
+            bounds[g] = BOX2D(grid.m_origin.first, grid.m_origin.second, grid.m_origin.first,
+                              grid.m_origin.second);
+        try
+        {
+            frames.emplace_back(bounds[g], grid.m_resolution, grid.m_origin.first, grid.m_origin.second);
+        }
+        catch (const std::out_of_range&)
+        {
+            throwError("Grid size out of range for the grid of '" + grid.name() + "'.");
+        }
+        cells.emplace_back(frames[g].cellCount(), counts[g]);
+        srcCells.emplace_back(frames[g], grid.m_srcBounds);
+    }
+
+    // all the cells of the pass are updated in a single scan; the points are read in the order of
+    // the view, so with the same Z, the first point of the view is kept in a cell
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        double x = point.getFieldAs<double>(Dimension::Id::X);
+        double y = point.getFieldAs<double>(Dimension::Id::Y);
+        double z = point.getFieldAs<double>(Dimension::Id::Z);
+        for (size_t g = 0; g < pass.size(); ++g)
+        {
+            if (!selected[g][id])
+                continue;
+            const Grid& grid = m_grids[pass[g]];
+            std::pair<int, int> cell = frames[g].cellOf(x, y);
+            if (!srcCells[g].contains(cell))
+                continue;
+
+            PointId& kept = cells[g].at(frames[g].index(cell));
+            if (kept == GridCells::Empty)
+            {
+                kept = id;
+                continue;
+            }
+            double zRef = view.getFieldAs<double>(Dimension::Id::Z, kept);
+            if (grid.m_outputType == "max" ? z > zRef : z < zRef)
+                kept = id;
+        }
+    }
+
+    std::vector<std::vector<bool>> keep(pass.size(), std::vector<bool>(view.size()));
+    for (size_t g = 0; g < pass.size(); ++g)
+    {
+        const Grid& grid = m_grids[pass[g]];
+        std::unique_ptr<GeoTiffRaster> raster;
+        if (!grid.m_outputRaster.empty())
+        {
+            raster.reset(new GeoTiffRaster(frames[g]));
+            raster->setSpatialReference(view.spatialReference());
+        }
+        cells[g].forEachKept([&](PointId id) {
+            keep[g][id] = true;
+            occupied++;
+            if (raster)
+            {
+                point.setPointId(id);
+                raster->set(frames[g].cellOf(point.getFieldAs<double>(Dimension::Id::X),
+                                             point.getFieldAs<double>(Dimension::Id::Y)),
+                            point.getFieldAs<double>(Dimension::Id::Z));
+            }
+        });
+        if (!raster)
+            continue;
+        try
+        {
+            raster->write(grid.m_outputRaster);
+        }
+        catch (const std::runtime_error& err)
+        {
+            throwError(err.what());
+        }
+        if (!raster->hasEpsg())
+            log()->get(LogLevel::Warning) << getName() << ": no EPSG code for the coordinate system, the raster "
+                                          << grid.m_outputRaster << " has no coordinate system" << std::endl;
+    }
+
+    // the outputs are written in the order of the grids: with the same output dimension, the last
+    // grid of a point wins, as with chained stages
+    for (PointId id = 0; id < view.size(); ++id)
+        for (size_t g = 0; g < pass.size(); ++g)
+            if (selected[g][id] && !m_grids[pass[g]].m_outputDimension.empty())
+                view.setField(m_grids[pass[g]].m_dim, id, int64_t(keep[g][id] ? 1 : 0));
+}
+
+void GridDecimationMultiFilter::filter(PointView& view)
+{
+    bool hasRaster = std::any_of(m_grids.begin(), m_grids.end(),
+                                 [](const Grid& grid) { return !grid.m_outputRaster.empty(); });
+    if (hasRaster && ++m_viewCount > 1)
+        throwError("The output_raster of a grid can only be written for a single point view.");
+
+    auto start = std::chrono::steady_clock::now();
+    uint64_t occupied(0);
+    for (const std::vector<size_t>& pass : m_passes)
+        processPass(view, pass, occupied);
+    double time = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+
+    m_metadata.add("points_scanned", view.size());
+    m_metadata.add("occupied_cells", occupied);
+    m_metadata.add("grid_time", time);
+    log()->get(LogLevel::Debug) << getName() << ": " << m_grids.size() << " grids computed in "
+                                << m_passes.size() << " passes" << std::endl;
+}
+
+} // namespace pdal
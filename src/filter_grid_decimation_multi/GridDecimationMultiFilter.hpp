@@ -0,0 +1,65 @@
+#pragma once
+
+#include <pdal/Filter.hpp>
+#include "PointExpression.hpp"
+
+extern "C" int32_t GridDecimationMultiFilter_ExitFunc();
+extern "C" PF_ExitFunc GridDecimationMultiFilter_InitPlugin();
+
+namespace pdal
+{
+
+// several grid decimations computed in a few scans of the points
+class GridDecimationMultiFilter : public Filter
+{
+public:
+    GridDecimationMultiFilter();
+    ~GridDecimationMultiFilter();
+
+    static void * create();
+    static int32_t destroy(void *);
+    std::string getName() const;
+
+private:
+
+    // one grid_decimation_deprecated: the max or min point of each cell of the points of m_where
+    struct Grid
+    {
+        double m_resolution;
+        std::string m_outputType;
+        std::string m_outputDimension; // points not marked if empty
+        std::string m_outputRaster; // GeoTIFF of the Z of the kept points, not written if empty
+        PointExpression m_where; // all the points if empty
+        BOX2D m_srcBounds;
+        std::pair<double, double> m_origin; // corner of a cell (0, 0 by default)
+        Dimension::Id m_dim;
+
+        const std::string& name() const { return m_outputDimension.empty() ? m_outputRaster : m_outputDimension; }
+    };
+
+    struct GridDecimationMultiArgs
+    {
+        std::vector<std::string> m_grids;
+    };
+    std::unique_ptr<GridDecimationMultiArgs> m_args;
+    std::vector<Grid> m_grids;
+    // grids computed together: the where of a grid never reads a dimension written by a grid of its pass
+    std::vector<std::vector<size_t>> m_passes;
+    int m_viewCount = 0; // views filtered, the rasters are written for a single view
+
+    virtual void addArgs(ProgramArgs& args);
+    virtual void initialize();
+    virtual void addDimensions(PointLayoutPtr layout);
+    virtual void prepared(PointTableRef table);
+    virtual void ready(PointTableRef table);
+    virtual void filter(PointView& view);
+
+    void parseGrids();
+    void planPasses();
+    void processPass(PointView& view, const std::vector<size_t>& pass, uint64_t& occupied) const;
+
+    GridDecimationMultiFilter& operator=(const GridDecimationMultiFilter&) = delete;
+    GridDecimationMultiFilter(const GridDecimationMultiFilter&) = delete;
+};
+
+} // namespace pdal
@@ -0,0 +1,521 @@
+#include "MnxMarkingFilter.hpp"
+#include "GridCells.hpp"
+#include "ParallelChunks.hpp"
+#include "RadiusIndexBuilder.hpp"
+
+#include <pdal/PointView.hpp>
+#include <pdal/StageFactory.hpp>
+#include <pdal/util/ProgramArgs.hpp>
+
+#include <pdal/Dimension.hpp>
+
+#include <algorithm>
+#include <chrono>
+#include <numeric>
+
+namespace pdal
+{
+
+static PluginInfo const s_info = PluginInfo(
+    "filters.mnx_marking",
+    "Mark the points used for the DTM and the DSM (whole marking of mark_points_to_use_for_digital_models_with_new_dimension in a single stage)",
+    "" );
+
+CREATE_SHARED_STAGE(MnxMarkingFilter, s_info)
+
+std::string MnxMarkingFilter::getName() const { return s_info.name; }
+
+MnxMarkingFilter::MnxMarkingFilter() :
+m_args(new MnxMarkingFilter::MnxMarkingArgs)
+{}
+
+
+MnxMarkingFilter::~MnxMarkingFilter()
+{}
+
+
+void MnxMarkingFilter::addArgs(ProgramArgs& args)
+{
+    args.add("dtm_dimension", "Name of the marker of the points used for the DTM", m_args->m_dtmDimension, "dtm_marker");
+    args.add("dsm_dimension", "Name of the marker of the points used for the DSM", m_args->m_dsmDimension, "dsm_marker");
+    args.add("reset_tags", "Start from markers at 0, instead of the values of the marker dimensions of the input", m_args->m_resetTags, false);
+    args.add("keep_temporary_dimensions", "Write the temporary markers (PT_VEG_DSM, PT_UNDER_BRIDGE, PT_CLOSED_BUILDING, PT_UNDER_VEGET, PT_ON_SOL, PT_ON_VIRT) in the point view", m_args->m_keepTemporaryDimensions, false);
+    args.add("src_bounds", "2d bounds '([xmin, xmax], [ymin, ymax])' of the core tile of a buffered input: the other points are only evaluated where they can change the markers of the core tile", m_args->m_srcBounds);
+    args.add("threads", "Number of threads used for the neighbors searches", m_args->m_threads, 1);
+
+    args.add("ground_class", "Class of the ground points", m_args->m_groundClass, 2);
+    args.add("low_veget_class", "Class of the low vegetation", m_args->m_lowVegetClass, 3);
+    args.add("veget_classes", "Classes of the medium and high vegetation", m_args->m_vegetClasses, std::vector<int> {4, 5});
+    args.add("high_veget_class", "Class of the high vegetation", m_args->m_highVegetClass, 5);
+    args.add("building_classes", "Classes of the buildings", m_args->m_buildingClasses, std::vector<int> {6, 67});
+    args.add("water_class", "Class of the water", m_args->m_waterClass, 9);
+    args.add("bridge_class", "Class of the bridges", m_args->m_bridgeClass, 17);
+    args.add("virtual_class", "Class of the virtual points (bridges and water)", m_args->m_virtualClass, 66);
+    args.add("correlation_class", "Class of the points from a correlation DSM, used for the DTM", m_args->m_correlationClass, 68);
+
+    args.add("veget_resolution", "Resolution of the grid of the highest vegetation points for the DSM (step 1.5)", m_args->m_vegetResolution, 0.75);
+    args.add("dtm_resolution", "Resolution of the grids of the DTM (steps 3.1 and 3.3)", m_args->m_dtmResolution, 0.5);
+    args.add("dsm_resolution", "Resolution of the grids of the DSM (steps 3.2 and 3.3)", m_args->m_dsmResolution, 0.5);
+
+    args.add("veget_radius", "Radius of the searches around the vegetation (steps 1.2 to 1.4, and their cleanups)", m_args->m_vegetRadius, 1.);
+    args.add("water_radius", "Radius of the search of the ground above the water (step 2.1)", m_args->m_waterRadius, 1.25);
+    args.add("water_virtual_radius", "Radius of the search of the virtual points around the water (step 2.2)", m_args->m_waterVirtualRadius, 1.);
+    args.add("water_cleanup_radius", "Radius of the cleanups of the steps 2.1 and 2.2", m_args->m_waterCleanupRadius, 1.);
+    args.add("overground_radius", "Radius of the search of the overground around the DTM points (step 4.1)", m_args->m_overgroundRadius, 1.5);
+    args.add("building_radius", "Radius of the search of the buildings around the ground (step 4.2)", m_args->m_buildingRadius, 1.25);
+    args.add("closed_building_radius", "Radius of the search of the open ground around the ground close to the buildings (step 4.2)", m_args->m_closedBuildingRadius, 1.);
+    args.add("bridge_radius", "Radius of the search of the bridges above the points (step 5)", m_args->m_bridgeRadius, 1.5);
+    args.add("bridge_cleanup_radius", "Radius of the cleanup of the step 5", m_args->m_bridgeCleanupRadius, 1.25);
+    args.add("virtual_radius", "Radius of the searches around the virtual points (steps 7.2 and 7.3, and the cleanup of 7.2)", m_args->m_virtualRadius, 0.5);
+    args.add("under_max2d_below", "Searches of the points above (steps 1.3, 2.1 and 5): downward maximum distance in Z for the reference points", m_args->m_underMax2dBelow, 0.);
+    args.add("under_cleanup_max2d", "Cleanups of the searches of the points above: maximum distance in Z (up and down) for the unmarked points", m_args->m_underCleanupMax2d, 0.5);
+}
+
+void MnxMarkingFilter::initialize()
+{
+    if (m_args->m_dtmDimension.empty() || m_args->m_dsmDimension.empty())
+        throwError("The dtm_dimension and the dsm_dimension must be given.");
+    if (m_args->m_dtmDimension == m_args->m_dsmDimension)
+        throwError("The dtm_dimension and the dsm_dimension must be different.");
+    if (m_args->m_threads < 1)
+        throwError("Invalid 'threads' option: " + std::to_string(m_args->m_threads) + ", must be >= 1");
+
+    std::vector<int> classes {m_args->m_groundClass, m_args->m_lowVegetClass, m_args->m_highVegetClass,
+                              m_args->m_waterClass, m_args->m_bridgeClass, m_args->m_virtualClass,
+                              m_args->m_correlationClass};
+    classes.insert(classes.end(), m_args->m_vegetClasses.begin(), m_args->m_vegetClasses.end());
+    classes.insert(classes.end(), m_args->m_buildingClasses.begin(), m_args->m_buildingClasses.end());
+    for (int c : classes)
+        if (c < 0 || c > 255)
+            throwError("Invalid class: " + std::to_string(c) + ", must be in [0, 255]");
+
+    for (double resolution : {m_args->m_vegetResolution, m_args->m_dtmResolution, m_args->m_dsmResolution})
+        if (resolution <= 0)
+            throwError("Invalid resolution: " + std::to_string(resolution) + ", must be > 0");
+    for (double radius : {m_args->m_vegetRadius, m_args->m_waterRadius, m_args->m_waterVirtualRadius,
+                          m_args->m_waterCleanupRadius, m_args->m_overgroundRadius, m_args->m_buildingRadius,
+                          m_args->m_closedBuildingRadius, m_args->m_bridgeRadius, m_args->m_bridgeCleanupRadius,
+                          m_args->m_virtualRadius})
+        if (radius <= 0)
+            throwError("Invalid radius: " + std::to_string(radius) + ", must be > 0");
+
+    m_names[Dtm] = m_args->m_dtmDimension;
+    m_names[Dsm] = m_args->m_dsmDimension;
+    m_names[VegDsm] = "PT_VEG_DSM";
+    m_names[UnderBridge] = "PT_UNDER_BRIDGE";
+    m_names[ClosedBuilding] = "PT_CLOSED_BUILDING";
+    m_names[UnderVeget] = "PT_UNDER_VEGET";
+    m_names[OnSol] = "PT_ON_SOL";
+    m_names[OnVirt] = "PT_ON_VIRT";
+    for (int m = 0; m < MarkerCount; ++m)
+        m_written[m] = (m == Dtm || m == Dsm || m_args->m_keepTemporaryDimensions);
+}
+
+void MnxMarkingFilter::addDimensions(PointLayoutPtr layout)
+{
+    // doubles, as the dimensions added by filters.ferry in the marking pipeline
+    for (int m = 0; m < MarkerCount; ++m)
+        if (m_written[m])
+            m_dims[m] = layout->registerOrAssignDim(m_names[m], Dimension::Type::Double);
+}
+
+void MnxMarkingFilter::prepared(PointTableRef table)
+{
+    // the temporary markers which are not written are still read from the input, if it has them
+    PointLayoutPtr layout(table.layout());
+    for (int m = 0; m < MarkerCount; ++m)
+        if (!m_written[m])
+            m_dims[m] = layout->findDim(m_names[m]);
+}
+
+BOX2D MnxMarkingFilter::StepBounds::next(double stepReach)
+{
+    if (m_core.empty())
+        return BOX2D();
+
+    m_reach -= stepReach;
+    // 1m more, so that the rounding of the coordinates and of the sums does not matter
+    double margin = std::max(m_reach, 0.) + 1;
+    return BOX2D(m_core.minx - margin, m_core.miny - margin, m_core.maxx + margin, m_core.maxy + margin);
+}
+
+std::vector<double> MnxMarkingFilter::stepReaches() const
+{
+    // reach of each spatial step, in the order of mark()
+    const MnxMarkingArgs& a = *m_args;
+    return {a.m_vegetRadius + a.m_vegetRadius,               // 1.2
+            a.m_vegetRadius + a.m_vegetRadius,               // 1.3
+            a.m_vegetRadius,                                 // 1.4
+            a.m_waterRadius + a.m_waterCleanupRadius,        // 2.1
+            a.m_waterVirtualRadius + a.m_waterCleanupRadius, // 2.2
+            a.m_vegetResolution,                             // 1.5
+            a.m_dtmResolution,                               // 3.1
+            a.m_dsmResolution,                               // 3.2
+            a.m_dtmResolution,                               // 3.3 (DTM)
+            a.m_dsmResolution,                               // 3.3 (DSM)
+            a.m_overgroundRadius,                            // 4.1
+            a.m_buildingRadius,                              // 4.2
+            a.m_closedBuildingRadius,                        // 4.2
+            a.m_bridgeRadius + a.m_bridgeCleanupRadius,      // 5
+            a.m_virtualRadius + a.m_virtualRadius,           // 7.2
+            a.m_virtualRadius};                              // 7.3
+}
+
+MnxMarkingFilter::ClassSet MnxMarkingFilter::classSet(const std::vector<int>& classes) const
+{
+    ClassSet set(256, false);
+    for (int c : classes)
+        set[c] = true;
+    return set;
+}
+
+template <typename Select>
+std::unique_ptr<RadiusIndex> MnxMarkingFilter::buildIndex(const Points& points, const Select& select,
+                                                          const RadiusQuery& query) const
+{
+    PointIdList refIds;
+    BOX3D refBounds;
+    for (PointId id = 0; id < points.size(); ++id)
+        if (select(id))
+        {
+            refIds.push_back(id);
+            refBounds.grow(points.m_x[id], points.m_y[id], points.m_z[id]);
+        }
+    ArrayCoords coords {points.m_x.data(), points.m_y.data(), points.m_z.data()};
+    return buildRadiusIndex(coords, refIds, refBounds, query, "kdtree");
+}
+
+const RadiusIndex& MnxMarkingFilter::classIndex(Points& points, const std::vector<int>& classes,
+                                                const RadiusQuery& query) const
+{
+    // the kd-tree can be queried with any radius and Z limits (see RadiusIndex::makeMatcher)
+    std::vector<int> key(classes);
+    std::sort(key.begin(), key.end());
+    std::unique_ptr<RadiusIndex>& index = points.m_classIndexes[key];
+    if (!index)
+    {
+        ClassSet set = classSet(classes);
+        index = buildIndex(points, [&](PointId id) { return points.in(set, id); }, query);
+    }
+    return *index;
+}
+
+PointIdList MnxMarkingFilter::search(const Points& points, const PointIdList& srcIds,
+                                     const RadiusIndex& index, const RadiusQuery& query) const
+{
+    ApproxMatcher matcher = index.makeMatcher(query);
+
+    // each thread works on a contiguous chunk of the source points with its own list of hits,
+    // merged in chunk order
+    std::vector<PointIdList> chunkHits(chunkCount(srcIds.size(), m_args->m_threads));
+    processInChunks(srcIds.size(), m_args->m_threads,
+                    [&](uint64_t begin, uint64_t end, size_t chunk)
+                    {
+                        for (uint64_t i = begin; i < end; ++i)
+                        {
+                            PointId id = srcIds[i];
+                            if (index.anyWithin(points.m_x[id], points.m_y[id], points.m_z[id], matcher))
+                                chunkHits[chunk].push_back(id);
+                        }
+                    });
+
+    PointIdList hits;
+    for (auto& chunk : chunkHits)
+        hits.insert(hits.end(), chunk.begin(), chunk.end());
+    return hits;
+}
+
+template <typename Select>
+PointIdList MnxMarkingFilter::radiusAssign(const Points& points, const Select& src, const RadiusIndex& index,
+                                           const RadiusQuery& query, const BOX2D& bounds) const
+{
+    PointIdList srcIds;
+    for (PointId id = 0; id < points.size(); ++id)
+        if (src(id) && (bounds.empty() || bounds.contains(points.m_x[id], points.m_y[id])))
+            srcIds.push_back(id);
+    return search(points, srcIds, index, query);
+}
+
+template <typename Select>
+void MnxMarkingFilter::radiusOpening(Points& points, const Select& src, const RadiusIndex& index, Marker marker,
+                                     const RadiusQuery& query, const RadiusQuery& cleanupQuery,
+                                     const BOX2D& bounds) const
+{
+    std::vector<uint8_t>& state = points.m_markers[marker];
+
+    // with bounds, the cleanup is limited to the bounds and the marking to the bounds grown by the
+    // cleanup radius, as in filters.radius_opening
+    const double margin = cleanupQuery.m_radius;
+    std::vector<bool> inCleanup(points.size());
+    PointIdList srcIds;
+    for (PointId id = 0; id < points.size(); ++id)
+    {
+        inCleanup[id] = src(id);
+        if (!inCleanup[id])
+            continue;
+        double x = points.m_x[id], y = points.m_y[id];
+        if (bounds.empty() || (x >= bounds.minx - margin && x <= bounds.maxx + margin &&
+                               y >= bounds.miny - margin && y <= bounds.maxy + margin))
+            srcIds.push_back(id);
+    }
+    PointIdList marked = search(points, srcIds, index, query);
+    for (PointId id : marked)
+        state[id] = 1;
+
+    // cleanup: the marked points close to an unmarked point of the cleanup are unmarked
+    srcIds.clear();
+    for (PointId id = 0; id < points.size(); ++id)
+        if (inCleanup[id] && state[id] == 1 &&
+            (bounds.empty() || bounds.contains(points.m_x[id], points.m_y[id])))
+            srcIds.push_back(id);
+    std::unique_ptr<RadiusIndex> unmarkedIndex =
+        buildIndex(points, [&](PointId id) { return inCleanup[id] && state[id] == 0; }, cleanupQuery);
+    PointIdList unmarked = search(points, srcIds, *unmarkedIndex, cleanupQuery);
+    for (PointId id : unmarked)
+        state[id] = 0;
+
+    log()->get(LogLevel::Debug) << getName() << ": " << m_names[marker] << ": " << marked.size()
+                                << " points marked, " << unmarked.size() << " unmarked by the cleanup"
+                                << std::endl;
+}
+
+template <typename Select>
+void MnxMarkingFilter::gridDecimation(Points& points, const Select& select, double resolution, bool max,
+                                      Marker marker, const BOX2D& bounds) const
+{
+    // the grid covers the selected points, with cells on the multiples of the resolution
+    std::vector<bool> selected(points.size());
+    BOX2D gridBounds;
+    point_count_t count(0);
+    for (PointId id = 0; id < points.size(); ++id)
+        if (select(id))
+        {
+            selected[id] = true;
+            gridBounds.grow(points.m_x[id], points.m_y[id]);
+            count++;
+        }
+    if (count == 0)
+        return;
+
+    std::unique_ptr<GridFrame> frame;
+    try
+    {
+        frame.reset(new GridFrame(gridBounds, resolution));
+    }
+    catch (const std::out_of_range&)
+    {
+        throwError("Grid size out of range for the grid of '" + m_names[marker] + "'.");
+    }
+    GridCells cells(frame->cellCount(), count);
+    GridCellRange srcCells(*frame, bounds);
+
+    // with the same Z, the first point of the view is kept in a cell
+    for (PointId id = 0; id < points.size(); ++id)
+    {
+        if (!selected[id])
+            continue;
+        std::pair<int, int> cell = frame->cellOf(points.m_x[id], points.m_y[id]);
+        if (!srcCells.contains(cell))
+            continue;
+        PointId& kept = cells.at(frame->index(cell));
+        double z = points.m_z[id];
+        if (kept == GridCells::Empty || (max ? z > points.m_z[kept] : z < points.m_z[kept]))
+            kept = id;
+    }
+
+    std::vector<uint8_t>& state = points.m_markers[marker];
+    for (PointId id = 0; id < points.size(); ++id)
+        if (selected[id])
+            state[id] = 0;
+    cells.forEachKept([&](PointId id) { state[id] = 1; });
+}
+
+void MnxMarkingFilter::mark(Points& p) const
+{
+    const MnxMarkingArgs& a = *m_args;
+    std::vector<double> reaches = stepReaches();
+    StepBounds bounds(a.m_srcBounds, std::accumulate(reaches.begin(), reaches.end(), 0.));
+
+    const std::vector<int> ground {a.m_groundClass}, highVeget {a.m_highVegetClass};
+    const std::vector<int> bridge {a.m_bridgeClass}, virtualPoints {a.m_virtualClass};
+    // classes of the points under the vegetation (1.3), of the DSM grid (3.2), of the overground
+    // (4.1 and 7.2) and of the points under the bridges (5)
+    std::vector<int> underVeget(a.m_buildingClasses), bridgeSrc(ground), dsmClasses(a.m_buildingClasses);
+    underVeget.insert(underVeget.end(), {a.m_waterClass, a.m_bridgeClass});
+    dsmClasses.push_back(a.m_bridgeClass);
+    std::vector<int> overground(a.m_vegetClasses);
+    overground.insert(overground.end(), dsmClasses.begin(), dsmClasses.end());
+    bridgeSrc.push_back(a.m_lowVegetClass);
+    bridgeSrc.insert(bridgeSrc.end(), a.m_vegetClasses.begin(), a.m_vegetClasses.end());
+    bridgeSrc.insert(bridgeSrc.end(), a.m_buildingClasses.begin(), a.m_buildingClasses.end());
+    bridgeSrc.push_back(a.m_waterClass);
+
+    const ClassSet isVeget = classSet(a.m_vegetClasses), isUnderVeget = classSet(underVeget);
+    const ClassSet isDsm = classSet(dsmClasses), isBridgeSrc = classSet(bridgeSrc);
+    auto is = [&](int c) { return [&p, c](PointId id) { return p.m_class[id] == c; }; };
+
+    // queries: without Z limits, of the points above, and of their cleanups
+    auto flat = [](double radius) { return RadiusQuery {radius, false, -1., -1.}; };
+    auto above = [&](double radius) { return RadiusQuery {radius, false, -1., a.m_underMax2dBelow}; };
+    auto near = [&](double radius) {
+        return RadiusQuery {radius, false, a.m_underCleanupMax2d, a.m_underCleanupMax2d};
+    };
+    auto set = [&](Marker marker, const PointIdList& ids, uint8_t value) {
+        for (PointId id : ids)
+            p.m_markers[marker][id] = value;
+    };
+    auto setWhere = [&](Marker marker, uint8_t value, auto where) {
+        for (PointId id = 0; id < p.size(); ++id)
+            if (where(id))
+                p.m_markers[marker][id] = value;
+    };
+
+    // 1 - vegetation for the DSM
+    // 1.1 vegetation points
+    setWhere(VegDsm, 1, [&](PointId id) { return p.in(isVeget, id); });
+    // 1.2 ground points inside the vegetation
+    radiusOpening(p, is(a.m_groundClass), classIndex(p, a.m_vegetClasses, flat(a.m_vegetRadius)), VegDsm,
+                  flat(a.m_vegetRadius), flat(a.m_vegetRadius), bounds.next(reaches[0]));
+    // 1.3 points (except the ground) under the vegetation
+    radiusOpening(p, [&](PointId id) { return p.in(isUnderVeget, id); },
+                  classIndex(p, a.m_vegetClasses, flat(a.m_vegetRadius)), UnderVeget, above(a.m_vegetRadius),
+                  near(a.m_vegetRadius), bounds.next(reaches[1]));
+    // 1.4 low vegetation close to the high vegetation
+    set(VegDsm,
+        radiusAssign(p, is(a.m_lowVegetClass), classIndex(p, highVeget, flat(a.m_vegetRadius)),
+                     flat(a.m_vegetRadius), bounds.next(reaches[2])),
+        1);
+
+    // 2 - water
+    // 2.1 water under the ground (e.g. under overhanging rocks)
+    radiusOpening(p, is(a.m_waterClass), classIndex(p, ground, above(a.m_waterRadius)), OnSol,
+                  above(a.m_waterRadius), near(a.m_waterCleanupRadius), bounds.next(reaches[3]));
+    // 2.2 water close to the virtual points
+    radiusOpening(p, is(a.m_waterClass), classIndex(p, virtualPoints, flat(a.m_waterVirtualRadius)), OnVirt,
+                  flat(a.m_waterVirtualRadius), flat(a.m_waterCleanupRadius), bounds.next(reaches[4]));
+
+    // 1.5 and 3 - grids, in the order of the marking pipeline (the steps 2.x don't read or
+    // write the markers of 1.5)
+    gridDecimation(p, [&](PointId id) { return p.is(VegDsm, id, 1); }, a.m_vegetResolution, true, Dsm,
+                   bounds.next(reaches[5]));
+    gridDecimation(p, is(a.m_groundClass), a.m_dtmResolution, true, Dtm, bounds.next(reaches[6]));
+    gridDecimation(p, [&](PointId id) { return (p.is(UnderVeget, id, 0) && p.in(isDsm, id)) || p.is(Dsm, id, 1); },
+                   a.m_dsmResolution, true, Dsm, bounds.next(reaches[7]));
+    auto freeWater = [&](PointId id) {
+        return p.is(OnSol, id, 0) && p.is(OnVirt, id, 0) && p.m_class[id] == a.m_waterClass;
+    };
+    gridDecimation(p, freeWater, a.m_dtmResolution, false, Dtm, bounds.next(reaches[8]));
+    gridDecimation(p, [&](PointId id) { return p.is(UnderVeget, id, 0) && freeWater(id); },
+                   a.m_dsmResolution, false, Dsm, bounds.next(reaches[9]));
+
+    // 4 - ground under the vegetation, the buildings and the bridges for the DSM
+    // 4.1 DTM points close to the overground
+    set(Dsm,
+        radiusAssign(p, [&](PointId id) { return p.is(Dtm, id, 1); },
+                     classIndex(p, overground, flat(a.m_overgroundRadius)), flat(a.m_overgroundRadius),
+                     bounds.next(reaches[10])),
+        0);
+    // 4.2 ground close to the buildings
+    set(ClosedBuilding,
+        radiusAssign(p, [&](PointId id) { return p.m_class[id] == a.m_groundClass && p.is(VegDsm, id, 0); },
+                     classIndex(p, a.m_buildingClasses, flat(a.m_buildingRadius)), flat(a.m_buildingRadius),
+                     bounds.next(reaches[11])),
+        1);
+    std::unique_ptr<RadiusIndex> openGround = buildIndex(
+        p,
+        [&](PointId id) {
+            return p.m_class[id] == a.m_groundClass && p.is(ClosedBuilding, id, 0) && p.is(VegDsm, id, 0);
+        },
+        flat(a.m_closedBuildingRadius));
+    set(Dsm,
+        radiusAssign(p,
+                     [&](PointId id) {
+                         return p.m_class[id] == a.m_groundClass && p.is(Dsm, id, 0) &&
+                                p.is(ClosedBuilding, id, 1) && p.is(Dtm, id, 1);
+                     },
+                     *openGround, flat(a.m_closedBuildingRadius), bounds.next(reaches[12])),
+        1);
+    openGround.reset();
+
+    // 5 - points under the bridges, removed from the DSM
+    radiusOpening(p, [&](PointId id) { return p.in(isBridgeSrc, id); },
+                  classIndex(p, bridge, above(a.m_bridgeRadius)), UnderBridge, above(a.m_bridgeRadius),
+                  near(a.m_bridgeCleanupRadius), bounds.next(reaches[13]));
+    setWhere(Dsm, 0, [&](PointId id) { return p.is(UnderBridge, id, 1); });
+
+    // 6 - DTM points used for the DSM
+    setWhere(Dsm, 1, [&](PointId id) {
+        return p.is(Dtm, id, 1) && p.is(VegDsm, id, 0) && p.is(UnderBridge, id, 0) &&
+               p.is(ClosedBuilding, id, 0) && p.is(UnderVeget, id, 0);
+    });
+
+    // 7 - virtual points
+    // 7.1 all the virtual points for the DTM
+    setWhere(Dtm, 1, is(a.m_virtualClass));
+    // 7.2 virtual points under the overground
+    radiusOpening(p, is(a.m_virtualClass), classIndex(p, overground, flat(a.m_virtualRadius)), UnderVeget,
+                  flat(a.m_virtualRadius), flat(a.m_virtualRadius), bounds.next(reaches[14]));
+    // 7.3 virtual points under the bridges, then the other ones (water) for the DSM
+    set(UnderBridge,
+        radiusAssign(p, is(a.m_virtualClass), classIndex(p, bridge, flat(a.m_virtualRadius)),
+                     flat(a.m_virtualRadius), bounds.next(reaches[15])),
+        1);
+    setWhere(Dsm, 1, [&](PointId id) {
+        return p.m_class[id] == a.m_virtualClass && p.is(UnderVeget, id, 0) && p.is(UnderBridge, id, 0);
+    });
+
+    // 8 - points from a correlation DSM for the DTM
+    setWhere(Dtm, 1, is(a.m_correlationClass));
+}
+
+void MnxMarkingFilter::filter(PointView& view)
+{
+    auto start = std::chrono::steady_clock::now();
+
+    Points points;
+    points.m_x.resize(view.size());
+    points.m_y.resize(view.size());
+    points.m_z.resize(view.size());
+    points.m_class.resize(view.size());
+    for (int m = 0; m < MarkerCount; ++m)
+        points.m_markers[m].assign(view.size(), 0);
+
+    PointRef point(view, 0);
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        points.m_x[id] = point.getFieldAs<double>(Dimension::Id::X);
+        points.m_y[id] = point.getFieldAs<double>(Dimension::Id::Y);
+        points.m_z[id] = point.getFieldAs<double>(Dimension::Id::Z);
+        points.m_class[id] = point.getFieldAs<uint8_t>(Dimension::Id::Classification);
+        if (m_args->m_resetTags)
+            continue;
+        for (int m = 0; m < MarkerCount; ++m)
+            if (m_dims[m] != Dimension::Id::Unknown)
+            {
+                double value = point.getFieldAs<double>(m_dims[m]);
+                points.m_markers[m][id] = (value == 1) ? 1 : (value == 0 ? 0 : 2);
+            }
+    }
+
+    mark(points);
+    size_t nbIndexes = points.m_classIndexes.size();
+    points.m_classIndexes.clear();
+
+    // the markers with another value than 0 or 1 were never set: the value of the input is kept
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        for (int m = 0; m < MarkerCount; ++m)
+            if (m_written[m] && points.m_markers[m][id] != 2)
+                point.setField(m_dims[m], double(points.m_markers[m][id]));
+    }
+
+    double time = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    m_metadata.add("points_scanned", view.size());
+    m_metadata.add("marking_time", time);
+    log()->get(LogLevel::Debug) << getName() << ": " << view.size() << " points marked in " << time
+                                << " s, with " << nbIndexes << " shared indexes" << std::endl;
+}
+
+} // namespace pdal
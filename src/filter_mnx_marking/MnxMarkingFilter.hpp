@@ -0,0 +1,124 @@
+#pragma once
+
+#include <pdal/Filter.hpp>
+#include <pdal/util/Bounds.hpp>
+#include "RadiusIndex.hpp"
+
+#include <map>
+
+extern "C" int32_t MnxMarkingFilter_ExitFunc();
+extern "C" PF_ExitFunc MnxMarkingFilter_InitPlugin();
+
+namespace pdal
+{
+
+// marking of the points used for the DTM and the DSM (steps 1 to 8 of the marking pipeline of
+// mark_points_to_use_for_digital_models_with_new_dimension) in a single stage: the coordinates
+// and the classes are copied in arrays, and the temporary markers are kept in memory
+class MnxMarkingFilter : public Filter
+{
+public:
+    MnxMarkingFilter();
+    ~MnxMarkingFilter();
+
+    static void * create();
+    static int32_t destroy(void *);
+    std::string getName() const;
+
+private:
+
+    // markers of the marking: the DTM and DSM outputs, then the temporary markers
+    enum Marker { Dtm, Dsm, VegDsm, UnderBridge, ClosedBuilding, UnderVeget, OnSol, OnVirt, MarkerCount };
+
+    struct MnxMarkingArgs
+    {
+        std::string m_dtmDimension, m_dsmDimension;
+        bool m_resetTags;
+        bool m_keepTemporaryDimensions;
+        BOX2D m_srcBounds;
+        int m_threads;
+        int m_groundClass, m_lowVegetClass, m_highVegetClass, m_waterClass, m_bridgeClass;
+        int m_virtualClass, m_correlationClass;
+        std::vector<int> m_vegetClasses, m_buildingClasses;
+        double m_vegetResolution, m_dtmResolution, m_dsmResolution;
+        double m_vegetRadius;
+        double m_waterRadius, m_waterVirtualRadius, m_waterCleanupRadius;
+        double m_overgroundRadius, m_buildingRadius, m_closedBuildingRadius;
+        double m_bridgeRadius, m_bridgeCleanupRadius;
+        double m_virtualRadius;
+        double m_underMax2dBelow, m_underCleanupMax2d;
+    };
+    std::unique_ptr<MnxMarkingArgs> m_args;
+    std::string m_names[MarkerCount];
+    Dimension::Id m_dims[MarkerCount]; // Unknown for a temporary marker which is not in the layout
+    bool m_written[MarkerCount]; // markers written in the point view
+
+    typedef std::vector<bool> ClassSet; // by class value
+
+    // points of a view: markers 0 or 1, 2 for the other values of an input dimension (neither
+    // marked nor unmarked, as for the expressions of the stages)
+    struct Points
+    {
+        std::vector<double> m_x, m_y, m_z;
+        std::vector<uint8_t> m_class;
+        std::vector<uint8_t> m_markers[MarkerCount];
+        // indexes on the points of a set of classes (the classes are never modified)
+        std::map<std::vector<int>, std::unique_ptr<RadiusIndex>> m_classIndexes;
+
+        PointId size() const { return m_x.size(); }
+        bool is(Marker marker, PointId id, uint8_t value) const { return m_markers[marker][id] == value; }
+        bool in(const ClassSet& classes, PointId id) const { return classes[m_class[id]]; }
+    };
+
+    // bounds of the source points of the successive steps, as SourceBounds in the marking script:
+    // the core bounds grown by the reach of the next steps (and 1 m)
+    class StepBounds
+    {
+    public:
+        StepBounds(const BOX2D& core, double reach) : m_core(core), m_reach(reach) {}
+        BOX2D next(double stepReach);
+
+    private:
+        BOX2D m_core;
+        double m_reach;
+    };
+
+    virtual void addArgs(ProgramArgs& args);
+    virtual void initialize();
+    virtual void addDimensions(PointLayoutPtr layout);
+    virtual void prepared(PointTableRef table);
+    virtual void filter(PointView& view);
+
+    ClassSet classSet(const std::vector<int>& classes) const;
+    std::vector<double> stepReaches() const;
+    void mark(Points& points) const;
+
+    // index on the points of classes, shared by the steps
+    const RadiusIndex& classIndex(Points& points, const std::vector<int>& classes,
+                                  const RadiusQuery& query) const;
+    template <typename Select>
+    std::unique_ptr<RadiusIndex> buildIndex(const Points& points, const Select& select,
+                                            const RadiusQuery& query) const;
+    // ids of srcIds with a point of the index within the query
+    PointIdList search(const Points& points, const PointIdList& srcIds, const RadiusIndex& index,
+                       const RadiusQuery& query) const;
+
+    // filters.radius_assign: the selected points in bounds with a point of the index within the
+    // query (the assignment is left to the caller)
+    template <typename Select>
+    PointIdList radiusAssign(const Points& points, const Select& src, const RadiusIndex& index,
+                             const RadiusQuery& query, const BOX2D& bounds) const;
+    // filters.radius_opening, with the src expression as cleanup expression
+    template <typename Select>
+    void radiusOpening(Points& points, const Select& src, const RadiusIndex& index, Marker marker,
+                       const RadiusQuery& query, const RadiusQuery& cleanupQuery, const BOX2D& bounds) const;
+    // filters.grid_decimation_deprecated with a where expression
+    template <typename Select>
+    void gridDecimation(Points& points, const Select& select, double resolution, bool max,
+                        Marker marker, const BOX2D& bounds) const;
+
+    MnxMarkingFilter& operator=(const MnxMarkingFilter&) = delete;
+    MnxMarkingFilter(const MnxMarkingFilter&) = delete;
+};
+
+} // namespace pdal
@@ -1,4 +1,8 @@
 #include "RadiusAssignFilter.hpp"
+#include "MortonOrder.hpp"
+#include "ParallelChunks.hpp"
+#include "RadiusIndexBuilder.hpp"
+#include "RadiusIndexCache.hpp"
 
 #include <pdal/PipelineManager.hpp>
 #include <pdal/StageFactory.hpp>
@@ -6,6 +10,9 @@
 
 #include <pdal/Dimension.hpp>
 
+#include <algorithm>
+#include <chrono>
+#include <cmath>
 #include <iostream>
 #include <utility>
 
@@ -27,113 +34,469 @@ m_args(new RadiusAssignFilter::RadiusAssignArgs)
 
 
 RadiusAssignFilter::~RadiusAssignFilter()
-{}
+{
+    // the stages are destroyed with their pipeline, which no longer needs the cached indexes (they
+    // are usually released before, when the last stage using the cache is done)
+    for (const std::weak_ptr<PointView>& view : m_cachedViews)
+        RadiusIndexCache::instance().release(view);
+    if (m_cacheTable)
+        RadiusIndexCache::instance().removeConsumer(m_cacheTable, this);
+}
 
 
 void RadiusAssignFilter::addArgs(ProgramArgs& args)
 {
-    args.add("src_domain", "Selects which points will be subject to radius-based neighbors search", m_args->m_srcDomain, "SRC_DOMAIN");
-    args.add("reference_domain", "Selects which points will be considered as potential neighbors", m_args->m_referenceDomain, "REF_DOMAIN");
+    m_args->m_srcDomainArg = &args.add("src_domain", "Selects which points will be subject to radius-based neighbors search", m_args->m_srcDomain, "SRC_DOMAIN");
+    m_args->m_referenceDomainArg = &args.add("reference_domain", "Selects which points will be considered as potential neighbors", m_args->m_referenceDomain, "REF_DOMAIN");
     args.add("radius", "Distance of neighbors to consult", m_args->m_radius, 1.);
-    args.add("output_dimension", "Name of the added dimension", m_args->m_outputDimension, "radius");
+    m_args->m_outputDimensionArg = &args.add("output_dimension", "Name of the added dimension", m_args->m_outputDimension, "radius");
     args.add("is3d", "Search in 3d", m_args->search3d, false );
     args.add("max2d_above", "if search in 2d : upward maximum distance in Z for potential neighbors (corresponds to a search in a cylinder with a height = max2d_above above the source point). Values < 0 mean infinite height", m_args->m_max2d_above, -1.);
     args.add("max2d_below", "if search in 2d : downward maximum distance in Z for potential neighbors (corresponds to a search in a cylinder with a height = max2d_below below the source point). Values < 0 mean infinite height", m_args->m_max2d_below, -1.);
+    args.add("index", "Spatial index on the reference points: 'kdtree' or 'grid' (cells of the size of the radius)", m_args->m_index, "kdtree");
+    args.add("threads", "Number of threads used for the neighbors search", m_args->m_threads, 1);
+    args.add("view_threads", "Number of point views (e.g. from filters.chipper) searched concurrently", m_args->m_viewThreads, 1);
+    args.add("distance_dimension", "Name of a dimension set to the distance to the nearest reference point (2d or 3d), capped at the radius", m_args->m_distanceDimension);
+    args.add("index_cache_size", "Memory (in MB) of the cache of indexes shared by the radius_assign stages of a pipeline: a stage whose reference points are the same as in a previous stage reuses its index. 0 disables the cache", m_args->m_cacheSize, 0);
+    args.add("search_from", "Side of the search: 'src' (index on the reference points, searched from each source point), 'ref' (index on the source points, searched from each reference point) or 'auto' (the cheaper one, from the number and the density of the points)", m_args->m_searchFrom, "auto");
+    args.add("query_order", "Order of the neighbors searches: 'file' (order of the points) or 'morton' (along a Z-order curve, so that consecutive searches read the same parts of the index)", m_args->m_queryOrder, "file");
+    args.add("src_where", "Expression which selects the points subject to the neighbors search (replaces src_domain)", m_args->m_srcWhere);
+    args.add("ref_where", "Expression which selects the potential neighbors (replaces reference_domain)", m_args->m_refWhere);
+    args.add("src_bounds", "2d bounds '([xmin, xmax], [ymin, ymax])' of the source points: the points outside are not searched (they are only reference points)", m_args->m_srcBounds);
+    args.add("value", "Assignments ('Dimension = expression [WHERE condition]') applied to the points which have a neighbor", m_args->m_values);
 }
 
 void RadiusAssignFilter::addDimensions(PointLayoutPtr layout)
 {
-    m_args->m_dim = layout->registerOrAssignDim(m_args->m_outputDimension, Dimension::Type::Unsigned8);
-    m_args->m_dim_ref = layout->registerOrAssignDim(m_args->m_referenceDomain,Dimension::Type::Unsigned8);
-    m_args->m_dim_src = layout->registerOrAssignDim(m_args->m_srcDomain,Dimension::Type::Unsigned8);
+    if (m_writeOutput)
+        m_args->m_dim = layout->registerOrAssignDim(m_args->m_outputDimension, Dimension::Type::Unsigned8);
+    if (!m_args->m_distanceDimension.empty())
+        m_args->m_dim_distance = layout->registerOrAssignDim(m_args->m_distanceDimension, Dimension::Type::Double);
+    if (m_refExpr.empty())
+        m_args->m_dim_ref = layout->registerOrAssignDim(m_args->m_referenceDomain,Dimension::Type::Unsigned8);
+    if (m_srcExpr.empty() && !m_args->m_srcDomain.empty())
+        m_args->m_dim_src = layout->registerOrAssignDim(m_args->m_srcDomain,Dimension::Type::Unsigned8);
 }
 
 void RadiusAssignFilter::initialize()
 {
-    if (m_args->m_referenceDomain.empty())
+    if (m_args->m_srcDomainArg->set() && !m_args->m_srcWhere.empty())
+        throwError("The src_domain and src_where options can't be given together.");
+    if (m_args->m_referenceDomainArg->set() && !m_args->m_refWhere.empty())
+        throwError("The reference_domain and ref_where options can't be given together.");
+    if (m_args->m_refWhere.empty() && m_args->m_referenceDomain.empty())
         throwError("The reference_domain must be given.");
     if (m_args->m_radius <= 0)
         throwError("Invalid 'radius' option: " + std::to_string(m_args->m_radius) + ", must be > 0");
     if (m_args->m_outputDimension.empty())
         throwError("The output_dimension must be given.");
+    if (m_args->m_index != "kdtree" && m_args->m_index != "grid")
+        throwError("The index must be 'kdtree' or 'grid'.");
+    if (m_args->m_threads < 1)
+        throwError("Invalid 'threads' option: " + std::to_string(m_args->m_threads) + ", must be >= 1");
+    if (m_args->m_viewThreads < 1)
+        throwError("Invalid 'view_threads' option: " + std::to_string(m_args->m_viewThreads) + ", must be >= 1");
+    if (m_args->m_cacheSize < 0)
+        throwError("Invalid 'index_cache_size' option: " + std::to_string(m_args->m_cacheSize) + ", must be >= 0");
+    if (m_args->m_searchFrom != "auto" && m_args->m_searchFrom != "src" && m_args->m_searchFrom != "ref")
+        throwError("The search_from option must be 'auto', 'src' or 'ref'.");
+    if (m_args->m_queryOrder != "file" && m_args->m_queryOrder != "morton")
+        throwError("The query_order must be 'file' or 'morton'.");
+    if (m_args->m_searchFrom == "ref" && !m_args->m_distanceDimension.empty())
+        throwError("The distance_dimension needs a search from the source points (search_from 'src' or 'auto').");
+
+    try
+    {
+        m_srcExpr = PointExpression();
+        if (!m_args->m_srcWhere.empty())
+            m_srcExpr.parse(m_args->m_srcWhere);
+        m_refExpr = PointExpression();
+        if (!m_args->m_refWhere.empty())
+            m_refExpr.parse(m_args->m_refWhere);
+        m_assignments.clear();
+        for (const std::string& value : m_args->m_values)
+        {
+            m_assignments.emplace_back();
+            m_assignments.back().parse(value);
+        }
+    }
+    catch (const std::invalid_argument& err)
+    {
+        throwError(err.what());
+    }
+
+    // with assignments, the output dimension is only written if it is asked for
+    m_writeOutput = m_assignments.empty() || m_args->m_outputDimensionArg->set();
 }
 
 void RadiusAssignFilter::prepared(PointTableRef table)
 {
     PointLayoutPtr layout(table.layout());
+
+    std::string unknown = m_srcExpr.bind(layout);
+    if (unknown.empty())
+        unknown = m_refExpr.bind(layout);
+    for (PointAssignment& assignment : m_assignments)
+        if (unknown.empty())
+            unknown = assignment.bind(layout);
+    if (!unknown.empty())
+        throwError("Unknown dimension '" + unknown + "'.");
+
+    // the stages are prepared before any of them is executed: the indexes cached for the views of
+    // the table are released once all the stages that use the cache are done
+    if (m_args->m_cacheSize > 0)
+    {
+        m_cacheTable = &table;
+        RadiusIndexCache::instance().addConsumer(m_cacheTable, this);
+    }
 }
 
 void RadiusAssignFilter::ready(PointTableRef)
 {
-    m_args->m_ptsToUpdate.clear();
+    m_views.clear();
+    // the views of a previous execution are not searched again
+    for (const std::weak_ptr<PointView>& view : m_cachedViews)
+        RadiusIndexCache::instance().release(view);
+    m_cachedViews.clear();
 }
 
-void RadiusAssignFilter::doOneNoDomain(PointRef &pointSrc)
+PointViewSet RadiusAssignFilter::run(PointViewPtr view)
 {
-    // build3dIndex and build2dIndex are build once
-    PointIdList iNeighbors;
-    if (m_args->search3d) iNeighbors = refView->build3dIndex().radius(pointSrc, m_args->m_radius);
-    else iNeighbors = refView->build2dIndex().radius(pointSrc, m_args->m_radius);
-    
-    if (iNeighbors.size() == 0)
-        return;
+    if (m_args->m_cacheSize > 0)
+        m_cachedViews.push_back(view);
 
-    if (!m_args->search3d && (m_args->m_max2d_below>=0 || m_args->m_max2d_above>=0))
+    // with view_threads > 1, the views are searched together once they are all known
+    if (m_args->m_viewThreads > 1)
+        m_views.push_back(view);
+    else
     {
-        double Zsrc = pointSrc.getFieldAs<double>(Dimension::Id::Z);
-        
-        bool take (false);
-        for (PointId ptId : iNeighbors)
-        {
-            double Zref = refView->point(ptId).getFieldAs<double>(Dimension::Id::Z);
-            if (m_args->m_max2d_above>=0 && Zref>Zsrc && (Zref-Zsrc)>m_args->m_max2d_above) continue;
-            if (m_args->m_max2d_below>=0 && Zsrc>Zref && (Zsrc-Zref)>m_args->m_max2d_below) continue;
-            take = true;
-            break;
-        }
-
-        if (!take) return;
+        ViewSearch search;
+        search.m_view = view;
+        processView(*view, search);
+        report(search);
     }
 
-    m_args->m_ptsToUpdate.push_back(pointSrc.pointId());
+    PointViewSet viewSet;
+    viewSet.insert(view);
+    return viewSet;
+}
+
+void RadiusAssignFilter::done(PointTableRef)
+{
+    // each view has its own search state; the views share the point table, but each one only
+    // writes the fields of its own points
+    std::vector<ViewSearch> searches(m_views.size());
+    for (size_t i = 0; i < m_views.size(); ++i)
+        searches[i].m_view = m_views[i];
+    processEach(m_views.size(), m_args->m_viewThreads,
+                [&](uint64_t i) { processView(*m_views[i], searches[i]); });
+    m_views.clear();
+    for (const ViewSearch& search : searches)
+        report(search);
+
+    if (m_cacheTable)
+    {
+        RadiusIndexCache::instance().removeConsumer(m_cacheTable, this);
+        m_cacheTable = nullptr;
+    }
 }
 
-bool RadiusAssignFilter::doOne(PointRef& point)
+bool RadiusAssignFilter::isSrc(PointRef& point) const
 {
+    if (!m_srcExpr.empty())
+        return m_srcExpr.test(point);
     if (m_args->m_srcDomain.empty())  // No domain, process all points
-        doOneNoDomain(point);
-    else if (point.getFieldAs<int8_t>(m_args->m_dim_src)>0)
-        doOneNoDomain(point);
-    return true;
+        return true;
+    return point.getFieldAs<int8_t>(m_args->m_dim_src)>0;
+}
+
+bool RadiusAssignFilter::isRef(PointRef& point) const
+{
+    if (!m_refExpr.empty())
+        return m_refExpr.test(point);
+    return point.getFieldAs<int8_t>(m_args->m_dim_ref)>0;
+}
+
+bool RadiusAssignFilter::inSrcBounds(PointRef& point) const
+{
+    if (m_args->m_srcBounds.empty())
+        return true;
+    return m_args->m_srcBounds.contains(point.getFieldAs<double>(Dimension::Id::X),
+                                        point.getFieldAs<double>(Dimension::Id::Y));
 }
 
-void RadiusAssignFilter::filter(PointView& view)
+bool RadiusAssignFilter::doOneNoDomain(ViewSearch& search, PointRef &pointSrc) const
+{
+    double x = pointSrc.getFieldAs<double>(Dimension::Id::X);
+    double y = pointSrc.getFieldAs<double>(Dimension::Id::Y);
+    double z = pointSrc.getFieldAs<double>(Dimension::Id::Z);
+
+    if (!search.m_distances.empty())
+    {
+        double dist2;
+        if (!search.m_index->nearestWithin(x, y, z, *search.m_matcher, dist2))
+            return false;
+        search.m_distances[pointSrc.pointId()] = std::sqrt(dist2);
+        return true;
+    }
+
+    // the search stops on the first reference point within the radius and the Z limits
+    return search.m_index->anyWithin(x, y, z, *search.m_matcher);
+}
+
+void RadiusAssignFilter::processRange(PointView& view, ViewSearch& search, const PointIdList& srcIds,
+                                      uint64_t begin, uint64_t end, PointIdList& ptsToUpdate,
+                                      SearchStats& stats) const
 {
     PointRef point_src(view, 0);
+    for (uint64_t i = begin; i < end; ++i)
+    {
+        point_src.setPointId(srcIds[i]);
+        uint64_t visited = visitedPoints();
+        if (doOneNoDomain(search, point_src))
+            ptsToUpdate.push_back(srcIds[i]);
+        stats.add(visitedPoints() - visited);
+    }
+}
+
+void RadiusAssignFilter::processRangeFromRef(PointView& view, const ViewSearch& search, const PointIdList& refIds,
+                                             uint64_t begin, uint64_t end, PointIdList& ptsToUpdate,
+                                             SearchStats& stats) const
+{
+    // a source point found by several reference points of the chunk is only listed once
+    std::vector<bool> found(view.size());
+    std::vector<uint64_t> near;
+    PointRef point_ref(view, 0);
+    for (uint64_t i = begin; i < end; ++i)
+    {
+        point_ref.setPointId(refIds[i]);
+        near.clear();
+        uint64_t visited = visitedPoints();
+        search.m_index->allWithin(point_ref.getFieldAs<double>(Dimension::Id::X),
+                                  point_ref.getFieldAs<double>(Dimension::Id::Y),
+                                  point_ref.getFieldAs<double>(Dimension::Id::Z), *search.m_matcher, near);
+        stats.add(visitedPoints() - visited);
+        for (uint64_t id : near)
+            if (!found[id])
+            {
+                found[id] = true;
+                ptsToUpdate.push_back(id);
+            }
+    }
+}
+
+bool RadiusAssignFilter::searchFromRef(const PointIdList& srcIds, const BOX3D& srcBounds,
+                                       const PointIdList& refIds, const BOX3D& refBounds) const
+{
+    if (m_args->m_searchFrom != "auto")
+        return m_args->m_searchFrom == "ref";
+    if (!m_args->m_distanceDimension.empty() || srcIds.empty() || refIds.empty())
+        return false;
+
+    // a search from the source points stops on the first reference point found, a search from
+    // a reference point visits all the source points within the radius: their mean number comes
+    // from the density of the source points (an extent is at least the radius)
+    const double r = m_args->m_radius;
+    double area = std::max(srcBounds.maxx - srcBounds.minx, r) * std::max(srcBounds.maxy - srcBounds.miny, r);
+    double srcPerRef = srcIds.size() * 3.141592653589793 * r * r / area;
+    if (m_args->search3d)
+        srcPerRef *= (4. / 3.) * r / std::max(srcBounds.maxz - srcBounds.minz, r);
+
+    // cost of building the index (n log n) and of the queries (log n plus the points visited)
+    auto cost = [](double indexed, double queries, double visited)
+    {
+        return indexed * std::log2(indexed + 1) + queries * (std::log2(indexed + 1) + visited);
+    };
+    double nSrc = srcIds.size(), nRef = refIds.size();
+    return cost(nSrc, nRef, srcPerRef) < cost(nRef, nSrc, 1);
+}
+
+void RadiusAssignFilter::buildIndex(PointView& view, const PointIdList& ids, const BOX3D& bounds, uint64_t hash,
+                                    const RadiusQuery& query, ViewSearch& search) const
+{
+    if (m_args->m_cacheSize <= 0)
+    {
+        search.m_index = buildRadiusIndex(view, ids, bounds, query, m_args->m_index);
+        search.m_matcher.reset(new ApproxMatcher(search.m_index->makeMatcher(query)));
+        return;
+    }
+
+    // the kd-tree can be queried with any radius, the cells of the grid depend on the radius;
+    // the index does not depend on the side of the search (nor on the Z limits)
+    RadiusIndexCache::Key key {search.m_view, hash, ids.size(), m_args->m_index,
+                               m_args->search3d, m_args->m_index == "grid" ? m_args->m_radius : 0.};
+    RadiusIndexCache& cache = RadiusIndexCache::instance();
+    search.m_index = cache.get(key);
+    search.m_cacheHit = (search.m_index != nullptr) ? 1 : 0;
+    if (!search.m_index)
+    {
+        search.m_index = buildRadiusIndex(view, ids, bounds, query, m_args->m_index);
+        cache.put(key, &view.table(), search.m_index, static_cast<size_t>(m_args->m_cacheSize) << 20);
+    }
+    search.m_matcher.reset(new ApproxMatcher(search.m_index->makeMatcher(query)));
+}
+
+void RadiusAssignFilter::processView(PointView& view, ViewSearch& search) const
+{
     PointRef temp(view, 0);
 
-    refView = view.makeNew();
+    // only the ids of the points are kept: their coordinates are gathered in the index
+    PointIdList srcIds, refIds;
+    BOX3D srcBounds, refBounds;
+    RefPointsHash srcHash, refHash;
     for (PointId id = 0; id < view.size(); ++id)
     {
         temp.setPointId(id);
-        temp.setField(m_args->m_dim, int64_t(0)); // initialisation
+        if (m_writeOutput)
+            temp.setField(m_args->m_dim, int64_t(0)); // initialisation
 
         // process only points that satisfy a domain condition
-        if (temp.getFieldAs<int8_t>(m_args->m_dim_ref)>0)
-            refView->appendPoint(view, id);
+        bool src = isSrc(temp) && inSrcBounds(temp), ref = isRef(temp);
+        if (!src && !ref)
+            continue;
+        double x = temp.getFieldAs<double>(Dimension::Id::X);
+        double y = temp.getFieldAs<double>(Dimension::Id::Y);
+        double z = temp.getFieldAs<double>(Dimension::Id::Z);
+        if (src)
+        {
+            srcIds.push_back(id);
+            srcBounds.grow(x, y, z);
+            if (m_args->m_cacheSize > 0)
+                srcHash.add(id, x, y, z);
+        }
+        if (ref)
+        {
+            refIds.push_back(id);
+            refBounds.grow(x, y, z);
+            if (m_args->m_cacheSize > 0)
+                refHash.add(id, x, y, z);
+        }
     }
 
-    for (PointId id = 0; id < view.size(); ++id)
+    // the index is built on the smaller side when it is cheaper, with the same result: the
+    // search from a reference point finds the source points whose search would find it
+    bool fromRef = searchFromRef(srcIds, srcBounds, refIds, refBounds);
+    search.m_fromRef = fromRef;
+    search.m_points = view.size();
+    search.m_src = srcIds.size();
+    search.m_ref = refIds.size();
+
+    // the index is built here (not in the workers) so that it is only read during the search
+    RadiusQuery query {m_args->m_radius, m_args->search3d, m_args->m_max2d_above, m_args->m_max2d_below};
+    PointIdList& queryIds = fromRef ? refIds : srcIds;
+    auto start = std::chrono::steady_clock::now();
+    if (fromRef)
     {
-        point_src.setPointId(id);
-        doOne(point_src);
+        buildIndex(view, srcIds, srcBounds, srcHash.value(), query.reversed(), search);
+        PointIdList().swap(srcIds);
     }
-    for (auto id: m_args->m_ptsToUpdate)
+    else
+    {
+        buildIndex(view, refIds, refBounds, refHash.value(), query, search);
+        PointIdList().swap(refIds);
+    }
+    auto built = std::chrono::steady_clock::now();
+
+    // the order of the searches does not change their results
+    if (m_args->m_queryOrder == "morton")
+        sortMorton(view, queryIds);
+
+    // the points without any reference point closer than the radius get the radius
+    if (!m_args->m_distanceDimension.empty())
+        search.m_distances.assign(view.size(), m_args->m_radius);
+
+    // each thread works on a contiguous chunk of points with its own list of hits;
+    // the lists are merged in chunk order, so the result does not depend on the scheduling
+    std::vector<PointIdList> chunkHits(chunkCount(queryIds.size(), m_args->m_threads));
+    std::vector<SearchStats> chunkStats(chunkHits.size());
+    processInChunks(queryIds.size(), m_args->m_threads,
+                    [&](uint64_t begin, uint64_t end, size_t chunk)
+                    {
+                        if (fromRef)
+                            processRangeFromRef(view, search, queryIds, begin, end, chunkHits[chunk],
+                                                chunkStats[chunk]);
+                        else
+                            processRange(view, search, queryIds, begin, end, chunkHits[chunk],
+                                         chunkStats[chunk]);
+                    });
+    auto searched = std::chrono::steady_clock::now();
+    // the cached indexes are kept by the cache
+    search.m_index.reset();
+
+    PointIdList ptsToUpdate;
+    if (fromRef)
+    {
+        // the chunks can find the same source points: they are merged in the order of the ids
+        std::vector<bool> found(view.size());
+        for (auto& hits : chunkHits)
+            for (PointId id : hits)
+                found[id] = true;
+        for (PointId id = 0; id < view.size(); ++id)
+            if (found[id])
+                ptsToUpdate.push_back(id);
+    }
+    else
+        for (auto& hits : chunkHits)
+            ptsToUpdate.insert(ptsToUpdate.end(), hits.begin(), hits.end());
+
+    for (const SearchStats& chunk : chunkStats)
+    {
+        search.m_stats.m_visited += chunk.m_visited;
+        search.m_stats.m_maxVisited = std::max(search.m_stats.m_maxVisited, chunk.m_maxVisited);
+    }
+    search.m_buildTime = std::chrono::duration<double>(built - start).count();
+    search.m_queryTime = std::chrono::duration<double>(searched - built).count();
+    search.m_queries = queryIds.size();
+    search.m_hits = ptsToUpdate.size();
+
+    if (!search.m_distances.empty())
+    {
+        for (PointId id = 0; id < view.size(); ++id)
+            view.setField(m_args->m_dim_distance, id, search.m_distances[id]);
+        std::vector<double>().swap(search.m_distances);
+    }
+
+    // the assignments are applied once all the points are searched, so that they don't change
+    // the source and reference points
+    for (auto id: ptsToUpdate)
     {
         temp.setPointId(id);
-        temp.setField(m_args->m_dim, int64_t(1));
+        if (m_writeOutput)
+            temp.setField(m_args->m_dim, int64_t(1));
+        for (const PointAssignment& assignment : m_assignments)
+            assignment.apply(temp);
     }
 }
 
-} // namespace pdal
+void RadiusAssignFilter::report(const ViewSearch& search)
+{
+    m_metadata.add("search_from", search.m_fromRef ? "ref" : "src");
+    log()->get(LogLevel::Debug) << getName() << ": " << search.m_src << " source points, " << search.m_ref
+                                << " reference points, search from the "
+                                << (search.m_fromRef ? "reference" : "source") << " points" << std::endl;
+    if (search.m_cacheHit >= 0)
+    {
+        m_metadata.add("index_cache_hit", search.m_cacheHit == 1);
+        log()->get(LogLevel::Debug) << getName() << ": index of "
+                                    << (search.m_fromRef ? search.m_src : search.m_ref) << " points "
+                                    << (search.m_cacheHit == 1 ? "found in" : "added to") << " the cache"
+                                    << std::endl;
+    }
 
+    // counters of the view, read by the batch tools in the metadata of the pipeline
+    m_metadata.add("points_scanned", search.m_points);
+    m_metadata.add("src_points", search.m_src);
+    m_metadata.add("ref_points", search.m_ref);
+    m_metadata.add("index_build_time", search.m_buildTime);
+    m_metadata.add("query_time", search.m_queryTime);
+    m_metadata.add("neighbors_visited", search.m_stats.m_visited);
+    m_metadata.add("neighbors_visited_max", search.m_stats.m_maxVisited);
+    m_metadata.add("hits", search.m_hits);
+    log()->get(LogLevel::Debug) << getName() << ": index built in " << search.m_buildTime << " s, "
+                                << search.m_queries << " searches in " << search.m_queryTime << " s, "
+                                << search.m_stats.m_visited << " points visited (at most "
+                                << search.m_stats.m_maxVisited << " by a search), " << search.m_hits
+                                << " hits" << std::endl;
+}
+
+} // namespace pdal
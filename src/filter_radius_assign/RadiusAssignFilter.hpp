@@ -1,7 +1,10 @@
 #pragma once
 
 #include <pdal/Filter.hpp>
-#include <pdal/KDIndex.hpp>
+#include <pdal/util/Bounds.hpp>
+#include "RadiusIndex.hpp"
+#include "PointExpression.hpp"
+#include <algorithm>
 #include <unordered_map>
 
 extern "C" int32_t RadiusAssignFilter_ExitFunc();
@@ -27,25 +30,80 @@ private:
         std::string m_referenceDomain;
         std::string m_srcDomain;
         double m_radius;
-        PointIdList m_ptsToUpdate;
         std::string m_outputDimension;
         Dimension::Id m_dim;
         bool search3d;
         Dimension::Id m_dim_ref, m_dim_src;
         double m_max2d_above, m_max2d_below;
+        std::string m_index;
+        int m_threads;
+        int m_viewThreads;
+        int m_cacheSize;
+        std::string m_searchFrom;
+        std::string m_queryOrder;
+        std::string m_distanceDimension;
+        Dimension::Id m_dim_distance;
+        std::string m_srcWhere, m_refWhere;
+        BOX2D m_srcBounds;
+        std::vector<std::string> m_values;
+        Arg *m_srcDomainArg, *m_referenceDomainArg, *m_outputDimensionArg;
     };
     std::unique_ptr<RadiusAssignArgs> m_args;
-    PointViewPtr refView;
+    PointExpression m_srcExpr, m_refExpr;
+    std::vector<PointAssignment> m_assignments;
+    bool m_writeOutput;
+    std::vector<PointViewPtr> m_views; // views searched in done(), with view_threads > 1
+    std::vector<std::weak_ptr<PointView>> m_cachedViews; // their cached indexes are released with the stage
+    const BasePointTable* m_cacheTable = nullptr; // table of the views, while the stage uses the cache
+
+    // counters of the searches of a chunk of points
+    struct SearchStats
+    {
+        uint64_t m_visited = 0; // points read in the index
+        uint64_t m_maxVisited = 0; // by a single search
+        void add(uint64_t visited)
+        {
+            m_visited += visited;
+            m_maxVisited = std::max(m_maxVisited, visited);
+        }
+    };
+
+    // state and result of the search of a point view (the views are searched independently)
+    struct ViewSearch
+    {
+        std::weak_ptr<PointView> m_view; // searched view, key of the cached indexes
+        std::shared_ptr<RadiusIndex> m_index; // on the reference points, or on the source points
+        std::unique_ptr<ApproxMatcher> m_matcher;
+        std::vector<double> m_distances; // distances to the nearest reference point, by point id
+        bool m_fromRef = false;
+        int m_cacheHit = -1; // 1 if the index was found in the cache, 0 if not, -1 without cache
+        point_count_t m_points = 0, m_src = 0, m_ref = 0, m_queries = 0, m_hits = 0;
+        double m_buildTime = 0, m_queryTime = 0;
+        SearchStats m_stats;
+    };
     
     virtual void addArgs(ProgramArgs& args);
     virtual void prepared(PointTableRef table);
-    virtual void filter(PointView& view);
+    virtual PointViewSet run(PointViewPtr view);
     virtual void initialize();
     virtual void addDimensions(PointLayoutPtr layout);
     virtual void ready(PointTableRef);
+    virtual void done(PointTableRef table);
     
-    bool doOne(PointRef& point);
-    void doOneNoDomain(PointRef &point);
+    bool isSrc(PointRef& point) const;
+    bool isRef(PointRef& point) const;
+    bool inSrcBounds(PointRef& point) const;
+    bool doOneNoDomain(ViewSearch& search, PointRef &point) const;
+    void buildIndex(PointView& view, const PointIdList& ids, const BOX3D& bounds, uint64_t hash,
+                    const RadiusQuery& query, ViewSearch& search) const;
+    bool searchFromRef(const PointIdList& srcIds, const BOX3D& srcBounds, const PointIdList& refIds,
+                       const BOX3D& refBounds) const;
+    void processRange(PointView& view, ViewSearch& search, const PointIdList& srcIds, uint64_t begin,
+                      uint64_t end, PointIdList& ptsToUpdate, SearchStats& stats) const;
+    void processRangeFromRef(PointView& view, const ViewSearch& search, const PointIdList& refIds,
+                             uint64_t begin, uint64_t end, PointIdList& ptsToUpdate, SearchStats& stats) const;
+    void processView(PointView& view, ViewSearch& search) const;
+    void report(const ViewSearch& search);
     
     RadiusAssignFilter& operator=(const RadiusAssignFilter&) = delete;
     RadiusAssignFilter(const RadiusAssignFilter&) = delete;
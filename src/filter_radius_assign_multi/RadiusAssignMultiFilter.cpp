@@ -0,0 +1,545 @@
+#include "RadiusAssignMultiFilter.hpp"
+#include "FlatJson.hpp"
+#include "ParallelChunks.hpp"
+#include "RadiusIndexBuilder.hpp"
+
+#include <pdal/PipelineManager.hpp>
+#include <pdal/StageFactory.hpp>
+#include <pdal/util/ProgramArgs.hpp>
+#include <pdal/util/Utils.hpp>
+
+#include <pdal/Dimension.hpp>
+
+#include <algorithm>
+#include <limits>
+#include <map>
+#include <numeric>
+#include <set>
+#include <tuple>
+
+namespace pdal
+{
+
+static PluginInfo const s_info = PluginInfo(
+    "filters.radius_assign_multi",
+    "Apply several radius_assign rules in a few passes, sharing the spatial indexes",
+    "" );
+
+CREATE_SHARED_STAGE(RadiusAssignMultiFilter, s_info)
+
+std::string RadiusAssignMultiFilter::getName() const { return s_info.name; }
+
+RadiusAssignMultiFilter::RadiusAssignMultiFilter() :
+m_args(new RadiusAssignMultiFilter::RadiusAssignMultiArgs)
+{}
+
+
+RadiusAssignMultiFilter::~RadiusAssignMultiFilter()
+{}
+
+
+void RadiusAssignMultiFilter::addArgs(ProgramArgs& args)
+{
+    args.add("rules", "List of rules (JSON objects with the options of filters.radius_assign: src_domain or src_where, reference_domain or ref_where, radius, is3d, max2d_above, max2d_below, src_bounds, output_dimension, value), applied in order", m_args->m_rules);
+    args.add("index", "Spatial index on the reference points: 'kdtree' or 'grid' (cells of the size of the radius)", m_args->m_index, "kdtree");
+    args.add("threads", "Number of threads used for the neighbors search", m_args->m_threads, 1);
+    args.add("neighbor_cache_size", "Memory (in MB) of the cache of the neighbor lists shared by the rules with the same radius and 2d/3d mode. 0 disables the cache", m_args->m_neighborCacheSize, 0);
+}
+
+void RadiusAssignMultiFilter::parseRules()
+{
+    // a new initialization of the stage replaces the rules
+    m_rules.clear();
+    m_passes.clear();
+
+    std::vector<FlatJsonObject> objects;
+    try
+    {
+        objects = FlatJsonParser::parse(m_args->m_rules);
+    }
+    catch (const std::invalid_argument& err)
+    {
+        throwError(std::string("Invalid 'rules' option: ") + err.what());
+    }
+
+    for (const FlatJsonObject& object : objects)
+    {
+        Rule rule;
+        rule.m_query = RadiusQuery {1., false, -1., -1.};
+        rule.m_outputDimension = "radius";
+        for (const auto& item : object)
+        {
+            const std::string& key = item.first;
+            const std::string& value = item.second;
+            try
+            {
+                if (key == "src_domain") rule.m_srcDomain = value;
+                else if (key == "reference_domain") rule.m_referenceDomain = value;
+                else if (key == "output_dimension") rule.m_outputDimension = value;
+                else if (key == "src_where") rule.m_srcWhere.parse(value);
+                else if (key == "ref_where") rule.m_refWhere.parse(value);
+                else if (key == "value")
+                {
+                    rule.m_assignments.emplace_back();
+                    rule.m_assignments.back().parse(value);
+                }
+                else if (key == "src_bounds")
+                {
+                    // an empty value means no bounds, as for the option of radius_assign
+                    bool valid = true;
+                    try
+                    {
+                        valid = value.empty() || Utils::fromString(value, rule.m_srcBounds);
+                    }
+                    catch (const std::runtime_error&)
+                    {
+                        valid = false;
+                    }
+                    if (!valid)
+                        throw std::invalid_argument(value);
+                }
+                else if (key == "radius") rule.m_query.m_radius = std::stod(value);
+                else if (key == "max2d_above") rule.m_query.m_max2d_above = std::stod(value);
+                else if (key == "max2d_below") rule.m_query.m_max2d_below = std::stod(value);
+                else if (key == "is3d")
+                {
+                    if (value != "true" && value != "false" && value != "1" && value != "0")
+                        throw std::invalid_argument(value);
+                    rule.m_query.m_search3d = (value == "true" || value == "1");
+                }
+                else
+                    throwError("Unknown key '" + key + "' in a rule.");
+            }
+            catch (const std::logic_error&)
+            {
+                throwError("Invalid value '" + value + "' for the key '" + key + "' of a rule.");
+            }
+        }
+
+        if (!rule.m_srcDomain.empty() && !rule.m_srcWhere.empty())
+            throwError("The src_domain and src_where of a rule can't be given together.");
+        if (!rule.m_referenceDomain.empty() && !rule.m_refWhere.empty())
+            throwError("The reference_domain and ref_where of a rule can't be given together.");
+        if (rule.m_referenceDomain.empty() && rule.m_refWhere.empty())
+            throwError("The reference_domain or the ref_where of each rule must be given.");
+        if (rule.m_query.m_radius <= 0)
+            throwError("Invalid radius in a rule: " + std::to_string(rule.m_query.m_radius) + ", must be > 0");
+        if (rule.m_outputDimension.empty())
+            throwError("The output_dimension of each rule must be given.");
+        // with a value, the output dimension is only written if it is asked for
+        rule.m_writeOutput = rule.m_assignments.empty() || object.count("output_dimension");
+        m_rules.push_back(rule);
+    }
+}
+
+std::vector<std::string> RadiusAssignMultiFilter::Rule::srcDimensions() const
+{
+    if (!m_srcWhere.empty())
+        return m_srcWhere.expression().dimensionNames();
+    if (!m_srcDomain.empty())
+        return {m_srcDomain};
+    return {};
+}
+
+std::vector<std::string> RadiusAssignMultiFilter::Rule::refDimensions() const
+{
+    if (!m_refWhere.empty())
+        return m_refWhere.expression().dimensionNames();
+    return {m_referenceDomain};
+}
+
+std::vector<std::string> RadiusAssignMultiFilter::Rule::dimensionsRead() const
+{
+    std::vector<std::string> names(srcDimensions());
+    for (const std::string& name : refDimensions())
+        names.push_back(name);
+    for (const PointAssignment& assignment : m_assignments)
+        for (const std::string& name : assignment.dimensionsRead())
+            names.push_back(name);
+    return names;
+}
+
+std::vector<std::string> RadiusAssignMultiFilter::Rule::dimensionsWritten() const
+{
+    std::vector<std::string> names;
+    if (m_writeOutput)
+        names.push_back(m_outputDimension);
+    for (const PointAssignment& assignment : m_assignments)
+        names.push_back(assignment.dimension());
+    return names;
+}
+
+void RadiusAssignMultiFilter::planPasses()
+{
+    // a rule joins the current pass if it does not read a dimension written by a rule of the
+    // pass, and if the dimensions it writes are not used by the pass: the rules then keep their
+    // sequential meaning
+    std::set<std::string> written, read;
+    for (size_t i = 0; i < m_rules.size(); ++i)
+    {
+        const Rule& rule = m_rules[i];
+        std::vector<std::string> ruleRead(rule.dimensionsRead());
+        std::vector<std::string> ruleWritten(rule.dimensionsWritten());
+        bool dependent = std::any_of(ruleRead.begin(), ruleRead.end(),
+                                     [&](const std::string& name) { return written.count(name); }) ||
+                         std::any_of(ruleWritten.begin(), ruleWritten.end(),
+                                     [&](const std::string& name)
+                                     { return written.count(name) || read.count(name); });
+        if (m_passes.empty() || dependent)
+        {
+            m_passes.emplace_back();
+            written.clear();
+            read.clear();
+        }
+        m_passes.back().push_back(i);
+        written.insert(ruleWritten.begin(), ruleWritten.end());
+        read.insert(ruleRead.begin(), ruleRead.end());
+    }
+}
+
+void RadiusAssignMultiFilter::initialize()
+{
+    if (m_args->m_index != "kdtree" && m_args->m_index != "grid")
+        throwError("The index must be 'kdtree' or 'grid'.");
+    if (m_args->m_threads < 1)
+        throwError("Invalid 'threads' option: " + std::to_string(m_args->m_threads) + ", must be >= 1");
+    if (m_args->m_neighborCacheSize < 0)
+        throwError("Invalid 'neighbor_cache_size' option: " + std::to_string(m_args->m_neighborCacheSize) + ", must be >= 0");
+
+    parseRules();
+    if (m_rules.empty())
+        throwError("At least one rule must be given.");
+    planPasses();
+}
+
+void RadiusAssignMultiFilter::addDimensions(PointLayoutPtr layout)
+{
+    for (Rule& rule : m_rules)
+    {
+        if (rule.m_writeOutput)
+            rule.m_dim = layout->registerOrAssignDim(rule.m_outputDimension, Dimension::Type::Unsigned8);
+        if (rule.m_refWhere.empty())
+            rule.m_dim_ref = layout->registerOrAssignDim(rule.m_referenceDomain, Dimension::Type::Unsigned8);
+        if (rule.m_srcWhere.empty() && !rule.m_srcDomain.empty())
+            rule.m_dim_src = layout->registerOrAssignDim(rule.m_srcDomain, Dimension::Type::Unsigned8);
+    }
+}
+
+void RadiusAssignMultiFilter::prepared(PointTableRef table)
+{
+    PointLayoutPtr layout(table.layout());
+    for (Rule& rule : m_rules)
+    {
+        std::string unknown = rule.m_srcWhere.bind(layout);
+        if (unknown.empty())
+            unknown = rule.m_refWhere.bind(layout);
+        for (PointAssignment& assignment : rule.m_assignments)
+            if (unknown.empty())
+                unknown = assignment.bind(layout);
+        if (!unknown.empty())
+            throwError("Unknown dimension '" + unknown + "'.");
+    }
+}
+
+bool RadiusAssignMultiFilter::isSrc(const Rule& rule, PointRef& point) const
+{
+    if (!rule.m_srcBounds.empty() &&
+        !rule.m_srcBounds.contains(point.getFieldAs<double>(Dimension::Id::X),
+                                   point.getFieldAs<double>(Dimension::Id::Y)))
+        return false;
+    if (!rule.m_srcWhere.empty())
+        return rule.m_srcWhere.test(point);
+    return rule.m_srcDomain.empty() || point.getFieldAs<int8_t>(rule.m_dim_src)>0;
+}
+
+bool RadiusAssignMultiFilter::isRef(const Rule& rule, PointRef& point) const
+{
+    if (!rule.m_refWhere.empty())
+        return rule.m_refWhere.test(point);
+    return point.getFieldAs<int8_t>(rule.m_dim_ref)>0;
+}
+
+void RadiusAssignMultiFilter::computeNeighborLists(PointView& view, const RadiusIndex& index,
+                                                   const ApproxMatcher& matcher, const std::vector<size_t>& rules,
+                                                   size_t key, int pass, std::vector<BlockState>& blockStates,
+                                                   NeighborListCache& cache) const
+{
+    std::vector<size_t> blocks;
+    for (size_t b = 0; b < blockStates.size(); ++b)
+        if (blockStates[b].m_pass < 0)
+            blocks.push_back(b);
+
+    // the blocks are computed by batches of a few blocks per thread, so that the lists that do not
+    // fit in the cache are not all in memory at once
+    const size_t batchSize = 4 * m_args->m_threads;
+    for (size_t start = 0; start < blocks.size(); start += batchSize)
+    {
+        size_t count = std::min(batchSize, blocks.size() - start);
+        std::vector<NeighborBlock> computed;
+        for (size_t i = 0; i < count; ++i)
+            computed.emplace_back(blocks[start + i] * NeighborBlock::Size);
+
+        processInChunks(count, m_args->m_threads,
+                        [&](uint64_t begin, uint64_t end, size_t)
+                        {
+                            PointRef point(view, 0);
+                            std::vector<uint64_t> neighbors;
+                            for (uint64_t i = begin; i < end; ++i)
+                            {
+                                PointId first = blocks[start + i] * NeighborBlock::Size;
+                                PointId last = std::min<PointId>(first + NeighborBlock::Size, view.size());
+                                for (PointId id = first; id < last; ++id)
+                                {
+                                    point.setPointId(id);
+                                    if (std::none_of(rules.begin(), rules.end(),
+                                                     [&](size_t r) { return isSrc(m_rules[r], point); }))
+                                        continue;
+                                    neighbors.clear();
+                                    index.allWithin(point.getFieldAs<double>(Dimension::Id::X),
+                                                    point.getFieldAs<double>(Dimension::Id::Y),
+                                                    point.getFieldAs<double>(Dimension::Id::Z), matcher,
+                                                    neighbors);
+                                    computed[i].add(id, neighbors);
+                                }
+                            }
+                        });
+
+        for (size_t i = 0; i < count; ++i)
+        {
+            BlockState& state = blockStates[blocks[start + i]];
+            state.m_pass = pass;
+            state.m_stored = !computed[i].empty();
+            if (state.m_stored)
+                cache.put(key, blocks[start + i], std::move(computed[i]));
+        }
+    }
+}
+
+void RadiusAssignMultiFilter::filter(PointView& view)
+{
+    // the indexes are shared by the rules with the same reference points (reference domain or
+    // ref_where), radius and 2d/3d mode, until a rule writes a dimension read by the reference
+    // points
+    typedef std::tuple<std::string, double, bool> IndexKey;
+    std::map<IndexKey, std::unique_ptr<RadiusIndex>> indexes;
+    std::map<IndexKey, std::vector<std::string>> indexDimensions;
+    size_t nbIndexes(0);
+
+    // with the neighbor cache, the rules with the same radius and 2d/3d mode (when there are
+    // several of them) share the lists of the points closer than the radius from their source
+    // points, whatever their domain and their Z, searched once in an index on all the points: a
+    // rule only filters these lists with its reference domain and its Z limits. The source points
+    // without a list (evicted from the cache, or source points of a later pass only) are searched
+    // in the index on the reference domain.
+    std::vector<int> ruleKey(m_rules.size(), -1);
+    std::vector<RadiusQuery> keyQueries;
+    if (m_args->m_neighborCacheSize > 0 && view.size() <= std::numeric_limits<uint32_t>::max())
+    {
+        std::map<std::pair<double, bool>, std::vector<size_t>> rulesByKey;
+        for (size_t r = 0; r < m_rules.size(); ++r)
+            rulesByKey[{m_rules[r].m_query.m_radius, m_rules[r].m_query.m_search3d}].push_back(r);
+        for (const auto& item : rulesByKey)
+            if (item.second.size() > 1)
+            {
+                for (size_t r : item.second)
+                    ruleKey[r] = keyQueries.size();
+                keyQueries.push_back(RadiusQuery {item.first.first, item.first.second, -1., -1.});
+            }
+    }
+    NeighborListCache cache(static_cast<size_t>(m_args->m_neighborCacheSize) << 20);
+    std::vector<std::unique_ptr<RadiusIndex>> allPointsIndexes(keyQueries.size());
+    size_t nbBlocks = (view.size() + NeighborBlock::Size - 1) / NeighborBlock::Size;
+    std::vector<std::vector<BlockState>> blockStates(keyQueries.size(), std::vector<BlockState>(nbBlocks));
+    size_t nbCached(0), nbSearched(0);
+
+    PointRef point(view, 0);
+    for (size_t p = 0; p < m_passes.size(); ++p)
+    {
+        const std::vector<size_t>& pass = m_passes[p];
+        // neighbor lists of the source points of the pass, in the blocks never computed
+        for (size_t k = 0; k < keyQueries.size(); ++k)
+        {
+            std::vector<size_t> rules;
+            for (size_t r : pass)
+                if (ruleKey[r] == static_cast<int>(k))
+                    rules.push_back(r);
+            if (rules.empty())
+                continue;
+
+            if (!allPointsIndexes[k])
+            {
+                PointIdList ids(view.size());
+                std::iota(ids.begin(), ids.end(), 0);
+                BOX3D bounds;
+                view.calculateBounds(bounds);
+                allPointsIndexes[k] = buildRadiusIndex(view, ids, bounds, keyQueries[k], m_args->m_index);
+                nbIndexes++;
+            }
+            computeNeighborLists(view, *allPointsIndexes[k], allPointsIndexes[k]->makeMatcher(keyQueries[k]),
+                                 rules, k, static_cast<int>(p), blockStates[k], cache);
+        }
+
+        // build the missing indexes (for a rule with neighbor lists, only if a source point has none)
+        std::vector<const RadiusIndex*> passIndexes(pass.size(), nullptr);
+        std::vector<std::unique_ptr<ApproxMatcher>> matchers(pass.size());
+        for (size_t i = 0; i < pass.size(); ++i)
+        {
+            const Rule& rule = m_rules[pass[i]];
+            int k = ruleKey[pass[i]];
+            if (k >= 0)
+            {
+                // the blocks computed for this pass have the lists of all its source points, unless
+                // they were evicted: only the points of the other blocks are checked
+                bool missing = false;
+                for (size_t b = 0; b < nbBlocks && !missing; ++b)
+                {
+                    const BlockState& state = blockStates[k][b];
+                    const NeighborBlock* block = cache.get(k, b);
+                    if (state.m_pass == static_cast<int>(p) && (block || !state.m_stored))
+                        continue;
+                    PointId last = std::min<PointId>((b + 1) * NeighborBlock::Size, view.size());
+                    for (PointId id = b * NeighborBlock::Size; id < last && !missing; ++id)
+                    {
+                        point.setPointId(id);
+                        missing = isSrc(rule, point) && (!block || !block->has(id));
+                    }
+                }
+                if (!missing)
+                    continue;
+            }
+
+            // a domain name can't contain spaces: it can't be taken for an expression
+            std::string refs = rule.m_refWhere.empty() ? rule.m_referenceDomain
+                                                       : "where " + rule.m_refWhere.expression().text();
+            IndexKey key(refs, rule.m_query.m_radius, rule.m_query.m_search3d);
+            if (!indexes.count(key))
+            {
+                PointIdList refIds;
+                BOX3D refBounds;
+                for (PointId id = 0; id < view.size(); ++id)
+                {
+                    point.setPointId(id);
+                    if (isRef(rule, point))
+                    {
+                        refIds.push_back(id);
+                        refBounds.grow(point.getFieldAs<double>(Dimension::Id::X),
+                                       point.getFieldAs<double>(Dimension::Id::Y),
+                                       point.getFieldAs<double>(Dimension::Id::Z));
+                    }
+                }
+                indexes[key] = buildRadiusIndex(view, refIds, refBounds, rule.m_query, m_args->m_index);
+                indexDimensions[key] = rule.refDimensions();
+                nbIndexes++;
+            }
+            passIndexes[i] = indexes[key].get();
+            matchers[i].reset(new ApproxMatcher(passIndexes[i]->makeMatcher(rule.m_query)));
+        }
+
+        // search all the rules of the pass in one scan of the points; each thread works on a
+        // contiguous chunk of points with its own lists of hits
+        size_t nbChunks = chunkCount(view.size(), m_args->m_threads);
+        std::vector<std::vector<PointIdList>> chunkHits(nbChunks, std::vector<PointIdList>(pass.size()));
+        std::vector<size_t> chunkCached(nbChunks), chunkSearched(nbChunks);
+        processInChunks(view.size(), m_args->m_threads,
+                        [&](PointId begin, PointId end, size_t chunk)
+                        {
+                            PointRef pointSrc(view, begin);
+                            PointRef pointRef(view, 0);
+                            for (PointId id = begin; id < end; ++id)
+                            {
+                                pointSrc.setPointId(id);
+                                double x = pointSrc.getFieldAs<double>(Dimension::Id::X);
+                                double y = pointSrc.getFieldAs<double>(Dimension::Id::Y);
+                                double z = pointSrc.getFieldAs<double>(Dimension::Id::Z);
+                                for (size_t i = 0; i < pass.size(); ++i)
+                                {
+                                    const Rule& rule = m_rules[pass[i]];
+                                    if (!isSrc(rule, pointSrc))
+                                        continue;
+
+                                    const NeighborBlock* block = nullptr;
+                                    if (ruleKey[pass[i]] >= 0)
+                                        block = cache.get(ruleKey[pass[i]], id / NeighborBlock::Size);
+                                    bool hit = false;
+                                    if (block && block->has(id))
+                                    {
+                                        // the lists hold the points closer than the radius
+                                        auto neighbors = block->neighbors(id);
+                                        for (const uint32_t* n = neighbors.first; n != neighbors.second && !hit; ++n)
+                                        {
+                                            pointRef.setPointId(*n);
+                                            hit = isRef(rule, pointRef) &&
+                                                  (!rule.m_query.zLimited() ||
+                                                   rule.m_query.acceptZ(z, pointRef.getFieldAs<double>(Dimension::Id::Z)));
+                                        }
+                                        chunkCached[chunk]++;
+                                    }
+                                    else
+                                    {
+                                        hit = passIndexes[i]->anyWithin(x, y, z, *matchers[i]);
+                                        chunkSearched[chunk]++;
+                                    }
+                                    if (hit)
+                                        chunkHits[chunk][i].push_back(id);
+                                }
+                            }
+                        });
+        for (size_t chunk = 0; chunk < nbChunks; ++chunk)
+        {
+            nbCached += chunkCached[chunk];
+            nbSearched += chunkSearched[chunk];
+        }
+
+        for (PointId id = 0; id < view.size(); ++id)
+        {
+            point.setPointId(id);
+            for (size_t r : pass)
+                if (m_rules[r].m_writeOutput)
+                    point.setField(m_rules[r].m_dim, int64_t(0)); // initialisation
+        }
+        // the rules of a pass don't read the dimensions written by the pass: the assignments are
+        // applied once all the rules are searched
+        for (size_t i = 0; i < pass.size(); ++i)
+        {
+            const Rule& rule = m_rules[pass[i]];
+            for (auto& hits : chunkHits)
+                for (PointId id : hits[i])
+                {
+                    point.setPointId(id);
+                    if (rule.m_writeOutput)
+                        point.setField(rule.m_dim, int64_t(1));
+                    for (const PointAssignment& assignment : rule.m_assignments)
+                        assignment.apply(point);
+                }
+        }
+
+        // the indexes on reference points selected by a dimension written by the pass are outdated
+        std::set<std::string> written;
+        for (size_t r : pass)
+            for (const std::string& name : m_rules[r].dimensionsWritten())
+                written.insert(name);
+        for (auto it = indexes.begin(); it != indexes.end();)
+        {
+            const std::vector<std::string>& names = indexDimensions[it->first];
+            if (std::any_of(names.begin(), names.end(),
+                            [&](const std::string& name) { return written.count(name); }))
+                it = indexes.erase(it);
+            else
+                ++it;
+        }
+    }
+
+    log()->get(LogLevel::Debug) << getName() << ": " << m_rules.size() << " rules applied in "
+                                << m_passes.size() << " passes with " << nbIndexes << " indexes"
+                                << std::endl;
+    if (!keyQueries.empty())
+    {
+        m_metadata.add("neighbor_lists_used", nbCached);
+        m_metadata.add("neighbor_lists_evicted", cache.evictions());
+        log()->get(LogLevel::Debug) << getName() << ": " << nbCached << " searches on the neighbor lists, "
+                                    << nbSearched << " in the indexes, " << cache.evictions()
+                                    << " blocks of lists evicted" << std::endl;
+    }
+}
+
+} // namespace pdal
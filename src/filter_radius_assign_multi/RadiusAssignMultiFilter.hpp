@@ -0,0 +1,88 @@
+#pragma once
+
+#include <pdal/Filter.hpp>
+#include <pdal/util/Bounds.hpp>
+#include "NeighborListCache.hpp"
+#include "PointExpression.hpp"
+#include "RadiusIndex.hpp"
+
+extern "C" int32_t RadiusAssignMultiFilter_ExitFunc();
+extern "C" PF_ExitFunc RadiusAssignMultiFilter_InitPlugin();
+
+namespace pdal
+{
+
+// several radius_assign rules evaluated in a few passes on the points
+class RadiusAssignMultiFilter : public Filter
+{
+public:
+    RadiusAssignMultiFilter();
+    ~RadiusAssignMultiFilter();
+
+    static void * create();
+    static int32_t destroy(void *);
+    std::string getName() const;
+
+private:
+
+    // one radius_assign: the source points (m_srcDomain or m_srcWhere) with a reference point
+    // (m_referenceDomain or m_refWhere) closer than the radius get the output dimension and the
+    // assignments of the rule
+    struct Rule
+    {
+        std::string m_srcDomain;
+        std::string m_referenceDomain;
+        std::string m_outputDimension;
+        PointExpression m_srcWhere, m_refWhere;
+        std::vector<PointAssignment> m_assignments;
+        BOX2D m_srcBounds;
+        bool m_writeOutput;
+        RadiusQuery m_query;
+        Dimension::Id m_dim_src, m_dim_ref, m_dim;
+
+        // dimensions read by the selection of the source points, of the reference points, and by
+        // the assignments
+        std::vector<std::string> srcDimensions() const;
+        std::vector<std::string> refDimensions() const;
+        std::vector<std::string> dimensionsRead() const;
+        std::vector<std::string> dimensionsWritten() const;
+    };
+
+    struct RadiusAssignMultiArgs
+    {
+        std::vector<std::string> m_rules;
+        std::string m_index;
+        int m_threads;
+        int m_neighborCacheSize;
+    };
+    std::unique_ptr<RadiusAssignMultiArgs> m_args;
+    std::vector<Rule> m_rules;
+    // rules evaluated together: a rule never reads or writes a dimension written by a rule of its pass
+    std::vector<std::vector<size_t>> m_passes;
+
+    virtual void addArgs(ProgramArgs& args);
+    virtual void initialize();
+    virtual void addDimensions(PointLayoutPtr layout);
+    virtual void prepared(PointTableRef table);
+    virtual void filter(PointView& view);
+
+    void parseRules();
+    void planPasses();
+    bool isSrc(const Rule& rule, PointRef& point) const;
+    bool isRef(const Rule& rule, PointRef& point) const;
+    // state of a block of neighbor lists of a radius and 2d/3d mode
+    struct BlockState
+    {
+        int m_pass = -1;        // pass whose source points the lists were computed for (-1: none)
+        bool m_stored = false;  // false if the block has no list (no source point)
+    };
+
+    void computeNeighborLists(PointView& view, const RadiusIndex& index, const ApproxMatcher& matcher,
+                              const std::vector<size_t>& rules, size_t key, int pass,
+                              std::vector<BlockState>& blockStates, NeighborListCache& cache) const;
+
+    RadiusAssignMultiFilter& operator=(const RadiusAssignMultiFilter&) = delete;
+    RadiusAssignMultiFilter(const RadiusAssignMultiFilter&) = delete;
+};
+
+} // namespace pdal
@@ -0,0 +1,195 @@
+#include "RadiusOpeningFilter.hpp"
+#include "ParallelChunks.hpp"
+#include "RadiusIndexBuilder.hpp"
+
+#include <pdal/PipelineManager.hpp>
+#include <pdal/StageFactory.hpp>
+#include <pdal/util/ProgramArgs.hpp>
+
+#include <pdal/Dimension.hpp>
+
+namespace pdal
+{
+
+static PluginInfo const s_info = PluginInfo(
+    "filters.radius_opening",
+    "Mark the points close to reference points, then unmark the marked points close to unmarked ones",
+    "" );
+
+CREATE_SHARED_STAGE(RadiusOpeningFilter, s_info)
+
+std::string RadiusOpeningFilter::getName() const { return s_info.name; }
+
+RadiusOpeningFilter::RadiusOpeningFilter() :
+m_args(new RadiusOpeningFilter::RadiusOpeningArgs)
+{}
+
+
+RadiusOpeningFilter::~RadiusOpeningFilter()
+{}
+
+
+void RadiusOpeningFilter::addArgs(ProgramArgs& args)
+{
+    args.add("src_where", "Expression which selects the points that can be marked", m_args->m_srcWhere);
+    args.add("ref_where", "Expression which selects the reference points: the source points closer than radius are marked", m_args->m_refWhere);
+    args.add("output_dimension", "Name of the marker dimension (1: marked, 0: unmarked)", m_args->m_outputDimension);
+    args.add("radius", "Distance of the reference points for the marking", m_args->m_radius, 1.);
+    args.add("is3d", "Search in 3d", m_args->m_search3d, false);
+    args.add("max2d_above", "Marking in 2d: upward maximum distance in Z for the reference points. Values < 0 mean infinite height", m_args->m_max2d_above, -1.);
+    args.add("max2d_below", "Marking in 2d: downward maximum distance in Z for the reference points. Values < 0 mean infinite height", m_args->m_max2d_below, -1.);
+    args.add("cleanup_where", "Expression which selects the points of the cleanup: the marked points closer than cleanup_radius from an unmarked point are unmarked (default: src_where)", m_args->m_cleanupWhere);
+    m_args->m_cleanupRadiusArg = &args.add("cleanup_radius", "Distance of the unmarked points for the cleanup (default: radius)", m_args->m_cleanupRadius, 1.);
+    args.add("cleanup_max2d_above", "Cleanup in 2d: upward maximum distance in Z for the unmarked points. Values < 0 mean infinite height", m_args->m_cleanup_max2d_above, -1.);
+    args.add("cleanup_max2d_below", "Cleanup in 2d: downward maximum distance in Z for the unmarked points. Values < 0 mean infinite height", m_args->m_cleanup_max2d_below, -1.);
+    args.add("index", "Spatial index on the reference points: 'kdtree' or 'grid' (cells of the size of the radius)", m_args->m_index, "kdtree");
+    args.add("threads", "Number of threads used for the neighbors search", m_args->m_threads, 1);
+    args.add("src_bounds", "2d bounds '([xmin, xmax], [ymin, ymax])' of the points whose marker is computed: the points outside are only reference points", m_args->m_srcBounds);
+}
+
+void RadiusOpeningFilter::initialize()
+{
+    if (m_args->m_srcWhere.empty() || m_args->m_refWhere.empty())
+        throwError("The src_where and ref_where expressions must be given.");
+    if (!m_args->m_cleanupRadiusArg->set())
+        m_args->m_cleanupRadius = m_args->m_radius;
+    if (m_args->m_radius <= 0)
+        throwError("Invalid 'radius' option: " + std::to_string(m_args->m_radius) + ", must be > 0");
+    if (m_args->m_cleanupRadius <= 0)
+        throwError("Invalid 'cleanup_radius' option: " + std::to_string(m_args->m_cleanupRadius) + ", must be > 0");
+    if (m_args->m_outputDimension.empty())
+        throwError("The output_dimension must be given.");
+    if (m_args->m_index != "kdtree" && m_args->m_index != "grid")
+        throwError("The index must be 'kdtree' or 'grid'.");
+    if (m_args->m_threads < 1)
+        throwError("Invalid 'threads' option: " + std::to_string(m_args->m_threads) + ", must be >= 1");
+
+    try
+    {
+        m_srcExpr.parse(m_args->m_srcWhere);
+        m_refExpr.parse(m_args->m_refWhere);
+        m_cleanupExpr.parse(m_args->m_cleanupWhere.empty() ? m_args->m_srcWhere : m_args->m_cleanupWhere);
+    }
+    catch (const std::invalid_argument& err)
+    {
+        throwError(err.what());
+    }
+}
+
+void RadiusOpeningFilter::addDimensions(PointLayoutPtr layout)
+{
+    m_args->m_dim = layout->registerOrAssignDim(m_args->m_outputDimension, Dimension::Type::Unsigned8);
+}
+
+void RadiusOpeningFilter::prepared(PointTableRef table)
+{
+    PointLayoutPtr layout(table.layout());
+
+    for (PointExpression* expr : {&m_srcExpr, &m_refExpr, &m_cleanupExpr})
+    {
+        std::string unknown = expr->bind(layout);
+        if (!unknown.empty())
+            throwError("Unknown dimension '" + unknown + "'.");
+    }
+}
+
+PointIdList RadiusOpeningFilter::search(PointView& view, const PointIdList& srcIds,
+                                        const PointIdList& refIds, const RadiusQuery& query)
+{
+    BOX3D refBounds;
+    for (PointId id : refIds)
+        refBounds.grow(view.getFieldAs<double>(Dimension::Id::X, id),
+                       view.getFieldAs<double>(Dimension::Id::Y, id),
+                       view.getFieldAs<double>(Dimension::Id::Z, id));
+    std::unique_ptr<RadiusIndex> index = buildRadiusIndex(view, refIds, refBounds, query, m_args->m_index);
+
+    // each thread works on a contiguous chunk of the source points with its own list of hits,
+    // merged in chunk order
+    std::vector<PointIdList> chunkHits(chunkCount(srcIds.size(), m_args->m_threads));
+    processInChunks(srcIds.size(), m_args->m_threads,
+                    [&](uint64_t begin, uint64_t end, size_t chunk)
+                    {
+                        PointRef point(view, 0);
+                        for (uint64_t i = begin; i < end; ++i)
+                        {
+                            point.setPointId(srcIds[i]);
+                            if (index->anyWithin(point.getFieldAs<double>(Dimension::Id::X),
+                                                 point.getFieldAs<double>(Dimension::Id::Y),
+                                                 point.getFieldAs<double>(Dimension::Id::Z)))
+                                chunkHits[chunk].push_back(srcIds[i]);
+                        }
+                    });
+
+    PointIdList hits;
+    for (auto& chunk : chunkHits)
+        hits.insert(hits.end(), chunk.begin(), chunk.end());
+    return hits;
+}
+
+void RadiusOpeningFilter::filter(PointView& view)
+{
+    // state of the marker of each point: 0 or 1, 2 for the other values (neither marked nor
+    // unmarked for the cleanup)
+    std::vector<uint8_t> state(view.size());
+    std::vector<bool> inCleanup(view.size());
+    PointIdList srcIds, refIds;
+
+    // with src_bounds, the cleanup is limited to the bounds and the marking to the bounds grown by
+    // the cleanup radius: the unmarked points read by the cleanup are the same as without bounds
+    const BOX2D& bounds = m_args->m_srcBounds;
+    const double margin = m_args->m_cleanupRadius;
+    std::vector<bool> inBounds(view.size(), true);
+
+    PointRef point(view, 0);
+    for (PointId id = 0; id < view.size(); ++id)
+    {
+        point.setPointId(id);
+        double marker = point.getFieldAs<double>(m_args->m_dim);
+        state[id] = (marker == 1) ? 1 : (marker == 0 ? 0 : 2);
+        inCleanup[id] = m_cleanupExpr.test(point);
+        bool inMarking = true;
+        if (!bounds.empty())
+        {
+            double x = point.getFieldAs<double>(Dimension::Id::X);
+            double y = point.getFieldAs<double>(Dimension::Id::Y);
+            inBounds[id] = bounds.contains(x, y);
+            inMarking = x >= bounds.minx - margin && x <= bounds.maxx + margin &&
+                        y >= bounds.miny - margin && y <= bounds.maxy + margin;
+        }
+        if (inMarking && m_srcExpr.test(point))
+            srcIds.push_back(id);
+        if (m_refExpr.test(point))
+            refIds.push_back(id);
+    }
+
+    // marking
+    RadiusQuery markQuery {m_args->m_radius, m_args->m_search3d, m_args->m_max2d_above, m_args->m_max2d_below};
+    PointIdList marked = search(view, srcIds, refIds, markQuery);
+    for (PointId id : marked)
+        state[id] = 1;
+
+    // cleanup, on the marking kept in memory
+    srcIds.clear();
+    refIds.clear();
+    for (PointId id = 0; id < view.size(); ++id)
+        if (inCleanup[id])
+        {
+            if (state[id] == 1 && inBounds[id])
+                srcIds.push_back(id);
+            else if (state[id] == 0)
+                refIds.push_back(id);
+        }
+    RadiusQuery cleanupQuery {m_args->m_cleanupRadius, m_args->m_search3d, m_args->m_cleanup_max2d_above,
+                              m_args->m_cleanup_max2d_below};
+    PointIdList unmarked = search(view, srcIds, refIds, cleanupQuery);
+
+    for (PointId id : marked)
+        view.setField(m_args->m_dim, id, int64_t(1));
+    for (PointId id : unmarked)
+        view.setField(m_args->m_dim, id, int64_t(0));
+
+    log()->get(LogLevel::Debug) << getName() << ": " << marked.size() << " points marked, "
+                                << unmarked.size() << " unmarked by the cleanup" << std::endl;
+}
+
+} // namespace pdal
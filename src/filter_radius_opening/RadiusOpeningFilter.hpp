@@ -0,0 +1,59 @@
+#pragma once
+
+#include <pdal/Filter.hpp>
+#include <pdal/util/Bounds.hpp>
+#include "RadiusIndex.hpp"
+#include "PointExpression.hpp"
+
+extern "C" int32_t RadiusOpeningFilter_ExitFunc();
+extern "C" PF_ExitFunc RadiusOpeningFilter_InitPlugin();
+
+namespace pdal
+{
+
+// marks the source points close to a reference point, then unmarks the marked points close to an
+// unmarked point of the cleanup domain (the two radius_assign of the mark-then-unmark pattern)
+class RadiusOpeningFilter : public Filter
+{
+public:
+    RadiusOpeningFilter();
+    ~RadiusOpeningFilter();
+
+    static void * create();
+    static int32_t destroy(void *);
+    std::string getName() const;
+
+private:
+
+    struct RadiusOpeningArgs
+    {
+        std::string m_srcWhere, m_refWhere, m_cleanupWhere;
+        std::string m_outputDimension;
+        double m_radius, m_cleanupRadius;
+        bool m_search3d;
+        double m_max2d_above, m_max2d_below;
+        double m_cleanup_max2d_above, m_cleanup_max2d_below;
+        std::string m_index;
+        int m_threads;
+        BOX2D m_srcBounds;
+        Dimension::Id m_dim;
+        Arg *m_cleanupRadiusArg;
+    };
+    std::unique_ptr<RadiusOpeningArgs> m_args;
+    PointExpression m_srcExpr, m_refExpr, m_cleanupExpr;
+
+    virtual void addArgs(ProgramArgs& args);
+    virtual void initialize();
+    virtual void addDimensions(PointLayoutPtr layout);
+    virtual void prepared(PointTableRef table);
+    virtual void filter(PointView& view);
+
+    // ids of the points of srcIds with a point of refIds within the query
+    PointIdList search(PointView& view, const PointIdList& srcIds, const PointIdList& refIds,
+                       const RadiusQuery& query);
+
+    RadiusOpeningFilter& operator=(const RadiusOpeningFilter&) = delete;
+    RadiusOpeningFilter(const RadiusOpeningFilter&) = delete;
+};
+
+} // namespace pdal
@@ -0,0 +1,82 @@
+import numpy as np
+import pdal
+
+from pdal_ign_macro import macro
+
+INPUT_LAS = "test/data/mnx/input/crop_1.laz"
+
+
+def stage_types(pipeline):
+    return [stage.type for stage in pipeline.stages]
+
+
+def test_pipeline_plan_merges_adjacent_assigns():
+    plan = macro.PipelinePlan() | pdal.Reader.las(filename=INPUT_LAS)
+    plan |= pdal.Filter.ferry(dimensions="=>A, =>B")
+    plan |= pdal.Filter.assign(value=["A=0"])
+    plan |= pdal.Filter.assign(value=["B=0"])
+    plan |= pdal.Filter.assign(value="A = 1 WHERE Classification==2")
+    plan = macro.add_radius_assign(plan, 1, False, "A==1", "Classification==6", "B=1")
+    plan |= pdal.Filter.assign(value=["A=0 WHERE B==1"])
+
+    pipeline = plan.pipeline()
+
+    assert stage_types(pipeline) == [
+        "readers.las",
+        "filters.ferry",
+        "filters.assign",
+        "filters.radius_assign",
+        "filters.assign",
+    ]
+    assert pipeline.stages[2].options["value"] == ["A=0", "B=0", "A = 1 WHERE Classification==2"]
+    assert plan.explain().splitlines() == [
+        "7 stages -> 5 stages",
+        "    filters.assign: 4 -> 2",
+    ]
+
+
+def test_pipeline_plan_drops_redundant_ferries_and_zeros():
+    plan = macro.PipelinePlan(input_dimensions=["X", "Y", "Z", "Classification", "A"])
+    plan |= pdal.Reader.las(filename=INPUT_LAS)
+    plan |= pdal.Filter.ferry(dimensions="=>A, =>B")
+    plan |= pdal.Filter.ferry(dimensions="=>B, =>C")
+    plan |= pdal.Filter.assign(value=["A=0", "B=0", "C=0"])  # B and C are new: already 0
+    plan |= pdal.Filter.assign(value=["C=1 WHERE Classification==2", "C=0", "C=0"])
+
+    pipeline = plan.pipeline()
+
+    assert stage_types(pipeline) == ["readers.las", "filters.ferry", "filters.assign"]
+    assert pipeline.stages[1].options["dimensions"] == "=>B, =>C"
+    assert pipeline.stages[2].options["value"] == ["A=0", "C=1 WHERE Classification==2", "C=0"]
+
+
+def test_pipeline_plan_keeps_zeros_after_other_stages():
+    plan = macro.PipelinePlan(input_dimensions=[]) | pdal.Reader.las(filename=INPUT_LAS)
+    plan |= pdal.Filter.ferry(dimensions="=>A")
+    plan |= pdal.Filter.radius_assign(
+        src_where="Classification==2", ref_where="Classification==6", radius=1, value="A=1"
+    )
+    plan |= pdal.Filter.assign(value=["A=0"])
+
+    assert stage_types(plan.pipeline()) == stage_types(pdal.Pipeline(plan.stages))
+
+
+def test_pipeline_plan_same_result():
+    def add_stages(pipeline):
+        pipeline |= pdal.Filter.ferry(dimensions="=>A, =>B")
+        for dimension in ["A", "B"]:
+            pipeline |= pdal.Filter.assign(value=[f"{dimension}=0"])
+        pipeline |= pdal.Filter.assign(value=["A=1 WHERE Classification==2"])
+        pipeline |= pdal.Filter.assign(value=["B=1 WHERE A==1 && Z > 100"])
+        pipeline |= pdal.Filter.assign(value=["A=0 WHERE B==1"])
+        return pipeline
+
+    pipeline = add_stages(pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS))
+    pipeline.execute()
+    plan = add_stages(macro.PipelinePlan() | pdal.Reader.las(filename=INPUT_LAS))
+    optimized = plan.pipeline()
+    optimized.execute()
+
+    assert len(optimized.stages) == 3
+    for dimension in ["A", "B"]:
+        assert np.array_equal(pipeline.arrays[0][dimension], optimized.arrays[0][dimension])
@@ -77,6 +77,38 @@ def test_mark_points_to_use_for_digital_models_with_new_dimension_keep_dimension
         assert np.any(arr[dtm_dimension] == 1)
 
 
+def test_mark_points_to_use_for_digital_models_with_new_dimension_output_rasters():
+    ini_las = "test/data/4_6.las"
+    dsm_dimension = "dsm_marker"
+    dtm_dimension = "dtm_marker"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        las_output = os.path.join(tmp_dir, "mark_points_output.las")
+        output_dsm = os.path.join(tmp_dir, "dsm.tif")
+        output_dtm = os.path.join(tmp_dir, "dtm.tif")
+        mark_points_to_use_for_digital_models_with_new_dimension(
+            ini_las, las_output, dsm_dimension, dtm_dimension, output_dsm, output_dtm
+        )
+        pipeline = pdal.Reader.las(las_output).pipeline()
+        pipeline.execute()
+        arr = pipeline.arrays[0]
+
+        for dimension, raster in [(dsm_dimension, output_dsm), (dtm_dimension, output_dtm)]:
+            pipeline_raster = pdal.Reader.gdal(filename=raster, header="Z").pipeline()
+            pipeline_raster.execute()
+            pixels = pipeline_raster.arrays[0]
+            pixels = pixels[pixels["Z"] != -9999]
+
+            # max Z of the marked points of each cell of 0.5 m (cells anchored to multiples of 0.5)
+            marked = arr[arr[dimension] == 1]
+            cells = {}
+            for x, y, z in zip(marked["X"], marked["Y"], marked["Z"]):
+                cell = (np.floor(x / 0.5), np.floor(y / 0.5))
+                cells[cell] = max(z, cells.get(cell, z))
+            assert len(pixels) == len(cells)
+            for x, y, z in zip(pixels["X"], pixels["Y"], pixels["Z"]):
+                assert cells[(np.floor(x / 0.5), np.floor(y / 0.5))] == z
+
+
 def test_main_no_buffer():
     ini_las = "test/data/4_6.las"
     dsm_dimension = "dsm_marker"
@@ -140,6 +172,127 @@ def test_main_with_buffer():
         assert np.any(arr[dtm_dimension] == 1)
 
 
+def test_main_with_buffer_tmp_dir():
+    ini_las = "test/data/buffer/test_data_77055_627755_LA93_IGN69.laz"
+    dsm_dimension = "dsm_marker"
+    dtm_dimension = "dtm_marker"
+    cwd_files = set(os.listdir("."))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        las_output = os.path.join(tmp_dir, "mark_points_output.las")
+        scratch_dir = os.path.join(tmp_dir, "scratch")
+        os.mkdir(scratch_dir)
+        main(
+            ini_las,
+            las_output,
+            dsm_dimension,
+            dtm_dimension,
+            "",
+            "",
+            keep_temporary_dims=False,
+            skip_buffer=False,
+            buffer_width=10,
+            tile_width=50,
+            tile_coord_scale=10,
+            tmp_dir=scratch_dir,
+        )
+        # the temporary files are in tmp_dir, and removed
+        assert os.listdir(scratch_dir) == []
+        assert set(os.listdir(".")) == cwd_files
+
+        pipeline_in = pdal.Reader.las(ini_las).pipeline()
+        pipeline_in.execute()
+        pipeline_out = pdal.Reader.las(las_output).pipeline()
+        pipeline_out.execute()
+        arr = pipeline_out.arrays[0]
+        # only the points of the tile, without the buffer tag and the temporary dimensions
+        assert len(arr) == len(pipeline_in.arrays[0])
+        assert set(arr.dtype.names) == set(pipeline_in.arrays[0].dtype.names).union(
+            [dsm_dimension, dtm_dimension]
+        )
+        assert np.any(arr[dsm_dimension] == 1)
+
+
+@pytest.mark.parametrize(
+    "ini_las, skip_buffer",
+    [
+        ("test/data/4_6.las", True),
+        ("test/data/buffer/test_data_77055_627755_LA93_IGN69.laz", False),
+    ],
+)
+def test_main_keeps_header_and_vlrs(ini_las, skip_buffer):
+    with tempfile.NamedTemporaryFile(
+        suffix="_mark_points_output.las", delete_on_close=False
+    ) as las_output:
+        main(
+            ini_las,
+            las_output.name,
+            "dsm_marker",
+            "dtm_marker",
+            "",
+            "",
+            skip_buffer=skip_buffer,
+            buffer_width=10,
+            tile_width=50,
+            tile_coord_scale=10,
+        )
+
+        def header_and_vlrs(las_file):
+            with laspy.open(las_file) as reader:
+                header = reader.header
+            vlrs = [
+                (vlr.user_id, vlr.record_id)
+                for vlr in header.vlrs
+                if (vlr.user_id, vlr.record_id) != ("LASF_Spec", 4)  # extra bytes description
+            ]
+            fields = (
+                header.version,
+                header.point_format.id,
+                header.system_identifier,
+                header.generating_software,
+                header.creation_date,
+                int(header.global_encoding.value),
+                header.uuid,
+                tuple(header.scales),
+                tuple(header.offsets),
+            )
+            return fields, vlrs
+
+        assert header_and_vlrs(las_output.name) == header_and_vlrs(ini_las)
+
+
+def test_main_with_buffer_core_only_sources():
+    ini_las = "test/data/buffer/test_data_77055_627755_LA93_IGN69.laz"
+    dsm_dimension = "dsm_marker"
+    dtm_dimension = "dtm_marker"
+    arrays = []
+    for core_only_sources in [False, True]:
+        with tempfile.NamedTemporaryFile(
+            suffix="_mark_points_output.las", delete_on_close=False
+        ) as las_output:
+            main(
+                ini_las,
+                las_output.name,
+                dsm_dimension,
+                dtm_dimension,
+                "",
+                "",
+                keep_temporary_dims=True,
+                skip_buffer=False,
+                buffer_width=10,
+                tile_width=50,
+                tile_coord_scale=10,
+                core_only_sources=core_only_sources,
+            )
+            pipeline_out = pdal.Reader.las(las_output.name).pipeline()
+            pipeline_out.execute()
+            arrays.append(pipeline_out.arrays[0])
+
+    # the buffer points are removed from the output: the points of the tile have the same markers
+    assert len(arrays[0]) == len(arrays[1])
+    for dim in [dsm_dimension, dtm_dimension, "PT_VEG_DSM", "PT_UNDER_BRIDGE", "PT_UNDER_VEGET"]:
+        assert np.array_equal(arrays[0][dim], arrays[1][dim])
+
+
 def test_parse_args():
     # sanity check for arguments parsing
     args = parse_args(
@@ -162,7 +315,8 @@ def test_parse_args():
         "68.laz",
     ],
 )
-def test_algo_mark_points_for_dm_with_reference(crop):
+@pytest.mark.parametrize("native_filter", [False, True])
+def test_algo_mark_points_for_dm_with_reference(crop, native_filter):
     ini_las = "test/data/mnx/input/" + crop
     dsm_dimension = "dsm_marker"
     dtm_dimension = "dtm_marker"
@@ -177,6 +331,7 @@ def test_algo_mark_points_for_dm_with_reference(crop):
             "",
             keep_temporary_dims=False,
             skip_buffer=True,
+            native_filter=native_filter,
         )
 
         def sort_points(points):
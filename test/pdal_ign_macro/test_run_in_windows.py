@@ -0,0 +1,102 @@
+import tempfile
+
+import numpy as np
+import pdal
+import pytest
+
+from pdal_ign_macro import macro
+from pdal_ign_macro.run_in_windows import core_mask, run_in_windows, split_in_windows
+
+INPUT_LAS = "test/data/mnx/input/crop_1.laz"
+
+
+def add_stages(pipeline):
+    pipeline |= pdal.Filter.ferry(dimensions="=>MARKER")
+    pipeline = macro.add_radius_opening(
+        pipeline,
+        radius=1.5,
+        search_3d=False,
+        condition_src="Classification==2",
+        condition_ref="Classification==4 || Classification==5",
+        dimension="MARKER",
+        cleanup_radius=1,
+    )
+    pipeline |= pdal.Filter.radius_assign(
+        src_where="Classification==1",
+        ref_where="Classification==6",
+        radius=2,
+        output_dimension="NEAR_BUILDING",
+    )
+    return pipeline
+
+
+def sorted_array(array):
+    return array[np.lexsort((array["GpsTime"], array["Z"], array["Y"], array["X"]))]
+
+
+def test_split_in_windows_each_point_in_one_window():
+    points = np.zeros(1000, dtype=[("X", float), ("Y", float)])
+    rng = np.random.default_rng(0)
+    points["X"] = np.round(rng.uniform(0, 50, len(points)), 1)
+    points["Y"] = np.round(rng.uniform(10, 35, len(points)), 1)
+    # points on the borders of the windows
+    points["X"][:10] = 20
+    points["Y"][10:20] = 30
+
+    windows = split_in_windows(0, 50, 10, 35, 10)
+    assert len(windows) == 15
+    count = np.sum([core_mask(points, window) for window in windows], axis=0)
+    assert np.all(count == 1)
+
+
+@pytest.mark.parametrize("window_size", [15, 1000])
+def test_run_in_windows_same_as_whole_tile(window_size):
+    with tempfile.NamedTemporaryFile(suffix="_windows.las", delete_on_close=False) as las_output:
+        # the halo covers the radius of the opening and of its cleanup, and the last radius
+        run_in_windows(
+            INPUT_LAS, las_output.name, add_stages, window_size, halo=2.5, chunk_size=5000
+        )
+
+        pipeline = add_stages(pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS))
+        pipeline.execute()
+        array_whole = sorted_array(pipeline.arrays[0])
+
+        pipeline = pdal.Reader.las(filename=las_output.name).pipeline()
+        pipeline.execute()
+        array_windows = sorted_array(pipeline.arrays[0])
+
+    assert len(array_windows) == len(array_whole)
+    assert np.count_nonzero(array_whole["MARKER"]) > 0
+    for dim in ["X", "Y", "Z", "Classification", "MARKER", "NEAR_BUILDING"]:
+        assert np.array_equal(array_windows[dim], array_whole[dim])
+
+
+def add_grid_stages(pipeline):
+    # cells anchored to (0, 0) by default: the same in each window as on the whole tile
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        resolution=0.75, output_type="max", output_dimension="grid"
+    )
+    return pipeline
+
+
+def test_run_in_windows_grid_decimation():
+    with tempfile.NamedTemporaryFile(suffix="_windows.las", delete_on_close=False) as las_output:
+        # the cell of a point of a window is in the window and a halo of one cell
+        run_in_windows(INPUT_LAS, las_output.name, add_grid_stages, 15, halo=0.75, chunk_size=5000)
+
+        pipeline = add_grid_stages(pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS))
+        pipeline.execute()
+        array_whole = sorted_array(pipeline.arrays[0])
+
+        pipeline = pdal.Reader.las(filename=las_output.name).pipeline()
+        pipeline.execute()
+        array_windows = sorted_array(pipeline.arrays[0])
+
+    assert len(array_windows) == len(array_whole)
+    assert np.count_nonzero(array_whole["grid"]) > 0
+    assert np.array_equal(array_windows["grid"], array_whole["grid"])
+
+
+def test_run_in_windows_invalid_window_size():
+    with pytest.raises(ValueError):
+        run_in_windows(INPUT_LAS, "unused.las", add_stages, window_size=0, halo=1)
@@ -0,0 +1,84 @@
+from test import utils
+
+import numpy as np
+import pdal
+import pytest
+
+from pdal_ign_macro import macro
+
+INPUT_LAS = "test/data/mnx/input/crop_1.laz"
+
+
+def test_class_mask_bits():
+    utils.pdal_has_plugin("filters.class_mask")
+
+    classes = [2, 3, 4, 5, 6, 9, 17, 67]
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS)
+    pipeline |= pdal.Filter.class_mask(classes=classes)
+    pipeline.execute()
+    arr = pipeline.arrays[0]
+
+    expected = np.zeros(len(arr), dtype=np.uint32)
+    for i, c in enumerate(classes):
+        expected[arr["Classification"] == c] = 1 << i
+    assert np.any(expected != 0)
+    assert np.array_equal(arr["ClassMask"], expected)
+
+
+@pytest.mark.parametrize(
+    "src_classes, ref_classes", [([2], [4, 5]), ([6, 9, 17, 67], [4, 5, 6, 17, 67])]
+)
+def test_class_mask_conditions_same_as_build_condition(src_classes, ref_classes):
+    utils.pdal_has_plugin("filters.class_mask")
+    class_mask = macro.ClassMask([2, 3, 4, 5, 6, 9, 17, 67], "MASK")
+
+    def marker(condition):
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS)
+        pipeline |= pdal.Filter.ferry(dimensions="=>MARKER")
+        pipeline = class_mask.add_stage(pipeline)
+        pipeline |= pdal.Filter.radius_assign(
+            src_where=condition(src_classes),
+            ref_where=condition(ref_classes),
+            value="MARKER = 1",
+            radius=1.5,
+        )
+        pipeline.execute()
+        return pipeline.arrays[0]["MARKER"]
+
+    marker_mask = marker(class_mask.condition)
+    marker_chain = marker(lambda classes: macro.build_condition("Classification", classes))
+
+    assert np.count_nonzero(marker_mask) > 0
+    assert np.array_equal(marker_mask, marker_chain)
+
+
+def test_class_mask_condition_unknown_class():
+    class_mask = macro.ClassMask([2, 3, 4, 5])
+
+    assert class_mask.condition([5, 3]) == "(ClassMask & 10)"
+    with pytest.raises(ValueError):
+        class_mask.condition([6])
+
+
+def test_bitwise_and_precedence():
+    utils.pdal_has_plugin("filters.class_mask")
+    class_mask = macro.ClassMask([2, 3, 4, 5], "MASK")
+
+    def marker(src_where):
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS)
+        pipeline |= pdal.Filter.ferry(dimensions="=>MARKER")
+        pipeline = class_mask.add_stage(pipeline)
+        pipeline |= pdal.Filter.radius_assign(
+            src_where=src_where,
+            ref_where=class_mask.condition([2, 3, 4, 5]),
+            value="MARKER = 1",
+            radius=1.5,
+        )
+        pipeline.execute()
+        return pipeline.arrays[0]["MARKER"]
+
+    # as in C, & binds looser than the comparisons: MASK & (2 == 2) is MASK & 1, the class 2
+    marker_unparenthesized = marker("MASK & 2 == 2")
+    assert np.count_nonzero(marker_unparenthesized) > 0
+    assert np.array_equal(marker_unparenthesized, marker("Classification == 2"))
+    assert not np.array_equal(marker_unparenthesized, marker("(MASK & 2) == 2"))
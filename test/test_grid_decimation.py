@@ -5,6 +5,7 @@ import os
 import tempfile
 from test import utils
 
+import numpy as np
 import pdal
 import pdaltools.las_info as li
 import pytest
@@ -28,8 +29,11 @@ def run_filter(output_type, resolution):
 
     bounds = li.las_get_xy_bounds(ini_las)
 
-    d_width = math.floor((bounds[0][1] - bounds[0][0]) / resolution) + 1
-    d_height = math.floor((bounds[1][1] - bounds[1][0]) / resolution) + 1
+    # the cells are on the multiples of the resolution, from the cell (col0, lig0)
+    col0 = math.floor(bounds[0][0] / resolution)
+    lig0 = math.floor(bounds[1][0] / resolution)
+    d_width = math.floor(bounds[0][1] / resolution) - col0 + 1
+    d_height = math.floor(bounds[1][1] / resolution) - lig0 + 1
     nb_dalle = d_width * d_height
 
     PIPELINE = [
@@ -55,18 +59,18 @@ def run_filter(output_type, resolution):
         if pt["grid"] > 0:
             nb_pts_grid += 1
 
-    assert nb_pts_grid == nb_dalle
-
+    nb_occupied = 0
     for lig in range(d_height):
         for col in range(d_width):
 
             cell = [
-                bounds[0][0] + col * resolution,
-                bounds[0][0] + (col + 1) * resolution,
-                bounds[1][0] + lig * resolution,
-                bounds[1][0] + (lig + 1) * resolution,
+                (col0 + col) * resolution,
+                (col0 + col + 1) * resolution,
+                (lig0 + lig) * resolution,
+                (lig0 + lig + 1) * resolution,
             ]
 
+            nbPtsCrop = 0
             nbThreadPtsCrop = 0
             ZRef = 0
             ZRefGrid = 0
@@ -77,6 +81,7 @@ def run_filter(output_type, resolution):
                 if not contains(cell, x, y):
                     continue
 
+                nbPtsCrop += 1
                 z = pt["Z"]
                 if output_type == "max":
                     if ZRef == 0 or z > ZRef:
@@ -89,9 +94,15 @@ def run_filter(output_type, resolution):
                     nbThreadPtsCrop += 1
                     ZRefGrid = z
 
+            # the cells on the sides of the grid may be empty
+            if nbPtsCrop == 0:
+                continue
+            nb_occupied += 1
             assert nbThreadPtsCrop == 1
             assert ZRef == ZRefGrid
 
+    assert nb_pts_grid == nb_occupied
+
     data = []
     with open(tmp_out_wkt, "r") as f:
         reader = csv.reader(f, delimiter="\t")
@@ -133,3 +144,240 @@ def test_grid_decimation_empty():
         # since pdal 2.9, the filter is not run if the view is empty
         # => the output wkt file is not created
         assert not os.path.exists(tmp_out_wkt.name)
+
+
+@pytest.mark.parametrize("output_type", ["min", "max"])
+def test_grid_decimation_query_order(output_type):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    arrays = {}
+    for query_order in ["file", "morton"]:
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.grid_decimation_deprecated(
+            resolution=1,
+            output_type=output_type,
+            output_dimension="grid",
+            query_order=query_order,
+        )
+        pipeline.execute()
+        arrays[query_order] = pipeline.arrays[0]
+
+    assert (arrays["file"]["grid"] == arrays["morton"]["grid"]).all()
+
+
+def run_grid_decimation(ini_las, **options):
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        output_type="max", output_dimension="grid", **options
+    )
+    pipeline.execute()
+    return pipeline.arrays[0]
+
+
+def test_grid_decimation_src_bounds():
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+    resolution = 1
+
+    array_all = run_grid_decimation(ini_las, resolution=resolution)
+    # the cells are on the multiples of the resolution, the limit is in the middle of a cell
+    xmin = math.floor(float(np.min(array_all["X"])) / resolution) * resolution
+    ymin, ymax = float(np.min(array_all["Y"])), float(np.max(array_all["Y"]))
+    src_bounds = ([xmin, xmin + 10.5 * resolution], [ymin, ymax])
+    array_bounds = run_grid_decimation(ini_las, resolution=resolution, src_bounds=str(src_bounds))
+
+    # the cells which intersect the bounds (up to the 11th column) keep the same points, the
+    # other ones are skipped
+    in_cells = array_all["X"] < xmin + 11 * resolution
+    assert np.count_nonzero(array_all["grid"][~in_cells]) > 0
+    assert (array_all["grid"][in_cells] == array_bounds["grid"][in_cells]).all()
+    assert np.count_nonzero(array_bounds["grid"][~in_cells]) == 0
+
+
+def test_grid_decimation_metadata_counters():
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        resolution=1, output_type="max", output_dimension="grid"
+    )
+    pipeline.execute()
+    array = pipeline.arrays[0]
+
+    def value(key):
+        values = utils.find_metadata_values(pipeline.metadata, key)
+        assert len(values) == 1
+        return float(values[0])
+
+    xmin, xmax = np.min(array["X"]), np.max(array["X"])
+    ymin, ymax = np.min(array["Y"]), np.max(array["Y"])
+    # cells of 1 on the multiples of 1
+    cells = (math.floor(xmax) - math.floor(xmin) + 1) * (math.floor(ymax) - math.floor(ymin) + 1)
+    assert value("points_scanned") == len(array)
+    assert value("points_processed") == len(array)
+    assert value("cell_count") == cells
+    assert value("occupied_cells") == np.count_nonzero(array["grid"])
+    assert value("grid_time") >= 0
+
+
+@pytest.mark.parametrize("view_threads", [1, 3])
+def test_grid_decimation_several_views(view_threads):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+    options = dict(resolution=2, output_type="max", output_dimension="grid")
+
+    # each view has its own grid: each chip gets the result of the filter on its own
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.chipper(capacity=5000)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(view_threads=view_threads, **options)
+    pipeline.execute()
+    assert len(pipeline.arrays) > 1
+
+    for chip in pipeline.arrays:
+        chip_pipeline = pdal.Filter.grid_decimation_deprecated(**options).pipeline(chip)
+        chip_pipeline.execute()
+        assert np.count_nonzero(chip["grid"]) > 0
+        assert (chip["grid"] == chip_pipeline.arrays[0]["grid"]).all()
+
+
+def expected_grid(array, resolution, output_type, origin=(0, 0)):
+    """Points kept by the grid decimation (the first point of the view for the same Z), with
+    cells anchored to the origin"""
+    x, y = array["X"], array["Y"]
+    x0, y0 = origin
+    cells = []
+    for v, vmin in [(x, x0), (y, y0)]:
+        c = np.floor((v - vmin) / resolution)
+        # same rounding as the filter
+        c -= v < vmin + c * resolution
+        c += v >= vmin + (c + 1) * resolution
+        cells.append(c.astype(np.int64) - int(np.min(c)))
+    cell = cells[1] * (np.max(cells[0]) + 1) + cells[0]
+    z = array["Z"] if output_type == "min" else -array["Z"]
+    order = np.lexsort((np.arange(len(array)), z, cell))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = cell[order][1:] != cell[order][:-1]
+    keep = np.zeros(len(array), dtype=bool)
+    keep[order[first]] = True
+    return keep
+
+
+# 0.1: many more cells than points (hash table of the occupied cells)
+@pytest.mark.parametrize("resolution", [1, 0.1])
+@pytest.mark.parametrize("output_type", ["min", "max"])
+def test_grid_decimation_cells(resolution, output_type):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        resolution=resolution, output_type=output_type, output_dimension="grid"
+    )
+    pipeline.execute()
+    array = pipeline.arrays[0]
+
+    assert np.array_equal(array["grid"] == 1, expected_grid(array, resolution, output_type))
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize("output_type", ["min", "max"])
+def test_grid_decimation_threads(threads, output_type):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    # many points with the same Z: the first point of the view is kept in a cell
+    pipeline |= pdal.Filter.assign(value=["Z = 0 WHERE Classification == 2"])
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        resolution=1, output_type=output_type, output_dimension="grid", threads=threads
+    )
+    pipeline.execute()
+    array = pipeline.arrays[0]
+
+    assert np.array_equal(array["grid"] == 1, expected_grid(array, 1, output_type))
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_grid_decimation_origin(threads):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    # cells anchored to the given origin, not to the multiples of the resolution
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(
+        resolution=0.75,
+        output_type="max",
+        output_dimension="grid",
+        origin_x=0.25,
+        origin_y=0.5,
+        threads=threads,
+    )
+    pipeline.execute()
+    array = pipeline.arrays[0]
+
+    origin = (0.25, 0.5)
+    assert np.array_equal(array["grid"] == 1, expected_grid(array, 0.75, "max", origin=origin))
+    assert not np.array_equal(array["grid"] == 1, expected_grid(array, 0.75, "max"))
+
+
+def test_grid_decimation_origin_x_only():
+    ini_las = "test/data/4_6.las"
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_deprecated(resolution=1, origin_x=0)
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
+
+
+def read_raster(filename):
+    """Values of the raster by cell (column and row of the pixel centers, with resolution 1 and
+    cells anchored to (0, 0)), without the nodata pixels"""
+    pipeline = pdal.Pipeline() | pdal.Reader.gdal(filename=filename, header="Z")
+    pipeline.execute()
+    array = pipeline.arrays[0]
+    array = array[array["Z"] != -9999]
+    return {(math.floor(p["X"]), math.floor(p["Y"])): p["Z"] for p in array}
+
+
+@pytest.mark.parametrize("output_type", ["min", "max"])
+def test_grid_decimation_output_raster(output_type):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    with tempfile.NamedTemporaryFile(suffix="_grid.tif") as tmp_raster:
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.grid_decimation_deprecated(
+            resolution=1,
+            output_type=output_type,
+            output_dimension="grid",
+            output_raster=tmp_raster.name,
+            origin_x=0,
+            origin_y=0,
+        )
+        pipeline.execute()
+        array = pipeline.arrays[0]
+        raster = read_raster(tmp_raster.name)
+
+    # a pixel by occupied cell, with the Z of the kept point
+    kept = array[array["grid"] == 1]
+    assert raster == {(math.floor(p["X"]), math.floor(p["Y"])): p["Z"] for p in kept}
+
+
+def test_grid_decimation_output_raster_only():
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_deprecated")
+
+    with tempfile.NamedTemporaryFile(suffix="_grid.tif") as tmp_raster:
+        # no output_dimension: the points are not marked
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.grid_decimation_deprecated(
+            resolution=1,
+            output_dimension="",
+            output_raster=tmp_raster.name,
+            origin_x=0,
+            origin_y=0,
+        )
+        pipeline.execute()
+        assert "grid" not in pipeline.arrays[0].dtype.names
+        assert len(read_raster(tmp_raster.name)) > 0
@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+from test import utils
+
+import numpy as np
+import pdal
+import pytest
+
+GRIDS = [
+    dict(resolution=0.75, output_type="max", where="Classification==5", output_dimension="OUT_A"),
+    dict(resolution=0.5, output_type="max", where="Classification==2", output_dimension="OUT_B"),
+    # same output dimension as a previous grid
+    dict(resolution=0.5, output_type="min", where="Classification==6", output_dimension="OUT_A"),
+    # grid that depends on the output of a previous grid (in a second pass)
+    dict(
+        resolution=0.5,
+        output_type="max",
+        where="OUT_A==1 || Classification==4",
+        output_dimension="OUT_C",
+    ),
+    # all the points
+    dict(resolution=2, output_type="min", output_dimension="OUT_D"),
+]
+
+
+def build_pipeline(ini_las):
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.ferry(dimensions="=>OUT_A, =>OUT_B, =>OUT_C, =>OUT_D")
+    return pipeline
+
+
+def test_grid_decimation_multi_same_as_chained_grid_decimation():
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    utils.pdal_has_plugin("filters.grid_decimation_multi")
+
+    pipeline_chained = build_pipeline(ini_las)
+    for grid in GRIDS:
+        pipeline_chained |= pdal.Filter.grid_decimation_deprecated(**grid)
+    pipeline_chained.execute()
+    array_chained = pipeline_chained.arrays[0]
+
+    pipeline_multi = build_pipeline(ini_las)
+    pipeline_multi |= pdal.Filter.grid_decimation_multi(grids=json.dumps(GRIDS))
+    pipeline_multi.execute()
+    array_multi = pipeline_multi.arrays[0]
+
+    for dim in ["OUT_A", "OUT_B", "OUT_C", "OUT_D"]:
+        assert np.count_nonzero(array_chained[dim]) > 0
+        assert np.array_equal(array_chained[dim], array_multi[dim])
+
+
+def test_grid_decimation_multi_src_bounds():
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.grid_decimation_multi")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline.execute()
+    array = pipeline.arrays[0]
+    xmin, xmax = float(np.min(array["X"])), float(np.max(array["X"]))
+    ymin, ymax = float(np.min(array["Y"])), float(np.max(array["Y"]))
+    src_bounds = str(([xmin, (xmin + xmax) / 2], [ymin, ymax]))
+    grid = dict(resolution=1, output_type="max", output_dimension="grid")
+
+    pipeline_single = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline_single |= pdal.Filter.grid_decimation_deprecated(src_bounds=src_bounds, **grid)
+    pipeline_single.execute()
+
+    pipeline_multi = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline_multi |= pdal.Filter.grid_decimation_multi(
+        grids=json.dumps([dict(src_bounds=src_bounds, **grid)])
+    )
+    pipeline_multi.execute()
+
+    assert np.array_equal(pipeline_single.arrays[0]["grid"], pipeline_multi.arrays[0]["grid"])
+
+
+@pytest.mark.parametrize(
+    "grids",
+    [
+        [dict(resolution=0, output_dimension="OUT")],
+        [dict(output_type="mean", output_dimension="OUT")],
+        [dict(resolution=1, output_dimension="OUT", unknown_key=1)],
+        [],
+    ],
+)
+def test_grid_decimation_multi_invalid_grids(grids):
+    ini_las = "test/data/4_6.las"
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.grid_decimation_multi(grids=json.dumps(grids))
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
+
+
+def test_grid_decimation_multi_output_raster():
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    utils.pdal_has_plugin("filters.grid_decimation_multi")
+    grids = [
+        dict(resolution=0.5, output_type="max", where="Classification==2", origin_x=0, origin_y=0),
+        dict(resolution=0.5, output_type="max", where="Classification==6", origin_x=0, origin_y=0),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rasters = [os.path.join(tmp_dir, f"multi_{i}.tif") for i in range(len(grids))]
+        # rasters of the grids without marks, computed together
+        pipeline_multi = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline_multi |= pdal.Filter.grid_decimation_multi(
+            grids=json.dumps(
+                [
+                    dict(output_dimension="", output_raster=raster, **grid)
+                    for grid, raster in zip(grids, rasters)
+                ]
+            )
+        )
+        pipeline_multi.execute()
+
+        for grid, raster in zip(grids, rasters):
+            raster_single = os.path.join(tmp_dir, "single.tif")
+            pipeline_single = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+            pipeline_single |= pdal.Filter.grid_decimation_deprecated(
+                output_raster=raster_single, **grid
+            )
+            pipeline_single.execute()
+
+            with open(raster, "rb") as f_multi, open(raster_single, "rb") as f_single:
+                assert f_multi.read() == f_single.read()
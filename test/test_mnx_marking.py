@@ -0,0 +1,114 @@
+import tempfile
+from test import utils
+
+import numpy as np
+import pdal
+import pytest
+
+from pdal_ign_macro.mark_points_to_use_for_digital_models_with_new_dimension import (
+    define_marking_pipeline,
+)
+
+MARKERS = [
+    "dtm_marker",
+    "dsm_marker",
+    "PT_VEG_DSM",
+    "PT_UNDER_BRIDGE",
+    "PT_CLOSED_BUILDING",
+    "PT_UNDER_VEGET",
+    "PT_ON_SOL",
+    "PT_ON_VIRT",
+]
+
+
+def run_reference(ini_las, reset_tags=False, core_bounds=None):
+    """Markers of the chain of stages of the marking script"""
+    with tempfile.NamedTemporaryFile(suffix="_reference.las") as las_output:
+        pipeline, _ = define_marking_pipeline(
+            ini_las, las_output.name, "dsm_marker", "dtm_marker", reset_tags, core_bounds
+        )
+        pipeline.execute()
+    return pipeline.arrays[0]
+
+
+def run_filter(ini_las, **options):
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.mnx_marking(keep_temporary_dimensions=True, **options)
+    pipeline.execute()
+    return pipeline.arrays[0]
+
+
+@pytest.mark.parametrize(
+    "ini_las",
+    [
+        "test/data/4_6.las",
+        "test/data/mnx/input/crop_1.laz",
+        "test/data/mnx/input/crop_3.laz",
+        "test/data/mnx/input/bat.laz",
+        "test/data/mnx/input/pont.laz",
+        "test/data/mnx/input/corse.laz",
+        "test/data/mnx/input/68.laz",
+    ],
+)
+def test_mnx_marking_same_as_marking_pipeline(ini_las):
+    utils.pdal_has_plugin("filters.mnx_marking")
+
+    array_reference = run_reference(ini_las)
+    array_filter = run_filter(ini_las)
+
+    assert np.count_nonzero(array_filter["dtm_marker"]) > 0
+    assert np.count_nonzero(array_filter["dsm_marker"]) > 0
+    for dim in MARKERS:
+        assert np.array_equal(array_reference[dim], array_filter[dim]), dim
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_mnx_marking_core_bounds(threads):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.mnx_marking")
+    core_bounds = ([1639650, 1639750], [1454550, 1454650])
+
+    array_reference = run_reference(ini_las, core_bounds=core_bounds)
+    array_filter = run_filter(ini_las, src_bounds=str(core_bounds), threads=threads)
+
+    for dim in MARKERS:
+        assert np.array_equal(array_reference[dim], array_filter[dim]), dim
+
+
+@pytest.mark.parametrize("reset_tags", [False, True])
+def test_mnx_marking_input_markers(reset_tags):
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.mnx_marking")
+
+    with tempfile.NamedTemporaryFile(suffix="_markers.las") as las_markers:
+        # input with markers already set (to 1 on the points of a few classes)
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.ferry(dimensions="=>" + ", =>".join(MARKERS))
+        pipeline |= pdal.Filter.assign(
+            value=[
+                f"{dim} = 1 WHERE Classification == {2 + i % 5}" for i, dim in enumerate(MARKERS)
+            ]
+        )
+        pipeline |= pdal.Writer.las(
+            filename=las_markers.name, extra_dims="all", forward="all", minor_version="4"
+        )
+        pipeline.execute()
+
+        array_reference = run_reference(las_markers.name, reset_tags=reset_tags)
+        array_filter = run_filter(las_markers.name, reset_tags=reset_tags)
+
+    for dim in MARKERS:
+        assert np.array_equal(array_reference[dim], array_filter[dim]), dim
+
+
+def test_mnx_marking_temporary_dimensions():
+    ini_las = "test/data/4_6.las"
+    utils.pdal_has_plugin("filters.mnx_marking")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.mnx_marking(dtm_dimension="dtm", dsm_dimension="dsm")
+    pipeline.execute()
+    dims = pipeline.arrays[0].dtype.names
+
+    assert "dtm" in dims and "dsm" in dims
+    assert not any(dim in dims for dim in MARKERS)
@@ -320,3 +320,274 @@ def test_radius_assign_2d_cylinder(limit_z_above, limit_z_below):
     )
 
     assert nb_pts_radius_2d_cylinder == nb_points_take_2d
+
+
+def run_filter_on_las(ini_las, **radius_assign_options):
+    """Run radius_assign on a las file with ground points as source and vegetation as reference"""
+    filter = "filters.radius_assign"
+    utils.pdal_has_plugin(filter)
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.ferry(dimensions="=>SRC_DOMAIN, =>REF_DOMAIN")
+    pipeline |= pdal.Filter.assign(
+        value=[
+            "SRC_DOMAIN = 1 WHERE Classification==2",
+            "REF_DOMAIN = 1 WHERE Classification==4 || Classification==5",
+        ]
+    )
+    pipeline |= pdal.Filter.radius_assign(
+        src_domain="SRC_DOMAIN",
+        reference_domain="REF_DOMAIN",
+        output_dimension="radius_search",
+        **radius_assign_options,
+    )
+    pipeline.execute()
+    return pipeline.arrays[0]
+
+
+@pytest.mark.parametrize("is3d, max2d_above, max2d_below", [(True, -1, -1), (False, 0.5, 0)])
+def test_radius_assign_threads(is3d, max2d_above, max2d_below):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(radius=1.25, is3d=is3d, max2d_above=max2d_above, max2d_below=max2d_below)
+
+    array_single = run_filter_on_las(ini_las, threads=1, **options)
+    array_multi = run_filter_on_las(ini_las, threads=4, **options)
+
+    assert np.count_nonzero(array_single["radius_search"]) > 0
+    assert np.array_equal(array_single["radius_search"], array_multi["radius_search"])
+
+
+@pytest.mark.parametrize(
+    "is3d, max2d_above, max2d_below", [(True, -1, -1), (False, -1, -1), (False, 0.5, 0)]
+)
+def test_radius_assign_grid_index(is3d, max2d_above, max2d_below):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(radius=1.25, is3d=is3d, max2d_above=max2d_above, max2d_below=max2d_below)
+
+    array_kdtree = run_filter_on_las(ini_las, index="kdtree", **options)
+    array_grid = run_filter_on_las(ini_las, index="grid", **options)
+
+    assert np.count_nonzero(array_kdtree["radius_search"]) > 0
+    assert np.array_equal(array_kdtree["radius_search"], array_grid["radius_search"])
+
+
+def test_radius_assign_expressions():
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(radius=1.25, is3d=False, max2d_above=0.5, max2d_below=0)
+
+    array_domains = run_filter_on_las(ini_las, **options)
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.ferry(dimensions="=>TAG")
+    pipeline |= pdal.Filter.radius_assign(
+        src_where="Classification==2",
+        ref_where="Classification==4 || Classification==5",
+        value="TAG = 1",
+        **options,
+    )
+    pipeline.execute()
+    array_expressions = pipeline.arrays[0]
+
+    # no scaffolding dimension is added
+    assert "SRC_DOMAIN" not in array_expressions.dtype.names
+    assert "REF_DOMAIN" not in array_expressions.dtype.names
+    assert "radius" not in array_expressions.dtype.names
+
+    assert np.count_nonzero(array_domains["radius_search"]) > 0
+    assert np.array_equal(array_domains["radius_search"], array_expressions["TAG"])
+
+
+def test_radius_assign_expressions_invalid():
+    utils.pdal_has_plugin("filters.radius_assign")
+    ini_las = "test/data/mnx/input/crop_1.laz"
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.radius_assign(
+        src_where="Classification==", ref_where="Classification==4"
+    )
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.radius_assign(
+        ref_where="Classification==4", value="UNKNOWN_DIMENSION = 1"
+    )
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
+
+
+@pytest.mark.parametrize("is3d, max2d_above, max2d_below", [(True, -1, -1), (False, 0.5, 0)])
+@pytest.mark.parametrize("index", ["kdtree", "grid"])
+def test_radius_assign_distance_dimension(index, is3d, max2d_above, max2d_below):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(index=index, is3d=is3d, max2d_above=max2d_above, max2d_below=max2d_below)
+
+    array = run_filter_on_las(ini_las, radius=1.5, distance_dimension="distance", **options)
+    distance = array["distance"]
+
+    # points with no neighbor (or not in the source domain) get the radius
+    assert np.all(distance[array["radius_search"] == 0] == 1.5)
+    assert np.all(distance[array["radius_search"] == 1] <= 1.5)
+
+    # any smaller radius becomes a threshold on the distance
+    for radius in [1, 1.25]:
+        array_radius = run_filter_on_las(ini_las, radius=radius, **options)
+        # the distances equal to the radius (up to the rounding of the square root) are ambiguous
+        unambiguous = np.abs(distance - radius) > 1e-9
+        assert np.count_nonzero(array_radius["radius_search"]) > 0
+        assert np.array_equal(
+            (distance < radius)[unambiguous], (array_radius["radius_search"] == 1)[unambiguous]
+        )
+
+
+@pytest.mark.parametrize("index", ["kdtree", "grid"])
+def test_radius_assign_index_cache(index):
+    utils.pdal_has_plugin("filters.radius_assign")
+    ini_las = "test/data/mnx/input/crop_1.laz"
+
+    def run(index_cache_size):
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.ferry(dimensions="=>TAG1, =>TAG2, =>TAG3")
+        ref = "Classification==4 || Classification==5"
+        # same reference points: the index of the first stage is reused by the second one
+        for tag, src in [("TAG1", "Classification==2"), ("TAG2", "Classification==3")]:
+            pipeline |= pdal.Filter.radius_assign(
+                src_where=src,
+                ref_where=ref,
+                value=f"{tag} = 1",
+                radius=1,
+                index=index,
+                index_cache_size=index_cache_size,
+            )
+        # the reference points are modified: the index is built again
+        pipeline |= pdal.Filter.assign(value="Classification = 1 WHERE Classification==5")
+        pipeline |= pdal.Filter.radius_assign(
+            src_where="Classification==2",
+            ref_where=ref,
+            value="TAG3 = 1",
+            radius=1,
+            index=index,
+            index_cache_size=index_cache_size,
+        )
+        pipeline.execute()
+        return pipeline.arrays[0], utils.find_metadata_values(pipeline.metadata, "index_cache_hit")
+
+    array_no_cache, hits_no_cache = run(0)
+    array_cache, hits_cache = run(256)
+
+    assert hits_no_cache == []
+    assert sorted(str(h).lower() for h in hits_cache) == ["false", "false", "true"]
+    for tag in ["TAG1", "TAG2", "TAG3"]:
+        assert np.count_nonzero(array_cache[tag]) > 0
+        assert np.array_equal(array_no_cache[tag], array_cache[tag])
+
+
+@pytest.mark.parametrize("index", ["kdtree", "grid"])
+@pytest.mark.parametrize(
+    "is3d, max2d_above, max2d_below", [(True, -1, -1), (False, -1, -1), (False, 0.5, 0)]
+)
+def test_radius_assign_search_from(index, is3d, max2d_above, max2d_below):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(
+        radius=1.25, is3d=is3d, max2d_above=max2d_above, max2d_below=max2d_below, index=index
+    )
+
+    array_src = run_filter_on_las(ini_las, search_from="src", **options)
+    array_ref = run_filter_on_las(ini_las, search_from="ref", threads=3, **options)
+    array_auto = run_filter_on_las(ini_las, **options)
+
+    assert np.count_nonzero(array_src["radius_search"]) > 0
+    assert np.array_equal(array_src["radius_search"], array_ref["radius_search"])
+    assert np.array_equal(array_src["radius_search"], array_auto["radius_search"])
+
+
+@pytest.mark.parametrize("search_from", ["src", "ref"])
+def test_radius_assign_query_order(search_from):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(radius=1.25, is3d=False, max2d_above=0.5, max2d_below=0, threads=3)
+
+    array_file = run_filter_on_las(ini_las, query_order="file", search_from=search_from, **options)
+    array_morton = run_filter_on_las(
+        ini_las, query_order="morton", search_from=search_from, **options
+    )
+
+    assert np.count_nonzero(array_file["radius_search"]) > 0
+    assert np.array_equal(array_file["radius_search"], array_morton["radius_search"])
+
+
+@pytest.mark.parametrize("search_from", ["src", "ref"])
+def test_radius_assign_src_bounds(search_from):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(radius=1.25, search_from=search_from)
+
+    array_all = run_filter_on_las(ini_las, **options)
+    xmin, xmax = float(np.min(array_all["X"])), float(np.max(array_all["X"]))
+    ymin, ymax = float(np.min(array_all["Y"])), float(np.max(array_all["Y"]))
+    # the left half of the points
+    bounds = ([xmin, (xmin + xmax) / 2], [ymin, ymax])
+    array_bounds = run_filter_on_las(ini_las, src_bounds=str(bounds), **options)
+
+    inside = array_all["X"] <= bounds[0][1]
+    assert np.count_nonzero(array_all["radius_search"][inside]) > 0
+    assert np.count_nonzero(array_all["radius_search"][~inside]) > 0
+    # the points inside are searched with all the reference points, the other ones are not searched
+    assert np.array_equal(
+        array_all["radius_search"][inside], array_bounds["radius_search"][inside]
+    )
+    assert np.count_nonzero(array_bounds["radius_search"][~inside]) == 0
+
+
+@pytest.mark.parametrize("search_from", ["src", "ref"])
+def test_radius_assign_metadata_counters(search_from):
+    utils.pdal_has_plugin("filters.radius_assign")
+    ini_las = "test/data/mnx/input/crop_1.laz"
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.radius_assign(
+        src_where="Classification==2",
+        ref_where="Classification==4 || Classification==5",
+        output_dimension="radius_search",
+        radius=1,
+        search_from=search_from,
+        threads=2,
+    )
+    pipeline.execute()
+    array = pipeline.arrays[0]
+
+    def value(key):
+        values = utils.find_metadata_values(pipeline.metadata, key)
+        assert len(values) == 1
+        return float(values[0])
+
+    assert value("points_scanned") == len(array)
+    assert value("src_points") == np.count_nonzero(array["Classification"] == 2)
+    assert value("ref_points") == np.count_nonzero(np.isin(array["Classification"], [4, 5]))
+    assert value("hits") == np.count_nonzero(array["radius_search"]) > 0
+    assert value("neighbors_visited") >= value("neighbors_visited_max") > 0
+    assert value("index_build_time") >= 0
+    assert value("query_time") >= 0
+
+
+@pytest.mark.parametrize("view_threads", [1, 3])
+def test_radius_assign_several_views(view_threads):
+    utils.pdal_has_plugin("filters.radius_assign")
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    options = dict(
+        src_where="Classification==2",
+        ref_where="Classification==4 || Classification==5",
+        output_dimension="radius_search",
+        radius=1,
+    )
+
+    # the views are searched independently: each chip gets the result of the filter on its own
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.chipper(capacity=20000)
+    pipeline |= pdal.Filter.radius_assign(view_threads=view_threads, **options)
+    pipeline.execute()
+    assert len(pipeline.arrays) > 1
+
+    for chip in pipeline.arrays:
+        chip_pipeline = pdal.Filter.radius_assign(**options).pipeline(chip)
+        chip_pipeline.execute()
+        assert np.array_equal(chip["radius_search"], chip_pipeline.arrays[0]["radius_search"])
+    assert sum(np.count_nonzero(chip["radius_search"]) for chip in pipeline.arrays) > 0
@@ -0,0 +1,159 @@
+import json
+from test import utils
+
+import numpy as np
+import pdal
+import pytest
+
+RULES = [
+    # two rules sharing the same index
+    dict(src_domain="SRC_GROUND", reference_domain="REF_VEG", radius=1, output_dimension="OUT_A"),
+    dict(
+        src_domain="SRC_GROUND",
+        reference_domain="REF_VEG",
+        radius=1,
+        max2d_above=0.5,
+        max2d_below=0,
+        output_dimension="OUT_B",
+    ),
+    # rules that depend on the output of a previous rule
+    dict(src_domain="OUT_A", reference_domain="REF_VEG", radius=1.5, output_dimension="OUT_C"),
+    dict(
+        src_domain="SRC_GROUND",
+        reference_domain="OUT_C",
+        radius=1,
+        is3d=True,
+        output_dimension="OUT_D",
+    ),
+]
+
+
+def build_domains_pipeline(ini_las):
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+    pipeline |= pdal.Filter.ferry(dimensions="=>SRC_GROUND, =>REF_VEG")
+    pipeline |= pdal.Filter.assign(
+        value=[
+            "SRC_GROUND = 1 WHERE Classification==2",
+            "REF_VEG = 1 WHERE Classification==4 || Classification==5",
+        ]
+    )
+    return pipeline
+
+
+@pytest.mark.parametrize("index, threads", [("kdtree", 1), ("grid", 1), ("kdtree", 4)])
+def test_radius_assign_multi_same_as_chained_radius_assign(index, threads):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    utils.pdal_has_plugin("filters.radius_assign_multi")
+
+    pipeline_chained = build_domains_pipeline(ini_las)
+    for rule in RULES:
+        pipeline_chained |= pdal.Filter.radius_assign(**rule)
+    pipeline_chained.execute()
+    array_chained = pipeline_chained.arrays[0]
+
+    pipeline_multi = build_domains_pipeline(ini_las)
+    pipeline_multi |= pdal.Filter.radius_assign_multi(
+        rules=json.dumps(RULES), index=index, threads=threads
+    )
+    pipeline_multi.execute()
+    array_multi = pipeline_multi.arrays[0]
+
+    for rule in RULES:
+        dim = rule["output_dimension"]
+        assert np.count_nonzero(array_chained[dim]) > 0
+        assert np.array_equal(array_chained[dim], array_multi[dim])
+
+
+def test_radius_assign_multi_invalid_rule():
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    pipeline = build_domains_pipeline(ini_las)
+    pipeline |= pdal.Filter.radius_assign_multi(
+        rules=json.dumps([dict(src_domain="SRC_GROUND", radius=1, output_dimension="OUT")])
+    )
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
+
+
+RULES_SHARED_LISTS = RULES + [
+    # same source points and radius as the first rules, other references (in another pass)
+    dict(
+        src_domain="SRC_GROUND", reference_domain="SRC_GROUND", radius=1, output_dimension="OUT_E"
+    ),
+    dict(
+        src_domain="SRC_GROUND",
+        reference_domain="OUT_C",
+        radius=1,
+        max2d_below=0.5,
+        output_dimension="OUT_F",
+    ),
+]
+
+
+@pytest.mark.parametrize("neighbor_cache_size, threads", [(1024, 1), (1024, 3), (1, 1)])
+def test_radius_assign_multi_neighbor_cache(neighbor_cache_size, threads):
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    utils.pdal_has_plugin("filters.radius_assign_multi")
+
+    arrays = []
+    for cache_size in [0, neighbor_cache_size]:
+        pipeline = build_domains_pipeline(ini_las)
+        pipeline |= pdal.Filter.radius_assign_multi(
+            rules=json.dumps(RULES_SHARED_LISTS),
+            threads=threads,
+            neighbor_cache_size=cache_size,
+        )
+        pipeline.execute()
+        arrays.append(pipeline.arrays[0])
+
+    for rule in RULES_SHARED_LISTS:
+        dim = rule["output_dimension"]
+        assert np.count_nonzero(arrays[0][dim]) > 0
+        assert np.array_equal(arrays[0][dim], arrays[1][dim])
+
+
+RULES_WHERE = [
+    # independent rules, in a single pass
+    dict(
+        src_where="Classification==2",
+        ref_where="Classification==4 || Classification==5",
+        radius=1.5,
+        value="OUT_A=1",
+    ),
+    dict(
+        src_where="Classification==2 && Z>0",
+        ref_where="Classification==6",
+        radius=1.25,
+        value="OUT_B=1",
+        src_bounds="([-1e9, 1e9], [-1e9, 1e9])",
+    ),
+    # reads the assignments of the previous rules
+    dict(
+        src_where="Classification==2 && OUT_A==0 && OUT_B==0",
+        ref_where="Classification==2 && OUT_A==1",
+        radius=1,
+        value="OUT_C=1",
+    ),
+]
+
+
+def test_radius_assign_multi_where_same_as_chained_radius_assign():
+    ini_las = "test/data/mnx/input/crop_1.laz"
+    utils.pdal_has_plugin("filters.radius_assign_multi")
+
+    arrays = []
+    for multi in [False, True]:
+        pipeline = pdal.Pipeline() | pdal.Reader.las(filename=ini_las)
+        pipeline |= pdal.Filter.ferry(dimensions="=>OUT_A, =>OUT_B, =>OUT_C")
+        if multi:
+            pipeline |= pdal.Filter.radius_assign_multi(rules=json.dumps(RULES_WHERE))
+        else:
+            for rule in RULES_WHERE:
+                pipeline |= pdal.Filter.radius_assign(**rule)
+        pipeline.execute()
+        arrays.append(pipeline.arrays[0])
+
+    # no output dimension is added with a value
+    assert "radius" not in arrays[1].dtype.names
+    for dim in ["OUT_A", "OUT_B", "OUT_C"]:
+        assert np.count_nonzero(arrays[0][dim]) > 0
+        assert np.array_equal(arrays[0][dim], arrays[1][dim])
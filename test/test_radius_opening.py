@@ -0,0 +1,100 @@
+from test import utils
+
+import numpy as np
+import pdal
+import pytest
+
+INPUT_LAS = "test/data/mnx/input/crop_1.laz"
+
+# (marking options, cleanup options, condition of the cleanup)
+CASES = [
+    # ground points inside the vegetation
+    (
+        dict(src="Classification==2", ref="Classification==4 || Classification==5", radius=1),
+        dict(radius=1),
+        "Classification==2",
+    ),
+    # points under the vegetation, with Z limits
+    (
+        dict(
+            src="Classification==3 || Classification==6",
+            ref="Classification==4 || Classification==5",
+            radius=1.25,
+            max2d_above=-1,
+            max2d_below=0,
+        ),
+        dict(radius=1, max2d_above=0.5, max2d_below=0.5),
+        "Classification==3 || Classification==6",
+    ),
+]
+
+
+def marker_pipeline():
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS)
+    pipeline |= pdal.Filter.ferry(dimensions="=>MARKER")
+    # points already marked before the filter
+    pipeline |= pdal.Filter.assign(value="MARKER = 1 WHERE Classification==4")
+    return pipeline
+
+
+@pytest.mark.parametrize("marking, cleanup, condition_cleanup", CASES)
+@pytest.mark.parametrize("index, threads", [("kdtree", 1), ("grid", 1), ("kdtree", 3)])
+def test_radius_opening_same_as_two_radius_assign(
+    marking, cleanup, condition_cleanup, index, threads
+):
+    utils.pdal_has_plugin("filters.radius_opening")
+
+    pipeline_chained = marker_pipeline()
+    pipeline_chained |= pdal.Filter.radius_assign(
+        src_where=marking["src"],
+        ref_where=marking["ref"],
+        value="MARKER = 1",
+        radius=marking["radius"],
+        max2d_above=marking.get("max2d_above", -1),
+        max2d_below=marking.get("max2d_below", -1),
+    )
+    pipeline_chained |= pdal.Filter.radius_assign(
+        src_where=f"MARKER==1 && ({condition_cleanup})",
+        ref_where=f"MARKER==0 && ({condition_cleanup})",
+        value="MARKER = 0",
+        radius=cleanup["radius"],
+        max2d_above=cleanup.get("max2d_above", -1),
+        max2d_below=cleanup.get("max2d_below", -1),
+    )
+    pipeline_chained.execute()
+    array_chained = pipeline_chained.arrays[0]
+
+    pipeline_opening = marker_pipeline()
+    pipeline_opening |= pdal.Filter.radius_opening(
+        src_where=marking["src"],
+        ref_where=marking["ref"],
+        output_dimension="MARKER",
+        radius=marking["radius"],
+        max2d_above=marking.get("max2d_above", -1),
+        max2d_below=marking.get("max2d_below", -1),
+        cleanup_where=condition_cleanup,
+        cleanup_radius=cleanup["radius"],
+        cleanup_max2d_above=cleanup.get("max2d_above", -1),
+        cleanup_max2d_below=cleanup.get("max2d_below", -1),
+        index=index,
+        threads=threads,
+    )
+    pipeline_opening.execute()
+    array_opening = pipeline_opening.arrays[0]
+
+    marked = np.count_nonzero(array_opening["MARKER"]) - np.count_nonzero(
+        array_opening["Classification"] == 4
+    )
+    assert marked > 0
+    assert np.array_equal(array_chained["MARKER"], array_opening["MARKER"])
+
+
+def test_radius_opening_invalid_expression():
+    utils.pdal_has_plugin("filters.radius_opening")
+
+    pipeline = pdal.Pipeline() | pdal.Reader.las(filename=INPUT_LAS)
+    pipeline |= pdal.Filter.radius_opening(
+        src_where="Classification==2", ref_where="UNKNOWN==1", output_dimension="MARKER"
+    )
+    with pytest.raises(RuntimeError):
+        pipeline.execute()
@@ -7,3 +7,18 @@ def pdal_has_plugin(name_filter):
     result = subprocess.run(["pdal", "--drivers"], stdout=subprocess.PIPE)
     if name_filter not in result.stdout.decode("utf-8"):
         raise ValueError("Filter " + name_filter + " not found by `pdal --drivers`.")
+
+
+def find_metadata_values(metadata, key):
+    """List all the values of a key in the (nested) metadata of a pipeline"""
+    values = []
+    if isinstance(metadata, dict):
+        for k, v in metadata.items():
+            if k == key:
+                values.append(v)
+            else:
+                values += find_metadata_values(v, key)
+    elif isinstance(metadata, list):
+        for v in metadata:
+            values += find_metadata_values(v, key)
+    return values